@@ -0,0 +1,112 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+# longest a getUpdates request is held open, whatever timeout the bot asks for
+MAX_POLL_TIMEOUT = 30
+
+
+class FakeBotApi:
+    # A local stand-in for the Telegram Bot API, for any bot key: getUpdates hands out the updates queued with
+    # enqueue() (long polling like telegram), sendMessage is recorded with the time it arrived, and every other
+    # method answers ok. Runs on its own threads until close().
+    def __init__(self, host='127.0.0.1', port=0):
+        self.updates = []
+        # (time, chat id, text) of every sendMessage
+        self.messages = []
+        # {method: number of calls}
+        self.calls = {}
+        self.polls = 0
+        self._condition = threading.Condition()
+        handler = type('FakeBotApiHandler', (_BotApiHandler,), {'api': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.server.block_on_close = False
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server.server_address[:2])
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-bot-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def enqueue(self, update):
+        # returns the time the update became available to the bot
+        with self._condition:
+            self.updates.append(update)
+            self._condition.notify_all()
+            return time.monotonic()
+
+    def take_messages(self):
+        # the recorded messages since the last call
+        with self._condition:
+            messages = self.messages
+            self.messages = []
+            return messages
+
+    def close(self):
+        with self._condition:
+            self._condition.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def call(self, method, params):
+        with self._condition:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Load Test', 'username': 'load_test_bot'}
+        if method == 'getUpdates':
+            return self._get_updates(int(params.get('offset') or 0), float(params.get('timeout') or 0))
+        if method == 'sendMessage':
+            chat_id = int(params['chat_id'])
+            with self._condition:
+                self.messages.append((time.monotonic(), chat_id, params.get('text', '')))
+                message_id = len(self.messages)
+            return {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'},
+                    'text': params.get('text', '')}
+        return True
+
+    def _get_updates(self, offset, timeout):
+        deadline = time.monotonic() + min(timeout, MAX_POLL_TIMEOUT)
+        with self._condition:
+            self.polls += 1
+            # telegram forgets the updates below the offset once it has been asked for it
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            while not self.updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return list(self.updates)
+
+
+class _BotApiHandler(BaseHTTPRequestHandler):
+    api = None
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if 'json' in (self.headers.get('Content-Type') or ''):
+            params = json.loads(body or b'{}')
+        else:
+            params = dict(parse_qsl(body.decode()))
+        self.send_result(self.path.rsplit('/', 1)[-1], params)
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        self.send_result(path.rsplit('/', 1)[-1], dict(parse_qsl(query)))
+
+    def send_result(self, method, params):
+        body = json.dumps({'ok': True, 'result': self.api.call(method, params)}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,126 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from benchmarks import fixtures
+
+# the coin whose price is the number of times page 1 was served, so a reply about it tells which fetch it came from
+PROBE_ID = 'load-test-probe'
+PROBE_SYMBOL = 'LTPROBE'
+_PROBE_RANK = len(fixtures.LISTED_COINS) + 1
+_PROBE_PRICE = b'"__probe_price__"'
+
+
+class FakeCoinGecko:
+    # A local stand-in for the CoinGecko /coins/markets and /exchange_rates endpoints, serving fixture pages (see
+    # fixtures.py). Faults can be changed while it runs: every request waits latency seconds (plus up to jitter
+    # more), then fails with a 500 with probability error_rate, or with a 429 and retry_after with probability
+    # rate_limit_rate. Page 1 lists the probe coin, see probe_age().
+    def __init__(self, pages, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0, retry_after=30,
+                 host='127.0.0.1', port=0, seed=None):
+        self.pages = dict(pages)
+        self.pages[1] = _add_probe(pages[1])
+        self.exchange_rates = fixtures.generate_exchange_rates()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        # time page 1 was served with each probe price, the first one at index 1
+        self.probe_served_at = [None]
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        handler = type('FakeCoinGeckoHandler', (_CoinGeckoHandler,), {'api': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.server.block_on_close = False
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server.server_address[:2])
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-coingecko', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'errors': self.errors, 'rate_limited': self.rate_limited,
+                    'page1_served': len(self.probe_served_at) - 1}
+
+    def symbols(self):
+        # the ticker symbols of the pages in ranking order, without the probe coin
+        pages = {page_number: body.replace(_PROBE_PRICE, b'1.0') for page_number, body in self.pages.items()}
+        return [symbol for symbol in fixtures.get_symbols(pages) if symbol != PROBE_SYMBOL.lower()]
+
+    def probe_age(self, probe_price, now):
+        # seconds since page 1 was served with probe_price, None for a price it never served
+        with self._lock:
+            version = int(round(probe_price))
+            if not 0 < version < len(self.probe_served_at):
+                return None
+            return now - self.probe_served_at[version]
+
+    def answer(self, path, page):
+        # (status, headers, body) of one request
+        with self._lock:
+            self.requests += 1
+            latency = self.latency + self._rng.uniform(0, self.jitter)
+            roll = self._rng.random()
+        time.sleep(latency)
+        with self._lock:
+            if roll < self.error_rate:
+                self.errors += 1
+                return 500, {}, b'{"error":"injected"}'
+            if roll < self.error_rate + self.rate_limit_rate:
+                self.rate_limited += 1
+                return 429, {'Retry-After': str(self.retry_after)}, b'{"status":{"error_code":429}}'
+            if path.endswith('/exchange_rates'):
+                return 200, {}, self.exchange_rates
+            body = self.pages.get(page, b'[]')
+            if page == 1:
+                self.probe_served_at.append(time.monotonic())
+                body = body.replace(_PROBE_PRICE, str(float(len(self.probe_served_at) - 1)).encode())
+            return 200, {}, body
+
+
+class _CoinGeckoHandler(BaseHTTPRequestHandler):
+    api = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            page = int(parse_qs(url.query).get('page', ['1'])[0])
+        except ValueError:
+            page = 0
+        status, headers, body = self.api.answer(url.path, page)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _add_probe(page):
+    # page 1 with the probe coin in place of the first generated coin, its price left as a placeholder
+    items = json.loads(page)
+    items[_PROBE_RANK - 1] = dict(items[_PROBE_RANK - 1], id=PROBE_ID, symbol=PROBE_SYMBOL.lower(),
+                                  name='Load Test Probe', current_price='__probe_price__')
+    return json.dumps(items).encode()
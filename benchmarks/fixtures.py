@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import random
+
+import requests
+
+from coingeckoapi import coingecko_api
+
+# coins at the top of the generated first page, so requests for the usual symbols and the BTC/ETH pairs resolve
+LISTED_COINS = (('bitcoin', 'btc', 60000.0), ('ethereum', 'eth', 3000.0), ('tether', 'usdt', 1.0),
+                ('binancecoin', 'bnb', 550.0), ('solana', 'sol', 150.0), ('ripple', 'xrp', 0.5),
+                ('dogecoin', 'doge', 0.15), ('cardano', 'ada', 0.45), ('litecoin', 'ltc', 80.0),
+                ('chainlink', 'link', 15.0))
+PAGE_SIZE = 250
+# {command: share of the messages}, roughly what the bot sees in a day
+DEFAULT_MIX = {'/p': 50, '/cap': 5, '/change': 15, '/compare': 10, '/top': 12, '/bottom': 8}
+CURRENCIES = ('EUR', 'GBP', 'JPY')
+WINDOWS = ('1h', '24h', '7d')
+
+
+def generate_pages(page_count=coingecko_api.PAGE_COUNT, seed=7):
+    # {page number: markets page body}, shaped like coingecko's /coins/markets answers, fields the bot ignores
+    # included. the same seed always gives the same bytes. short random symbols make some coins share a symbol,
+    # like on coingecko.
+    rng = random.Random(seed)
+    pages = {}
+    for page_number in range(1, page_count + 1):
+        items = []
+        for position in range(PAGE_SIZE):
+            rank = (page_number - 1) * PAGE_SIZE + position + 1
+            if rank <= len(LISTED_COINS):
+                coin_id, symbol, price = LISTED_COINS[rank - 1]
+            else:
+                symbol = ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 5)))
+                coin_id = '{}-{}'.format(symbol, rank)
+                price = rng.lognormvariate(0, 4)
+            items.append(_build_item(rng, rank, coin_id, symbol, price))
+        pages[page_number] = json.dumps(items).encode()
+    return pages
+
+
+def generate_exchange_rates():
+    # /exchange_rates body, units per BTC like coingecko's
+    usd_per_btc = LISTED_COINS[0][2]
+    rates = {'btc': {'name': 'Bitcoin', 'unit': 'BTC', 'value': 1.0, 'type': 'crypto'},
+             'usd': {'name': 'US Dollar', 'unit': '$', 'value': usd_per_btc, 'type': 'fiat'}}
+    for code, per_usd in zip(CURRENCIES, (0.92, 0.79, 155.0)):
+        rates[code.lower()] = {'name': code, 'unit': code, 'value': usd_per_btc * per_usd, 'type': 'fiat'}
+    return json.dumps({'rates': rates}).encode()
+
+
+def load_pages(directory):
+    # {page number: body} of the page_<n>.json files in directory, as written by record_pages()
+    pages = {}
+    for file_name in os.listdir(directory):
+        stem, extension = os.path.splitext(file_name)
+        if extension == '.json' and stem.startswith('page_') and stem[5:].isdigit():
+            with open(os.path.join(directory, file_name), 'rb') as page_file:
+                pages[int(stem[5:])] = page_file.read()
+    if not pages:
+        raise ValueError('No page_<n>.json files in {}'.format(directory))
+    return pages
+
+
+def record_pages(directory, page_count=coingecko_api.PAGE_COUNT, base_url=coingecko_api.API_BASE_URL):
+    # saves the live markets pages as page_<n>.json, mind the request budget of the api key
+    os.makedirs(directory, exist_ok=True)
+    session = requests.Session()
+    for page_number in range(1, page_count + 1):
+        response = session.get(coingecko_api._get_markets_url(base_url, page_number),
+                               timeout=coingecko_api.PAGE_TIMEOUT)
+        response.raise_for_status()
+        with open(os.path.join(directory, 'page_{}.json'.format(page_number)), 'wb') as page_file:
+            page_file.write(response.content)
+
+
+def get_symbols(pages):
+    # ticker symbols of the pages in ranking order, each symbol once
+    symbols = []
+    seen = set()
+    for page_number in sorted(pages):
+        for row in coingecko_api._parse_page(pages[page_number], 0, None):
+            if row.ticker_symbol not in seen:
+                seen.add(row.ticker_symbol)
+                symbols.append(row.ticker_symbol.lower())
+    return symbols
+
+
+def build_updates(symbols, count, mix=None, seed=7, chat_count=1000, first_update_id=1):
+    # count synthetic telegram updates with commands drawn from mix ({command: weight}). symbols are taken from the
+    # front of the list more often, the way requests cluster on the top coins. the updates come from chat_count
+    # private chats, or every one from its own chat (its update id) when chat_count is None.
+    rng = random.Random(seed)
+    mix = DEFAULT_MIX if mix is None else mix
+    commands = list(mix)
+    weights = [mix[command] for command in commands]
+    updates = []
+    for update_id in range(first_update_id, first_update_id + count):
+        command = rng.choices(commands, weights)[0]
+        chat_id = update_id if chat_count is None else rng.randint(1, chat_count)
+        updates.append({'update_id': update_id,
+                        'message': {'message_id': update_id, 'text': build_command(rng, command, symbols),
+                                    'from': {'id': chat_id}, 'chat': {'id': chat_id, 'type': 'private'}}})
+    return updates
+
+
+def build_command(rng, command, symbols):
+    # message text of one command with arguments the bot accepts
+    def pick():
+        return symbols[min(int(rng.paretovariate(1.2)) - 1, len(symbols) - 1)]
+
+    if command in ('/p', '/cap'):
+        roll = rng.random()
+        if roll < 0.15:
+            return '{} {}'.format(command, ' '.join(pick() for _ in range(rng.randint(2, 5))))
+        if roll < 0.25:
+            return '{} {} {}'.format(command, pick(), rng.choice(CURRENCIES).lower())
+        return '{} {}'.format(command, pick())
+    if command == '/change':
+        return '/change {}'.format(pick())
+    if command == '/compare':
+        return '/compare {}/{}'.format(pick(), pick())
+    if command in ('/top', '/bottom'):
+        if rng.random() < 0.7:
+            return command
+        return '{} {} {}'.format(command, rng.choice(WINDOWS), rng.choice((5, 10, 20)))
+    return command
+
+
+def parse_mix(text):
+    # '/p=50,/top=10' -> {'/p': 50, '/top': 10}
+    mix = {}
+    for part in text.split(','):
+        command, _, weight = part.strip().partition('=')
+        if not command.startswith('/') or not weight:
+            raise ValueError('Expected /command=weight, got \'{}\''.format(part))
+        mix[command] = float(weight)
+    return mix
+
+
+def _build_item(rng, rank, coin_id, symbol, price):
+    return {'id': coin_id, 'symbol': symbol, 'name': coin_id.replace('-', ' ').title(),
+            'image': 'https://assets.coingecko.com/coins/images/{}/large/{}.png'.format(rank, symbol),
+            'current_price': price, 'market_cap': price * rng.uniform(1e6, 1e9) / rank,
+            'market_cap_rank': rank, 'fully_diluted_valuation': None, 'total_volume': rng.uniform(0, 1e8) / rank,
+            'high_24h': price * 1.05, 'low_24h': price * 0.95, 'price_change_24h': price * 0.01,
+            'price_change_percentage_24h': rng.gauss(0, 5), 'market_cap_change_24h': None,
+            'market_cap_change_percentage_24h': rng.gauss(0, 5), 'circulating_supply': 1e7, 'total_supply': 2e7,
+            'max_supply': None, 'ath': price * 3, 'ath_change_percentage': -60.0,
+            'ath_date': '2021-11-10T14:24:11.849Z', 'atl': price / 100, 'atl_change_percentage': 9000.0,
+            'atl_date': '2015-10-20T00:00:00.000Z',
+            'roi': {'times': 1.5, 'currency': 'usd', 'percentage': 150.0} if rank % 3 == 0 else None,
+            'last_updated': '2024-05-01T12:00:00.000Z',
+            'price_change_percentage_1h_in_currency': rng.gauss(0, 1),
+            'price_change_percentage_24h_in_currency': rng.gauss(0, 5),
+            'price_change_percentage_7d_in_currency': rng.gauss(0, 10),
+            'price_change_percentage_30d_in_currency': rng.gauss(0, 20),
+            'price_change_percentage_1y_in_currency': rng.gauss(0, 100) if rank % 7 else None}
+
+
+def main():
+    # writes fixtures for run_benchmarks.py -fixtures, e.g.
+    # python benchmarks/fixtures.py -dir benchmarks/recorded -record
+    # without -record the pages are generated. -updates also writes synthetic updates, one per line, which
+    # cryptopricebot/post_updates.py can post to a bot in webhook mode.
+    cmd_args = _get_args()
+    if cmd_args.record:
+        record_pages(cmd_args.dir, cmd_args.pages)
+        pages = load_pages(cmd_args.dir)
+    else:
+        os.makedirs(cmd_args.dir, exist_ok=True)
+        pages = generate_pages(cmd_args.pages, cmd_args.seed)
+        for page_number, body in pages.items():
+            with open(os.path.join(cmd_args.dir, 'page_{}.json'.format(page_number)), 'wb') as page_file:
+                page_file.write(body)
+    if cmd_args.updates:
+        mix = parse_mix(cmd_args.mix) if cmd_args.mix else None
+        with open(cmd_args.updates, 'w') as updates_file:
+            for update in build_updates(get_symbols(pages), cmd_args.count, mix, cmd_args.seed):
+                updates_file.write(json.dumps(update) + '\n')
+    print('Wrote {} pages to {}'.format(len(pages), cmd_args.dir))
+
+
+def _get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-dir", required=True)
+    parser.add_argument("-record", action='store_true')
+    parser.add_argument("-pages", type=int, default=coingecko_api.PAGE_COUNT)
+    parser.add_argument("-seed", type=int, default=7)
+    parser.add_argument("-updates")
+    parser.add_argument("-count", type=int, default=1000)
+    # e.g. '/p=50,/change=15,/top=10'
+    parser.add_argument("-mix")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+import argparse
+import json
+import os
+import re
+import shlex
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks import fixtures
+from benchmarks.fake_bot_api import FakeBotApi
+from benchmarks.fake_coingecko import FakeCoinGecko, PROBE_SYMBOL
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_SCRIPT = os.path.join(REPO_ROOT, 'cryptopricebot', 'crypto_price_bot.py')
+BOT_KEY = '123456:load-test'
+# replies that mean the bot could not answer
+ERROR_REPLIES = ('Oops!', 'We are having some API connection issues')
+# a step is saturated when the bot answers less than this share of the offered rate, more than MAX_ERROR_RATE of the
+# messages go unanswered or fail, or the 95th percentile reply takes longer than max_latency seconds
+MIN_THROUGHPUT_SHARE = 0.95
+MAX_ERROR_RATE = 0.01
+MAX_LATENCY = 2.0
+# seconds between two probe requests, see fake_coingecko.FakeCoinGecko
+PROBE_INTERVAL = 1.0
+_PROBE_PRICE_PATTERN = re.compile(r'\({}\):\s*\$([0-9.]+)'.format(PROBE_SYMBOL))
+
+
+class LoadGenerator:
+    # Replays synthetic updates (see fixtures.build_updates()) through a FakeBotApi at a fixed rate and matches the
+    # bot's replies to them. Every update comes from its own chat, so a reply is matched by chat id and no request is
+    # merged with another one. Probe requests for the probe coin of the FakeCoinGecko are mixed in every
+    # probe_interval seconds, the price in their reply tells how old the bot's snapshot was.
+    def __init__(self, bot_api, coingecko, mix=None, probe_interval=PROBE_INTERVAL, max_latency=MAX_LATENCY,
+                 seed=7):
+        self.bot_api = bot_api
+        self.coingecko = coingecko
+        self.mix = mix
+        self.probe_interval = probe_interval
+        self.max_latency = max_latency
+        self.seed = seed
+        self.symbols = coingecko.symbols()
+        self.next_update_id = 1
+        # {chat id: (time the update was queued, command)} of the updates waiting for a reply
+        self._waiting = {}
+        self._replies = []
+        self._staleness = []
+
+    def wait_until_ready(self, timeout):
+        # blocks until the bot answers a probe from a snapshot, False if it did not within timeout seconds
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self._send_probe()
+            reply_deadline = min(time.monotonic() + 2, deadline)
+            while self._waiting and time.monotonic() < reply_deadline:
+                time.sleep(0.05)
+                self._collect()
+            if self._staleness:
+                self._waiting.clear()
+                return True
+        return False
+
+    def run_step(self, rate, duration, drain=15.0):
+        # sends rate messages a second for duration seconds, then waits up to drain seconds for the last replies
+        self._replies = []
+        self._staleness = []
+        self._waiting.clear()
+        coingecko_before = self.coingecko.stats()
+        count = max(int(rate * duration), 1)
+        updates = fixtures.build_updates(self.symbols, count, self.mix, seed=self.seed + self.next_update_id,
+                                         chat_count=None, first_update_id=self.next_update_id)
+        self.next_update_id += count
+        start = time.monotonic()
+        next_probe = start
+        for index, update in enumerate(updates):
+            delay = start + index / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if time.monotonic() >= next_probe:
+                self._send_probe()
+                next_probe += self.probe_interval
+            self._send(update)
+            if index % 50 == 0:
+                self._collect()
+        send_time = time.monotonic() - start
+        deadline = time.monotonic() + drain
+        while self._waiting and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self._collect()
+        self._collect()
+        coingecko_after = self.coingecko.stats()
+        return self._summarize_step(rate, count, start, send_time, {
+            name: coingecko_after[name] - coingecko_before[name] for name in coingecko_after})
+
+    def _send(self, update, command=None):
+        message = update['message']
+        command = message['text'].split()[0] if command is None else command
+        self._waiting[message['chat']['id']] = (self.bot_api.enqueue(update), command)
+
+    def _send_probe(self):
+        update_id = self.next_update_id
+        self.next_update_id += 1
+        self._send({'update_id': update_id,
+                    'message': {'message_id': update_id, 'text': '/p {}'.format(PROBE_SYMBOL.lower()),
+                                'from': {'id': update_id}, 'chat': {'id': update_id, 'type': 'private'}}}, 'probe')
+
+    def _collect(self):
+        for received_at, chat_id, text in self.bot_api.take_messages():
+            sent = self._waiting.pop(chat_id, None)
+            if sent is None:
+                # a reply to an earlier step
+                continue
+            sent_at, command = sent
+            error = text.startswith(ERROR_REPLIES)
+            if command == 'probe':
+                match = _PROBE_PRICE_PATTERN.search(text)
+                age = self.coingecko.probe_age(float(match.group(1)), received_at) if match else None
+                if age is not None:
+                    self._staleness.append(age)
+            else:
+                self._replies.append((command, received_at - sent_at, received_at, error))
+
+    def _summarize_step(self, rate, count, start, send_time, coingecko):
+        latencies = [latency for _, latency, _, error in self._replies if not error]
+        errors = sum(1 for _, _, _, error in self._replies if error)
+        missing = sum(1 for _, command in self._waiting.values() if command != 'probe')
+        last_reply = max((received_at for _, _, received_at, _ in self._replies), default=start)
+        throughput = len(latencies) / max(last_reply - start, count / rate)
+        error_rate = (errors + missing) / count
+        step = {'rate': rate, 'sent': count, 'offered_rate': count / max(send_time, 1e-9), 'replied': len(latencies),
+                'error_replies': errors, 'missing': missing, 'error_rate': error_rate, 'throughput': throughput,
+                'latency_ms': _percentiles(latencies, 1000), 'commands': {}, 'coingecko': coingecko,
+                'staleness_s': dict(_percentiles(self._staleness), probes=len(self._staleness))}
+        for command in sorted({command for command, _, _, _ in self._replies}):
+            command_latencies = [latency for name, latency, _, error in self._replies if name == command and not error]
+            step['commands'][command] = dict(_percentiles(command_latencies, 1000), count=len(command_latencies))
+        p95 = step['latency_ms'].get('p95')
+        step['saturated'] = throughput < MIN_THROUGHPUT_SHARE * rate or error_rate > MAX_ERROR_RATE or \
+            p95 is None or p95 > self.max_latency * 1000
+        return step
+
+
+def start_bot(bot_api_url, coingecko_url, workdir, bot_args=()):
+    # runs crypto_price_bot.py as it is deployed, only pointed at the local servers. logs go to workdir
+    os.makedirs(workdir, exist_ok=True)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(path for path in (REPO_ROOT, env.get('PYTHONPATH')) if path)
+    command = [sys.executable, BOT_SCRIPT, '-botkey', BOT_KEY, '-botapiurl', bot_api_url, '-coingeckourl',
+               coingecko_url, '-runtime', 'async'] + list(bot_args)
+    output = open(os.path.join(workdir, 'bot.out'), 'wb')
+    try:
+        return subprocess.Popen(command, cwd=workdir, env=env, stdout=output, stderr=subprocess.STDOUT)
+    finally:
+        output.close()
+
+
+def stop_bot(process, timeout=40):
+    if process.poll() is not None:
+        return process.returncode
+    process.send_signal(signal.SIGTERM)
+    try:
+        return process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        return process.wait()
+
+
+def run(rates, duration, pages=None, mix=None, drain=15.0, bot_args=(), workdir=None, ready_timeout=120,
+        probe_interval=PROBE_INTERVAL, max_latency=MAX_LATENCY, coingecko_faults=None, logger=None):
+    # the report of one load test: a bot process is started against fresh stand-in servers and every rate in rates
+    # is run for duration seconds, lowest first. coingecko_faults are FakeCoinGecko options like latency.
+    pages = fixtures.generate_pages() if pages is None else pages
+    coingecko = FakeCoinGecko(pages, **(coingecko_faults or {})).start()
+    bot_api = FakeBotApi().start()
+    temp_dir = None
+    if workdir is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix='cpb-load-test-')
+        workdir = temp_dir.name
+    process = start_bot(bot_api.url, coingecko.url, workdir, bot_args)
+    steps = []
+    try:
+        generator = LoadGenerator(bot_api, coingecko, mix, probe_interval, max_latency)
+        if not generator.wait_until_ready(ready_timeout):
+            with open(os.path.join(workdir, 'bot.out'), 'rb') as output_file:
+                output = output_file.read().decode(errors='replace')[-2000:]
+            raise RuntimeError('The bot did not answer within {} seconds:\n{}'.format(ready_timeout, output))
+        for rate in sorted(rates):
+            step = generator.run_step(rate, duration, drain)
+            steps.append(step)
+            if logger is not None:
+                logger(_describe_step(step))
+    finally:
+        stop_bot(process)
+        bot_api.close()
+        coingecko.close()
+        if temp_dir is not None:
+            temp_dir.cleanup()
+    sustained = [step['rate'] for step in steps if not step['saturated']]
+    saturated = [step['rate'] for step in steps if step['saturated']]
+    return {'created_at': time.time(), 'duration': duration, 'bot_args': list(bot_args),
+            'coingecko_faults': coingecko_faults or {}, 'steps': steps,
+            'max_sustained_rate': max(sustained) if sustained else None,
+            'saturated_at': min(saturated) if saturated else None}
+
+
+def _percentiles(values, scale=1):
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * scale
+    return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99), 'max': float(np.max(values) * scale)}
+
+
+def _describe_step(step):
+    latency = step['latency_ms']
+    staleness = step['staleness_s']
+    return '{:>7.1f} msgs/s: {:>7.1f} replies/s, latency p50 {} p95 {} p99 {} ms, errors {:.1%} ({} missing), ' \
+           'staleness p50 {} max {} s{}'.format(step['rate'], step['throughput'], _format(latency.get('p50')),
+                                                _format(latency.get('p95')), _format(latency.get('p99')),
+                                                step['error_rate'], step['missing'], _format(staleness.get('p50')),
+                                                _format(staleness.get('max')),
+                                                ', saturated' if step['saturated'] else '')
+
+
+def _format(value):
+    return '-' if value is None else '{:.1f}'.format(value)
+
+
+def main():
+    # starts a bot process against a fake Bot API and a fake CoinGecko and finds how many messages a second it
+    # keeps up with, e.g.
+    # python benchmarks/load_test.py -rates 5,10,20,40 -duration 30 -output load.json
+    # python benchmarks/load_test.py -rates 10 -cglatency 2 -cg429 0.2 -botargs '-cgbudget 60'
+    # replies go out at most 30 a second, the bot's own telegram limit (see send_throttle.py)
+    cmd_args = _get_args()
+    faults = {'latency': cmd_args.cglatency, 'jitter': cmd_args.cgjitter, 'error_rate': cmd_args.cgerrors,
+              'rate_limit_rate': cmd_args.cg429, 'retry_after': cmd_args.cgretryafter}
+    report = run([float(rate) for rate in cmd_args.rates.split(',')], cmd_args.duration,
+                 fixtures.load_pages(cmd_args.fixtures) if cmd_args.fixtures else None,
+                 fixtures.parse_mix(cmd_args.mix) if cmd_args.mix else None, cmd_args.drain,
+                 shlex.split(cmd_args.botargs), cmd_args.workdir, cmd_args.readytimeout, cmd_args.probeinterval,
+                 cmd_args.maxlatency, faults, logger=print)
+    print('Max sustained rate: {} msgs/s, saturated at: {} msgs/s'.format(report['max_sustained_rate'],
+                                                                          report['saturated_at']))
+    if cmd_args.output:
+        with open(cmd_args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+
+
+def _get_args():
+    parser = argparse.ArgumentParser()
+    # comma separated messages per second, each run for -duration seconds
+    parser.add_argument("-rates", default='10')
+    parser.add_argument("-duration", type=float, default=30)
+    # seconds to wait for the last replies of a step
+    parser.add_argument("-drain", type=float, default=15)
+    # e.g. '/p=50,/change=15,/top=10', see fixtures.py
+    parser.add_argument("-mix")
+    parser.add_argument("-fixtures")
+    # faults of the fake coingecko: seconds of latency (plus up to -cgjitter more), and the share of requests
+    # answered with a 500 or a 429
+    parser.add_argument("-cglatency", type=float, default=0.0)
+    parser.add_argument("-cgjitter", type=float, default=0.0)
+    parser.add_argument("-cgerrors", type=float, default=0.0)
+    parser.add_argument("-cg429", type=float, default=0.0)
+    parser.add_argument("-cgretryafter", type=int, default=30)
+    # more arguments for crypto_price_bot.py, e.g. '-runtime threaded' or '-maxconcurrency 64'
+    parser.add_argument("-botargs", default='')
+    # where the bot's logs are kept, a temporary directory otherwise
+    parser.add_argument("-workdir")
+    parser.add_argument("-readytimeout", type=float, default=120)
+    parser.add_argument("-probeinterval", type=float, default=PROBE_INTERVAL)
+    # p95 reply latency in seconds above which a step counts as saturated
+    parser.add_argument("-maxlatency", type=float, default=MAX_LATENCY)
+    parser.add_argument("-output")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
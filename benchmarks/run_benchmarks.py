@@ -0,0 +1,352 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks import fixtures
+from coingeckoapi import coingecko_api
+from cryptodata import price_req_repo
+from cryptodata.data_models import Base
+from cryptodata.dimension_cache import DimensionCache
+from cryptodata.price_req_writer import PriceRequestWriter
+from cryptopricebot import crypto_price_bot
+from cryptopricebot.async_runtime import _Update
+from cryptopricebot.reply_cache import ReplyCache
+from cryptopricebot.request_coalescer import RequestCoalescer
+from cryptoshared.ticker_snapshot import TickerSnapshot
+
+FORMAT_VERSION = 1
+# a metric is a regression when it is this much worse than in the baseline
+TOLERANCE = 0.2
+# metrics whose baseline is below this are left out of comparisons, they are mostly timer noise
+NOISE_FLOOR = 0.01
+# metrics that describe the input rather than performance
+_COUNTS = ('rows',)
+# the tail of sub-millisecond timings moves with whatever else runs on the machine, so it is only compared on request
+_TAILS = ('p95_ms', 'p99_ms')
+# handler latency is measured for these commands, with an empty reply cache and with every reply cached
+HANDLER_COMMANDS = ('/p', '/change', '/compare', '/top', '/bottom')
+HANDLERS = {'/p': crypto_price_bot._get_price, '/cap': crypto_price_bot._get_market_cap,
+            '/change': crypto_price_bot._get_change, '/compare': crypto_price_bot._compare,
+            '/top': crypto_price_bot._top_ten, '/bottom': crypto_price_bot._bottom_ten}
+BENCHMARKS = ('parse', 'refresh', 'handlers', 'db')
+
+
+def run(pages, benchmarks=BENCHMARKS, repeat=20, updates_per_command=500, db_requests=500, logger=None):
+    # {benchmark name: {metric: value}} for the selected groups of benchmarks. metrics ending in _per_sec are better
+    # when higher, every other one when lower.
+    results = {}
+    if 'parse' in benchmarks:
+        results.update(bench_parse(pages, repeat))
+    if 'refresh' in benchmarks:
+        results.update(bench_refresh(pages, repeat))
+    if 'handlers' in benchmarks:
+        results.update(bench_handlers(pages, updates_per_command, repeat))
+    if 'db' in benchmarks:
+        results.update(bench_db(db_requests))
+    if logger is not None:
+        for name, metrics in results.items():
+            logger.info('{}: {}'.format(name, ', '.join('{} {:.4g}'.format(metric, value)
+                                                       for metric, value in metrics.items())))
+    return results
+
+
+def bench_parse(pages, repeat):
+    # the cpu side of a refresh: decoding the page bodies into rows, then building the snapshot from them. once from
+    # scratch and once from the previous snapshot, which is how every refresh after the first one builds it. the
+    # snapshot timings leave out the decoding, which parse_pages already covers and which would drown them out
+    def parse():
+        shadowed = []
+        parsed = {page_number: coingecko_api._parse_page(body, 0, None) for page_number, body in pages.items()}
+        return coingecko_api._merge_pages(parsed, shadowed), shadowed
+
+    rows, shadowed = parse()
+
+    def build():
+        return TickerSnapshot.from_rows(rows, 1, shadowed=shadowed)
+
+    # the top page moved since the previous refresh
+    moved = [row._replace(usd_price=row.usd_price * 1.01) if position < fixtures.PAGE_SIZE else row
+             for position, row in enumerate(rows)]
+    previous = TickerSnapshot.from_rows(moved, 1, shadowed=shadowed)
+    previous.search_index
+
+    def rebuild():
+        snapshot = TickerSnapshot.from_rows(rows, 2, shadowed=shadowed, previous=previous)
+        snapshot.search_index
+        return snapshot
+
+    results = {'parse_pages': _measure(parse, repeat), 'build_snapshot': _measure(build, repeat),
+               'rebuild_snapshot': _measure(rebuild, repeat)}
+    results['parse_pages']['rows'] = len(rows) + len(shadowed)
+    return results
+
+
+def bench_refresh(pages, repeat):
+    # get_all_tickers() against a local server answering with the fixture pages, so it includes http and the thread
+    # pool but no network
+    server = _serve_pages(pages)
+    base_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    try:
+        def refresh():
+            shadowed = []
+            tickers = coingecko_api.get_all_tickers(page_count=len(pages), base_url=base_url, shadowed=shadowed)
+            if not tickers:
+                raise RuntimeError('The fixture server returned no tickers')
+            return tickers
+
+        return {'get_all_tickers': _measure(refresh, repeat)}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def bench_handlers(pages, updates_per_command, repeat=1):
+    # the latency of the command handlers from the moment an update arrives until the reply is handed to telegram,
+    # which is only recorded here. the updates are handled repeat times over.
+    shadowed = []
+    parsed = {page_number: coingecko_api._parse_page(body, 0, None) for page_number, body in pages.items()}
+    rows = coingecko_api._merge_pages(parsed, shadowed)
+    rates = coingecko_api._parse_exchange_rates(json.loads(fixtures.generate_exchange_rates()))
+    snapshot = TickerSnapshot.from_rows(rows, 1, shadowed=shadowed, rates=rates)
+    # built when the bot publishes a snapshot, not by the first request that needs it
+    snapshot.search_index
+    symbols = fixtures.get_symbols(pages)
+    saved = {name: getattr(crypto_price_bot, name)
+             for name in ('logger', 'ticker_snapshot', 'reply_cache', 'request_coalescer', 'price_request_writer')}
+    results = {}
+    try:
+        # debug logging of every command is off in production
+        logger = logging.getLogger('benchmarks-bot')
+        logger.setLevel(logging.INFO)
+        crypto_price_bot.logger = logger
+        crypto_price_bot.ticker_snapshot = snapshot
+        crypto_price_bot.price_request_writer = None
+        # repeats of a request are answered, not merged
+        crypto_price_bot.request_coalescer = RequestCoalescer(window=0)
+        for command in HANDLER_COMMANDS:
+            updates = fixtures.build_updates(symbols, updates_per_command, {command: 1})
+            # every reply rendered, the worst case right after a refresh
+            results['handler{}_uncached'.format(command.replace('/', '_'))] = \
+                _summarize(_time_updates(command, updates * repeat, True))
+            crypto_price_bot.reply_cache = ReplyCache()
+            _time_updates(command, updates)
+            results['handler{}_cached'.format(command.replace('/', '_'))] = \
+                _summarize(_time_updates(command, updates * repeat))
+    finally:
+        for name, value in saved.items():
+            setattr(crypto_price_bot, name, value)
+    return results
+
+
+def bench_db(request_count):
+    # price request logging against a file backed sqlite db: one transaction per request with
+    # price_req_repo.log_price_request(), and the write-behind PriceRequestWriter the bot uses, from the first
+    # request queued until the last one is committed
+    symbols = [symbol for _, symbol, _ in fixtures.LISTED_COINS]
+    price_requests = [(number % 200, number % 150, symbols[number % len(symbols)]) for number in range(request_count)]
+    results = {}
+    with tempfile.TemporaryDirectory() as db_dir:
+        engine = create_engine('sqlite:///{}'.format(os.path.join(db_dir, 'benchmarks.db')))
+        try:
+            Base.metadata.create_all(engine)
+            session_maker = sessionmaker(bind=engine)
+            latencies = []
+            start = time.perf_counter()
+            for tg_user_id, tg_chat_id, ticker_symbol in price_requests:
+                request_start = time.perf_counter()
+                price_req_repo.log_price_request(session_maker, tg_user_id, tg_chat_id, ticker_symbol)
+                latencies.append(time.perf_counter() - request_start)
+            results['log_price_request'] = dict(_summarize(latencies),
+                                                requests_per_sec=request_count / (time.perf_counter() - start))
+
+            writer = PriceRequestWriter(session_maker, dimension_cache=DimensionCache()).start()
+            latencies = []
+            start = time.perf_counter()
+            for tg_user_id, tg_chat_id, ticker_symbol in price_requests:
+                request_start = time.perf_counter()
+                writer.log_price_request(tg_user_id, tg_chat_id, ticker_symbol)
+                latencies.append(time.perf_counter() - request_start)
+            writer.close()
+            elapsed = time.perf_counter() - start
+            if writer.written != request_count:
+                raise RuntimeError('The writer wrote {} of {} requests'.format(writer.written, request_count))
+            results['price_request_writer'] = dict(_summarize(latencies), requests_per_sec=request_count / elapsed)
+        finally:
+            engine.dispose()
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE, noise_floor=NOISE_FLOOR, tails=False):
+    # [(benchmark, metric, baseline value, value, relative change)] of the metrics that got worse by more than
+    # tolerance. the change is positive when worse, whichever way the metric goes. tail percentiles only count
+    # with tails.
+    regressions = []
+    for name, metrics in sorted(results.items()):
+        for metric, value in sorted(metrics.items()):
+            old_value = baseline.get(name, {}).get(metric)
+            if metric in _COUNTS or (metric in _TAILS and not tails) or old_value is None or \
+                    abs(old_value) < noise_floor:
+                continue
+            change = (value - old_value) / old_value
+            if metric.endswith('_per_sec'):
+                change = -change
+            if change > tolerance:
+                regressions.append((name, metric, old_value, value, change))
+    return regressions
+
+
+def build_report(results, repeat):
+    return {'format': FORMAT_VERSION, 'created_at': time.time(), 'python': platform.python_version(),
+            'machine': platform.machine(), 'repeat': repeat, 'results': results}
+
+
+def _measure(function, repeat):
+    # timings of repeat calls after a warm up call, the peak and the retained memory of one more call under
+    # tracemalloc, and the garbage collections per call
+    function()
+    gc.collect()
+    collections = sum(generation['collections'] for generation in gc.get_stats())
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+    collections = sum(generation['collections'] for generation in gc.get_stats()) - collections
+    gc.collect()
+    tracemalloc.start()
+    try:
+        # what is still held after the call is mostly the result
+        result = function()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return dict(_summarize(latencies), peak_mb=peak / 1e6, retained_mb=retained / 1e6,
+                gc_collections=collections / repeat)
+
+
+def _time_updates(command, updates, empty_cache=False):
+    handler = HANDLERS[command]
+    latencies = []
+    for update in updates:
+        update = _Update(update)
+        if empty_cache:
+            crypto_price_bot.reply_cache = ReplyCache()
+        start = time.perf_counter()
+        handler(None, update)
+        latencies.append(time.perf_counter() - start)
+        if not update.message.replies:
+            raise RuntimeError('{} did not reply to \'{}\''.format(command, update.message.text))
+    return latencies
+
+
+def _summarize(latencies):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {'mean_ms': float(np.mean(latencies) * 1000), 'p50_ms': float(p50), 'p95_ms': float(p95),
+            'p99_ms': float(p99)}
+
+
+class _PagesHandler(BaseHTTPRequestHandler):
+    pages = {}
+
+    def do_GET(self):
+        body = self.pages.get(int(parse_qs(urlparse(self.path).query).get('page', ['0'])[0]), b'[]')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve_pages(pages):
+    handler = type('PagesHandler', (_PagesHandler,), {'pages': pages})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _print_regressions(regressions, tolerance):
+    if not regressions:
+        print('No regressions over {:.0%}'.format(tolerance))
+        return
+    print('{} regressions over {:.0%}:'.format(len(regressions), tolerance))
+    for name, metric, old_value, value, change in regressions:
+        print('  {} {}: {:.4g} -> {:.4g} ({:+.0%})'.format(name, metric, old_value, value, change))
+
+
+def main():
+    # runs the benchmarks and writes the results as json, e.g.
+    # python benchmarks/run_benchmarks.py -output baseline.json
+    # python benchmarks/run_benchmarks.py -output results.json -baseline baseline.json
+    # with -baseline, the metrics that got worse by more than -tolerance are listed and the exit status is 1.
+    # -fixtures is a directory of page_<n>.json files (see fixtures.py), the pages are generated otherwise.
+    # -compare only compares two result files.
+    cmd_args = _get_args()
+    if cmd_args.compare:
+        with open(cmd_args.compare) as results_file:
+            results = json.load(results_file)['results']
+    else:
+        benchmarks = cmd_args.only.split(',') if cmd_args.only else BENCHMARKS
+        unknown = set(benchmarks) - set(BENCHMARKS)
+        if unknown:
+            sys.exit('Unknown benchmarks: {}'.format(', '.join(sorted(unknown))))
+        pages = fixtures.load_pages(cmd_args.fixtures) if cmd_args.fixtures else fixtures.generate_pages()
+        logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stderr)
+        results = run(pages, benchmarks, cmd_args.repeat, cmd_args.updates, cmd_args.dbrequests,
+                      logging.getLogger('benchmarks'))
+        report = json.dumps(build_report(results, cmd_args.repeat), indent=2, sort_keys=True)
+        if cmd_args.output:
+            with open(cmd_args.output, 'w') as output_file:
+                output_file.write(report + '\n')
+        else:
+            print(report)
+    if cmd_args.baseline:
+        with open(cmd_args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = compare(results, baseline, cmd_args.tolerance, tails=cmd_args.tails)
+        _print_regressions(regressions, cmd_args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+def _get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-output")
+    parser.add_argument("-baseline")
+    parser.add_argument("-compare")
+    parser.add_argument("-tolerance", type=float, default=TOLERANCE)
+    # also compare p95 and p99
+    parser.add_argument("-tails", action='store_true')
+    parser.add_argument("-fixtures")
+    # comma separated, out of parse, refresh, handlers and db
+    parser.add_argument("-only")
+    parser.add_argument("-repeat", type=int, default=20)
+    # synthetic updates per handler command
+    parser.add_argument("-updates", type=int, default=500)
+    parser.add_argument("-dbrequests", type=int, default=500)
+    cmd_args = parser.parse_args()
+    if cmd_args.compare and not cmd_args.baseline:
+        parser.error('-compare needs a -baseline')
+    return cmd_args
+
+
+if __name__ == '__main__':
+    main()
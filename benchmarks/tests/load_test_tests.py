@@ -0,0 +1,80 @@
+import threading
+import time
+import unittest
+
+import requests
+
+from benchmarks import fixtures, load_test
+from benchmarks.fake_bot_api import FakeBotApi
+from benchmarks.fake_coingecko import FakeCoinGecko, PROBE_SYMBOL
+from coingeckoapi import coingecko_api
+
+
+class FakeBotApiTests(unittest.TestCase):
+    def setUp(self):
+        self.api = FakeBotApi().start()
+        self.addCleanup(self.api.close)
+
+    def call(self, method, **params):
+        response = requests.post('{}/bot123:abc/{}'.format(self.api.url, method), json=params, timeout=5)
+        return response.json()['result']
+
+    def test_long_poll_returns_queued_updates(self):
+        self.assertEqual('load_test_bot', self.call('getMe')['username'])
+        self.assertEqual([], self.call('getUpdates', timeout=0))
+        threading.Timer(0.2, self.api.enqueue, [{'update_id': 7}]).start()
+        start = time.monotonic()
+        self.assertEqual([{'update_id': 7}], self.call('getUpdates', timeout=5))
+        self.assertLess(time.monotonic() - start, 4)
+        # the offset acknowledges the update
+        self.assertEqual([], self.call('getUpdates', offset=8, timeout=0))
+
+    def test_messages_are_recorded(self):
+        self.assertEqual(42, self.call('sendMessage', chat_id=42, text='hi')['chat']['id'])
+        self.assertEqual([(42, 'hi')], [(chat_id, text) for _, chat_id, text in self.api.take_messages()])
+        self.assertEqual([], self.api.take_messages())
+
+
+class FakeCoinGeckoTests(unittest.TestCase):
+    def setUp(self):
+        self.coingecko = FakeCoinGecko(fixtures.generate_pages(page_count=2), retry_after=7).start()
+        self.addCleanup(self.coingecko.close)
+
+    def test_probe_price_counts_page_fetches(self):
+        for expected_price in (1.0, 2.0):
+            shadowed = []
+            rows = coingecko_api.get_market_rows(page_count=2, base_url=self.coingecko.url, shadowed=shadowed)
+            probe = [row for row in rows if row.ticker_symbol == PROBE_SYMBOL]
+            self.assertEqual([expected_price], [row.usd_price for row in probe])
+        age = self.coingecko.probe_age(2.0, time.monotonic())
+        self.assertTrue(0 <= age < 5)
+        self.assertIsNone(self.coingecko.probe_age(3.0, time.monotonic()))
+        self.assertNotIn(PROBE_SYMBOL.lower(), self.coingecko.symbols())
+        self.assertIn('btc', self.coingecko.symbols())
+
+    def test_injected_faults(self):
+        self.coingecko.rate_limit_rate = 1.0
+        report = coingecko_api.RefreshReport()
+        self.assertEqual([], coingecko_api.get_market_rows(page_count=2, base_url=self.coingecko.url, report=report))
+        self.assertEqual((2, 7), (report.rate_limited, report.retry_after))
+        self.coingecko.rate_limit_rate = 0.0
+        self.coingecko.error_rate = 1.0
+        self.assertEqual([], coingecko_api.get_market_rows(page_count=2, base_url=self.coingecko.url))
+        self.assertEqual({'requests': 4, 'errors': 2, 'rate_limited': 2, 'page1_served': 0}, self.coingecko.stats())
+
+
+class LoadTestTests(unittest.TestCase):
+    def test_bot_answers_a_short_step(self):
+        report = load_test.run([5], duration=2, pages=fixtures.generate_pages(page_count=2), drain=10,
+                               mix={'/p': 1, '/top': 1}, ready_timeout=60)
+        step = report['steps'][0]
+        self.assertEqual(10, step['sent'])
+        self.assertEqual(10, step['replied'])
+        self.assertEqual(0, step['missing'])
+        self.assertEqual({'/p', '/top'}, set(step['commands']))
+        self.assertIn('p95', step['latency_ms'])
+        self.assertGreater(step['staleness_s']['probes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import json
+import os
+import tempfile
+import unittest
+
+from benchmarks import fixtures, run_benchmarks
+from coingeckoapi import coingecko_api
+from cryptopricebot import crypto_price_bot
+
+
+class FixturesTests(unittest.TestCase):
+    def test_generated_pages_parse(self):
+        pages = fixtures.generate_pages(page_count=2)
+        self.assertEqual(pages, fixtures.generate_pages(page_count=2))
+        rows = coingecko_api._parse_page(pages[1], 0, None)
+        self.assertEqual(['BTC', 'ETH'], [row.ticker_symbol for row in rows[:2]])
+        self.assertEqual(fixtures.PAGE_SIZE, len(json.loads(pages[2])))
+
+    def test_load_pages(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'page_3.json'), 'wb') as page_file:
+                page_file.write(b'[]')
+            with open(os.path.join(directory, 'notes.txt'), 'w') as notes_file:
+                notes_file.write('not a page')
+            self.assertEqual({3: b'[]'}, fixtures.load_pages(directory))
+
+    def test_updates_follow_mix(self):
+        updates = fixtures.build_updates(['btc', 'eth'], 50, {'/compare': 1, '/top': 1})
+        self.assertEqual(list(range(1, 51)), [update['update_id'] for update in updates])
+        commands = {update['message']['text'].split()[0] for update in updates}
+        self.assertEqual({'/compare', '/top'}, commands)
+        self.assertEqual({'/p': 3.0, '/top': 1.0}, fixtures.parse_mix('/p=3, /top=1'))
+        with self.assertRaises(ValueError):
+            fixtures.parse_mix('p=3')
+
+
+class CompareTests(unittest.TestCase):
+    def test_regressions(self):
+        baseline = {'parse_pages': {'p50_ms': 10.0, 'p99_ms': 20.0, 'rows': 3000, 'peak_mb': 0.0},
+                    'log_price_request': {'requests_per_sec': 100.0, 'p50_ms': 5.0}}
+        results = {'parse_pages': {'p50_ms': 13.0, 'p99_ms': 30.0, 'rows': 250, 'peak_mb': 1.0},
+                   'log_price_request': {'requests_per_sec': 70.0, 'p50_ms': 5.5},
+                   'new_benchmark': {'p50_ms': 1.0}}
+        regressions = run_benchmarks.compare(results, baseline, tolerance=0.2)
+        self.assertEqual([('log_price_request', 'requests_per_sec'), ('parse_pages', 'p50_ms')],
+                         [(name, metric) for name, metric, _, _, _ in regressions])
+        self.assertAlmostEqual(0.3, regressions[0][4])
+        self.assertEqual([], run_benchmarks.compare(results, baseline, tolerance=0.5))
+        self.assertEqual([('parse_pages', 'p99_ms')],
+                         [(name, metric) for name, metric, _, _, _ in
+                          run_benchmarks.compare(results, baseline, tolerance=0.4, tails=True)])
+
+
+class RunTests(unittest.TestCase):
+    def test_small_run(self):
+        snapshot = crypto_price_bot.ticker_snapshot
+        results = run_benchmarks.run(fixtures.generate_pages(page_count=2), repeat=1, updates_per_command=20,
+                                     db_requests=20)
+        self.assertIs(snapshot, crypto_price_bot.ticker_snapshot)
+        for command in run_benchmarks.HANDLER_COMMANDS:
+            self.assertIn('p95_ms', results['handler_{}_uncached'.format(command[1:])])
+        self.assertEqual(2 * fixtures.PAGE_SIZE, results['parse_pages']['rows'])
+        self.assertIn('peak_mb', results['get_all_tickers'])
+        self.assertGreater(results['price_request_writer']['requests_per_sec'], 0)
+        # a run compared with itself has no regressions
+        self.assertEqual([], run_benchmarks.compare(results, json.loads(json.dumps(results))))
+
+
+if __name__ == '__main__':
+    unittest.main()
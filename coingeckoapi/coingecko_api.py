@@ -1,46 +1,348 @@
+import asyncio
+import codecs
+import concurrent.futures
+import json
+import re
+import sys
+import threading
+
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 
+from cryptoshared import market_row
+from cryptoshared.market_row import MarketRow
 from cryptoshared.ticker_result import TickerResult
 
+API_BASE_URL = 'https://api.coingecko.com/api/v3'
+PAGE_COUNT = 12
+# number of pages fetched in parallel, also used as the size of the keep-alive connection pool
+MAX_CONCURRENT_PAGES = 6
+# (connect, read) timeout in seconds for a single page request
+PAGE_TIMEOUT = (5, 15)
+# pages that have not come back after this many seconds are skipped for the current refresh
+REFRESH_TIMEOUT = 20
+# bytes of a page body decoded at a time while it is parsed
+PARSE_CHUNK_SIZE = 64 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
 
 class InvalidTicker(Exception):
     pass
 
 
-def get_all_tickers(min_volume=0, logger=None):
-    tickers = {}
-    for i in range(1, 13):
-        response = _api_get_all_tickers(i)
-        json_response = response.json()
-        for item in json_response:
+class RefreshReport:
+    # How a refresh went, filled in by get_all_tickers() when one is given, for refresh_scheduler.RefreshScheduler:
+    # the number of page requests that reached the API, the pages that failed or timed out, the pages refused with
+    # a 429 and the longest Retry-After (seconds) sent with them. skipped is set by a price_providers.ProviderSet
+    # whose providers were all still busy with an earlier refresh, so this one made no request at all.
+    def __init__(self):
+        self.requests = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.retry_after = None
+        self.skipped = False
+
+    def merge(self, other):
+        # adds up the reports of calls made for the same refresh
+        self.requests += other.requests
+        self.failed += other.failed
+        self.rate_limited += other.rate_limited
+        if other.retry_after is not None:
+            self.retry_after = max(self.retry_after or 0, other.retry_after)
+
+    def add_response(self, status_code, headers):
+        if status_code != 429:
+            return
+        self.rate_limited += 1
+        retry_after = _parse_retry_after(headers.get('Retry-After'))
+        if retry_after is not None:
+            self.retry_after = max(self.retry_after or 0, retry_after)
+
+
+def get_market_rows(min_volume=0, logger=None, page_count=PAGE_COUNT, max_workers=MAX_CONCURRENT_PAGES,
+                    page_timeout=PAGE_TIMEOUT, refresh_timeout=REFRESH_TIMEOUT, base_url=API_BASE_URL, shadowed=None,
+                    report=None, tiers=None):
+    # returns a market_row.MarketRow for every coin, in ranking order. coins whose symbol is already taken by a
+    # higher ranked coin are appended to the shadowed list when one is given, in ranking order, instead of being
+    # dropped. with a page_tiers.PageTiers only the pages it plans are fetched, the others come from earlier
+    # refreshes.
+    report = RefreshReport() if report is None else report
+    page_numbers = range(1, page_count + 1) if tiers is None else tiers.plan()
+    pages = _fetch_pages(page_numbers, min_volume, max_workers, page_timeout, refresh_timeout, base_url, logger,
+                         report)
+    if tiers is not None:
+        tiers.update(pages)
+        pages = tiers.pages()
+    return _merge_pages(pages, shadowed)
+
+
+def get_all_tickers(min_volume=0, logger=None, page_count=PAGE_COUNT, max_workers=MAX_CONCURRENT_PAGES,
+                    page_timeout=PAGE_TIMEOUT, refresh_timeout=REFRESH_TIMEOUT, base_url=API_BASE_URL, shadowed=None,
+                    report=None, tiers=None):
+    # get_market_rows() as {ticker_symbol: TickerResult}, shadowed is filled with TickerResults
+    shadowed_rows = None if shadowed is None else []
+    rows = get_market_rows(min_volume, logger, page_count, max_workers, page_timeout, refresh_timeout, base_url,
+                           shadowed_rows, report, tiers)
+    if shadowed is not None:
+        shadowed.extend(market_row.to_ticker(row, TickerResult()) for row in shadowed_rows)
+    return {row.ticker_symbol: market_row.to_ticker(row, TickerResult()) for row in rows}
+
+
+async def get_market_rows_async(client, min_volume=0, logger=None, page_count=PAGE_COUNT,
+                                max_concurrency=MAX_CONCURRENT_PAGES, page_timeout=PAGE_TIMEOUT,
+                                refresh_timeout=REFRESH_TIMEOUT, base_url=API_BASE_URL, shadowed=None, report=None,
+                                tiers=None):
+    # same as get_market_rows(), with the pages fetched on the running event loop through an httpx.AsyncClient
+    # (see build_async_client()) instead of on worker threads
+    report = RefreshReport() if report is None else report
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch_page(page_number):
+        async with semaphore:
+            report.requests += 1
+            response = await client.get(_get_markets_url(base_url, page_number),
+                                        timeout=httpx.Timeout(page_timeout[1], connect=page_timeout[0]))
+            report.add_response(response.status_code, response.headers)
+            response.raise_for_status()
+            return _parse_page(response.content, min_volume, logger)
+
+    page_numbers = range(1, page_count + 1) if tiers is None else tiers.plan()
+    tasks = {asyncio.ensure_future(fetch_page(page_number)): page_number for page_number in page_numbers}
+    done, not_done = await asyncio.wait(tasks, timeout=refresh_timeout)
+    pages = {}
+    for task in done:
+        try:
+            pages[tasks[task]] = task.result()
+        except Exception as e:
+            report.failed += 1
+            if logger is not None:
+                logger.error('Unable to fetch page {} from CG API: {}'.format(tasks[task], e))
+    for task in not_done:
+        task.cancel()
+        report.failed += 1
+        if logger is not None:
+            logger.error('Page {} from CG API timed out and was skipped.'.format(tasks[task]))
+    if tiers is not None:
+        tiers.update(pages)
+        pages = tiers.pages()
+    return _merge_pages(pages, shadowed)
+
+
+async def get_all_tickers_async(client, min_volume=0, logger=None, page_count=PAGE_COUNT,
+                                max_concurrency=MAX_CONCURRENT_PAGES, page_timeout=PAGE_TIMEOUT,
+                                refresh_timeout=REFRESH_TIMEOUT, base_url=API_BASE_URL, shadowed=None, report=None,
+                                tiers=None):
+    # get_market_rows_async() as {ticker_symbol: TickerResult}, shadowed is filled with TickerResults
+    shadowed_rows = None if shadowed is None else []
+    rows = await get_market_rows_async(client, min_volume, logger, page_count, max_concurrency, page_timeout,
+                                       refresh_timeout, base_url, shadowed_rows, report, tiers)
+    if shadowed is not None:
+        shadowed.extend(market_row.to_ticker(row, TickerResult()) for row in shadowed_rows)
+    return {row.ticker_symbol: market_row.to_ticker(row, TickerResult()) for row in rows}
+
+
+def get_exchange_rates(logger=None, timeout=PAGE_TIMEOUT, base_url=API_BASE_URL, report=None):
+    # {currency code: units per USD} for every fiat currency of coingecko's exchange rate table, from a single
+    # request whatever the number of currencies. empty when the request fails.
+    report = RefreshReport() if report is None else report
+    report.requests += 1
+    try:
+        response = _get_session().get(_get_exchange_rates_url(base_url), timeout=timeout)
+        report.add_response(response.status_code, response.headers)
+        response.raise_for_status()
+        return _parse_exchange_rates(response.json())
+    except Exception as e:
+        report.failed += 1
+        if logger is not None:
+            logger.error('Unable to fetch exchange rates from CG API: {}'.format(e))
+        return {}
+
+
+async def get_exchange_rates_async(client, logger=None, timeout=PAGE_TIMEOUT, base_url=API_BASE_URL, report=None):
+    # same as get_exchange_rates(), through an httpx.AsyncClient
+    report = RefreshReport() if report is None else report
+    report.requests += 1
+    try:
+        response = await client.get(_get_exchange_rates_url(base_url),
+                                    timeout=httpx.Timeout(timeout[1], connect=timeout[0]))
+        report.add_response(response.status_code, response.headers)
+        response.raise_for_status()
+        return _parse_exchange_rates(response.json())
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        report.failed += 1
+        if logger is not None:
+            logger.error('Unable to fetch exchange rates from CG API: {}'.format(e))
+        return {}
+
+
+def build_async_client(pool_size=MAX_CONCURRENT_PAGES):
+    # the async counterpart of the shared requests session. owned by the caller, who has to close it.
+    return httpx.AsyncClient(limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                             headers={'Accept-Encoding': 'gzip, deflate'})
+
+
+def _merge_pages(pages, shadowed):
+    rows = []
+    symbols = set()
+    # merge in page order so a symbol shared by several coins still resolves to the highest ranked one. pages kept
+    # from different refreshes can list a coin that moved between them twice, the higher ranked copy is kept.
+    currency_ids = set()
+    for page_number in sorted(pages):
+        for row in pages[page_number]:
+            if row.currency_id in currency_ids:
+                continue
+            currency_ids.add(row.currency_id)
+            if row.ticker_symbol not in symbols:
+                symbols.add(row.ticker_symbol)
+                rows.append(row)
+            elif shadowed is not None:
+                shadowed.append(row)
+    return rows
+
+
+def _parse_page(content, min_volume, logger, chunk_size=PARSE_CHUNK_SIZE):
+    # decodes the json array of a markets page one item at a time straight into MarketRows, so the dicts of a whole
+    # page never exist at once and only the compact rows are kept. a bytes body is decoded chunk_size bytes at a
+    # time, so its whole text is never held next to it either
+    text = _PageText(content, chunk_size)
+    rows = []
+    if text.next_char() != '[':
+        raise ValueError('Expected a json array from CG API')
+    text.index += 1
+    if text.next_char() == ']':
+        return rows
+    while True:
+        row = _build_row(text.decode_value(), min_volume, logger)
+        if row is not None:
+            rows.append(row)
+        char = text.next_char()
+        if char == ']':
+            return rows
+        if char != ',':
+            raise ValueError('Unexpected character at position {} of the CG API response'.format(text.position()))
+        text.index += 1
+
+
+class _PageText:
+    # the text of a page body for _parse_page(), decoded as the parser gets to it. the part already parsed is
+    # dropped whenever the next chunk is added
+    def __init__(self, content, chunk_size):
+        self.text = ''
+        self.index = 0
+        if isinstance(content, str):
+            self.text = content
+            self._chunks = iter(())
+        else:
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            body = memoryview(content)
+            self._chunks = (decoder.decode(body[start:start + chunk_size], final=start + chunk_size >= len(body))
+                            for start in range(0, len(body), chunk_size))
+        # characters dropped from the front of text so far
+        self._dropped = 0
+
+    def next_char(self):
+        # the next character that is not whitespace, without consuming it. '' at the end of the body
+        while True:
+            self.index = _WHITESPACE.match(self.text, self.index).end()
+            if self.index < len(self.text):
+                return self.text[self.index]
+            if not self._read():
+                return ''
+
+    def decode_value(self):
+        # the json value after the whitespace at index, consumed
+        self.next_char()
+        while True:
             try:
-                if 'total_volume' in item and item['total_volume']:
-                    volume = float(item['total_volume'])
-                    if volume > min_volume:
-                        ticker_result = TickerResult()
-                        _build_ticker_result(item, ticker_result)
-                        if ticker_result.ticker_symbol not in tickers:
-                            tickers[ticker_result.ticker_symbol] = ticker_result
-            except KeyError as key_error:
-                key_err_msg = 'The following key was not present in the CoinGecko API response: \'{}\''.format(key_error)
-                if logger is not None:
-                    logger.error(key_err_msg)
-            except ValueError as value_error:
-                if logger is not None:
-                    logger.error(value_error)
-            except InvalidTicker as ticker_error:
-                if logger is not None:
-                    logger.debug(ticker_error)
+                value, end = _decoder.raw_decode(self.text, self.index)
+            except json.JSONDecodeError:
+                if self._read():
+                    continue
+                raise
+            # a value ending with the text, e.g. a number, may go on in the next chunk
+            if end < len(self.text) or not self._read():
+                self.index = end
+                return value
+
+    def position(self):
+        return self._dropped + self.index
+
+    def _read(self):
+        # adds the next chunk, False at the end of the body
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        self._dropped += self.index
+        self.text = self.text[self.index:] + chunk
+        self.index = 0
+        return True
+
+
+def _build_row(item, min_volume, logger):
+    # None for coins without enough volume and for invalid items
+    try:
+        if 'total_volume' in item and item['total_volume']:
+            volume = float(item['total_volume'])
+            if volume > min_volume:
+                return _build_market_row(item)
+    except KeyError as key_error:
+        key_err_msg = 'The following key was not present in the CoinGecko API response: \'{}\''.format(key_error)
+        if logger is not None:
+            logger.error(key_err_msg)
+    except ValueError as value_error:
+        if logger is not None:
+            logger.error(value_error)
+    except InvalidTicker as ticker_error:
+        if logger is not None:
+            logger.debug(ticker_error)
+    except Exception as e:
+        if logger is not None:
+            logger.exception('An error occurred while processing the response from CG API:')
+    return None
+
+
+def _fetch_pages(page_numbers, min_volume, max_workers, page_timeout, refresh_timeout, base_url, logger, report):
+    # returns {page_number: [MarketRow]} for every page that came back in time. a slow or failed page is
+    # skipped for this refresh instead of holding back the pages that are already done.
+    pages = {}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {executor.submit(_api_get_all_tickers, page_number, page_timeout, base_url, max_workers): page_number
+                   for page_number in page_numbers}
+        done, not_done = concurrent.futures.wait(futures, timeout=refresh_timeout)
+        report.requests += len(done)
+        for future in done:
+            page_number = futures[future]
+            try:
+                response = future.result()
+                report.add_response(response.status_code, response.headers)
+                response.raise_for_status()
+                pages[page_number] = _parse_page(response.content, min_volume, logger)
             except Exception as e:
+                report.failed += 1
                 if logger is not None:
-                    logger.exception('An error occurred while processing the response from CG API:')
-    return tickers
+                    logger.error('Unable to fetch page {} from CG API: {}'.format(page_number, e))
+        for future in not_done:
+            # a page still waiting for a worker thread never reaches the API
+            if not future.cancel():
+                report.requests += 1
+            report.failed += 1
+            if logger is not None:
+                logger.error('Page {} from CG API timed out and was skipped.'.format(futures[future]))
+    finally:
+        executor.shutdown(wait=False)
+    return pages
 
 
-def _build_ticker_result(json_response, ticker_result):
-    ticker_result.exchange_name = 'CoinGecko'
-    ticker_result.currency_id = json_response['id']
-
+def _build_market_row(json_response):
     name = json_response['name']
     if not name:
         raise InvalidTicker('\'Name\' is a required field.  Skipping this currency.')
@@ -50,35 +352,66 @@ def _build_ticker_result(json_response, ticker_result):
     usd_price = json_response['current_price']
     if not usd_price:
         raise InvalidTicker('\'USD Price\' is a required field.  Skipping this currency.')
-    ticker_result.currency_name = name
-    ticker_result.ticker_symbol = symbol.upper()
-    ticker_result.usd_price = float(usd_price)
-
-    market_cap = json_response['market_cap']
-    volume_24h = json_response['total_volume']
-    change_1h = json_response['price_change_percentage_1h_in_currency']
-    change_24h = json_response['price_change_percentage_24h_in_currency']
-    change_7d = json_response['price_change_percentage_7d_in_currency']
-    change_30d = json_response['price_change_percentage_30d_in_currency']
-    change_1y = json_response['price_change_percentage_1y_in_currency']
-    if market_cap:
-        ticker_result.market_cap = float(market_cap)
-    if volume_24h:
-        ticker_result.volume_24h = float(volume_24h)
-    if change_1h:
-        ticker_result.percent_change_1h = float(change_1h)
-    if change_24h:
-        ticker_result.percent_change_24h = float(change_24h)
-    if change_7d:
-        ticker_result.percent_change_7d = float(change_7d)
-    if change_30d:
-        ticker_result.percent_change_30d = float(change_30d)
-    if change_1y:
-        ticker_result.percent_change_1y = float(change_1y)
-
-
-def _api_get_all_tickers(page_number):
-    response = requests.get('https://api.coingecko.com/api/v3/coins/markets?vs_currency=usd&order=gecko_desc&'
-                            'per_page=250&page={}&sparkline=false&'
-                            'price_change_percentage=1h%2C24h%2C7d%2C30d%2C1y'.format(page_number), timeout=30)
+    # interned, so every refresh lists a coin with the same string objects and stores compare them by identity
+    return MarketRow('CoinGecko', _intern(json_response['id']), _intern(name), sys.intern(symbol.upper()),
+                     float(usd_price), _optional_float(json_response['market_cap']),
+                     _optional_float(json_response['total_volume']),
+                     _optional_float(json_response['price_change_percentage_1h_in_currency']),
+                     _optional_float(json_response['price_change_percentage_24h_in_currency']),
+                     _optional_float(json_response['price_change_percentage_7d_in_currency']),
+                     _optional_float(json_response['price_change_percentage_30d_in_currency']),
+                     _optional_float(json_response['price_change_percentage_1y_in_currency']))
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _optional_float(value):
+    # missing and zero values are both left out, as before
+    return float(value) if value else None
+
+
+def _api_get_all_tickers(page_number, timeout=PAGE_TIMEOUT, base_url=API_BASE_URL, pool_size=MAX_CONCURRENT_PAGES):
+    response = _get_session(pool_size).get(_get_markets_url(base_url, page_number), timeout=timeout)
     return response
+
+
+def _parse_retry_after(value):
+    # only the delay-seconds form, coingecko does not send dates
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _get_markets_url(base_url, page_number):
+    return '{}/coins/markets?vs_currency=usd&order=gecko_desc&per_page=250&page={}&sparkline=false&' \
+           'price_change_percentage=1h%2C24h%2C7d%2C30d%2C1y'.format(base_url, page_number)
+
+
+def _get_exchange_rates_url(base_url):
+    return '{}/exchange_rates'.format(base_url)
+
+
+def _parse_exchange_rates(json_response):
+    # coingecko's rates are units per BTC
+    rates = json_response['rates']
+    usd_per_btc = float(rates['usd']['value'])
+    return {code.upper(): float(rate['value']) / usd_per_btc for code, rate in rates.items()
+            if rate.get('type') == 'fiat' and rate.get('value')}
+
+
+def _get_session(pool_size=MAX_CONCURRENT_PAGES):
+    # one shared session so every refresh reuses the same keep-alive connections instead of a new TLS handshake
+    # per page. requests negotiates gzip/deflate by default; the header is set explicitly so it is not lost.
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+            _session = session
+        return _session
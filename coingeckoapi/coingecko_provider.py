@@ -0,0 +1,35 @@
+from coingeckoapi import coingecko_api
+from cryptoshared.price_providers import PriceProvider
+
+
+class CoinGeckoProvider(PriceProvider):
+    # price_providers.PriceProvider over the CoinGecko markets pages. tiers is the page_tiers.PageTiers deciding
+    # which pages a refresh fetches, client the httpx.AsyncClient used by fetch_async() (see
+    # coingecko_api.build_async_client()), set by the async runtime once it is open. reports are
+    # coingecko_api.RefreshReports.
+    name = 'coingecko'
+
+    def __init__(self, tiers=None, logger=None, client=None, **options):
+        self.tiers = tiers
+        self.logger = logger
+        self.client = client
+        # passed on to coingecko_api.get_market_rows(), e.g. base_url or page_count
+        self.options = options
+
+    @property
+    def native_async(self):
+        return self.client is not None
+
+    def fetch(self, report=None):
+        shadowed = []
+        rows = coingecko_api.get_market_rows(logger=self.logger, shadowed=shadowed, report=report, tiers=self.tiers,
+                                             **self.options)
+        return rows, shadowed
+
+    async def fetch_async(self, report=None):
+        if self.client is None:
+            return await super().fetch_async(report)
+        shadowed = []
+        rows = await coingecko_api.get_market_rows_async(self.client, logger=self.logger, shadowed=shadowed,
+                                                         report=report, tiers=self.tiers, **self.options)
+        return rows, shadowed
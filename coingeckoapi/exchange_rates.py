@@ -0,0 +1,39 @@
+import time
+
+from coingeckoapi import coingecko_api
+from coingeckoapi.coingecko_api import API_BASE_URL
+
+# seconds a fetched exchange rate table is used for. fiat rates barely move in a minute, so this costs one request a
+# minute on top of the pages
+INTERVAL = 60
+
+
+class ExchangeRates:
+    # Exchange rate table attached to every snapshot (see ticker_snapshot.TickerSnapshot.in_currency()), fetched
+    # again by a refresh once it is interval seconds old. A failed fetch keeps the previous table and is retried by
+    # the next refresh. clock is only replaced in tests.
+    def __init__(self, interval=INTERVAL, clock=time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self.rates = {}
+        self._fetched_at = None
+
+    def due(self):
+        return self._fetched_at is None or self.clock() - self._fetched_at >= self.interval
+
+    def update(self, rates):
+        if rates:
+            self.rates = rates
+            self._fetched_at = self.clock()
+        return self.rates
+
+    def get(self, logger=None, base_url=API_BASE_URL, report=None):
+        if self.due():
+            self.update(coingecko_api.get_exchange_rates(logger, base_url=base_url, report=report))
+        return self.rates
+
+    async def get_async(self, client, logger=None, base_url=API_BASE_URL, report=None):
+        if self.due():
+            self.update(await coingecko_api.get_exchange_rates_async(client, logger, base_url=base_url,
+                                                                     report=report))
+        return self.rates
@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict
+
+from coingeckoapi.coingecko_api import PAGE_COUNT
+
+# pages fetched on every refresh no matter what, page 1 holds the 250 largest coins
+HOT_PAGES = 1
+# most pages fetched by one refresh once every page has been fetched once
+MAX_PAGES = 4
+# seconds after which a page nobody asked about is due again
+COLD_INTERVAL = 60
+# a page stays in demand for this many seconds after a request for one of its coins
+DEMAND_WINDOW = 15 * 60
+MAX_DEMAND = 10000
+
+HOT = 'hot'
+DEMAND = 'demand'
+COLD = 'cold'
+
+
+class PageTiers:
+    # Decides which markets pages a refresh fetches and keeps the latest copy of every page, so the pages that were
+    # not fetched are merged in from the previous refreshes (see coingecko_api.get_all_tickers(tiers=...)).
+    # A refresh fetches, up to max_pages:
+    # - the hot pages,
+    # - the pages of the coins requested in the past demand_window seconds, most requested first,
+    # - cold pages older than cold_interval, oldest first.
+    # Pages never fetched before are always included, so the first refresh fetches everything. Requests are reported
+    # from the handlers by CoinGecko id with record_demand(). clock is only replaced in tests.
+    # A coin that left a fetched page moved to a neighbouring page whose copy may predate the move. Its row from the
+    # previous copy is carried over to that page until the page is fetched again, which the next refresh does first,
+    # so the coin never drops out of the merged pages.
+    def __init__(self, page_count=PAGE_COUNT, hot_pages=HOT_PAGES, max_pages=MAX_PAGES, cold_interval=COLD_INTERVAL,
+                 demand_window=DEMAND_WINDOW, max_demand=MAX_DEMAND, clock=time.time):
+        self.page_count = page_count
+        self.hot_pages = hot_pages
+        self.max_pages = max_pages
+        self.cold_interval = cold_interval
+        self.demand_window = demand_window
+        self.max_demand = max_demand
+        self.clock = clock
+        # {page number: (fetched_at, [market_row.MarketRow])}
+        self._pages = {}
+        # {currency id: page number} of the pages fetched so far
+        self._page_of = {}
+        # {currency id: (page number it moved to, page number it left, row)} of the coins carried over
+        self._carried = {}
+        # {currency id: row} of the rows pages() serves from the copies of earlier refreshes
+        self._cached = {}
+        # {currency id: time of the last request}, oldest first
+        self._demand = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record_demand(self, currency_ids):
+        with self._lock:
+            now = self.clock()
+            for currency_id in currency_ids:
+                self._demand[currency_id] = now
+                self._demand.move_to_end(currency_id)
+            while len(self._demand) > self.max_demand:
+                self._demand.popitem(last=False)
+
+    def plan(self):
+        # sorted page numbers for the next refresh
+        with self._lock:
+            now = self.clock()
+            missing = [page for page in range(1, self.page_count + 1) if page not in self._pages]
+            hot = [page for page in range(1, min(self.hot_pages, self.page_count) + 1)]
+            selected = set(missing) | set(hot)
+            moved_to = sorted({page for page, _, _ in self._carried.values()})
+            for page in moved_to + self._get_demanded_pages(now):
+                if len(selected) >= self.max_pages:
+                    break
+                selected.add(page)
+            cold = sorted((fetched_at, page) for page, (fetched_at, _) in self._pages.items()
+                          if page not in selected and now - fetched_at >= self.cold_interval)
+            for _, page in cold[:max(self.max_pages - len(selected), 0)]:
+                selected.add(page)
+            return sorted(selected)
+
+    def update(self, pages):
+        # stores the pages a refresh brought back, pages that failed keep their previous copy
+        with self._lock:
+            now = self.clock()
+            fetched_ids = {row.currency_id for rows in pages.values() for row in rows}
+            for page_number, rows in pages.items():
+                previous = self._pages.get(page_number)
+                if previous is not None and rows:
+                    self._carry_over(page_number, previous[1], rows, fetched_ids, pages)
+                self._pages[page_number] = (now, rows)
+                for row in rows:
+                    self._page_of[row.currency_id] = page_number
+            # a fetched page is the current word on which coins it lists
+            for currency_id, (moved_to, _, _) in list(self._carried.items()):
+                if moved_to in pages or currency_id in fetched_ids:
+                    del self._carried[currency_id]
+            self._cached = {row.currency_id: row for page_number, (_, rows) in self._pages.items()
+                            if page_number not in pages for row in rows}
+            self._cached.update((currency_id, row) for currency_id, (_, _, row) in self._carried.items())
+
+    def pages(self):
+        # {page number: rows} of every page fetched so far, with the coins carried over to the page they moved to:
+        # in front of its rows when they dropped from the page above, after them when they rose from the one below
+        with self._lock:
+            pages = {page_number: rows for page_number, (_, rows) in self._pages.items()}
+            for moved_to, moved_from, row in self._carried.values():
+                rows = pages.get(moved_to, [])
+                pages[moved_to] = [row] + rows if moved_from < moved_to else rows + [row]
+            return pages
+
+    def fetched_mask(self, rows):
+        # for each of rows, whether it came from a page the latest update() brought back rather than from the copy
+        # of an earlier refresh. rows this PageTiers never served, e.g. those of another provider, count as fetched.
+        with self._lock:
+            return [self._cached.get(row.currency_id) is not row for row in rows]
+
+    def freshness(self):
+        # {tier: seconds since its least recently fetched page}, for the tiers that have pages
+        with self._lock:
+            now = self.clock()
+            demanded = set(self._get_demanded_pages(now))
+            ages = {}
+            for page_number, (fetched_at, _) in self._pages.items():
+                tier = HOT if page_number <= self.hot_pages else DEMAND if page_number in demanded else COLD
+                ages[tier] = max(ages.get(tier, 0), now - fetched_at)
+            return ages
+
+    def _carry_over(self, page_number, previous_rows, rows, fetched_ids, pages):
+        # rows of the previous copy of a page that are in none of the pages just fetched. a coin with a larger market
+        # cap than the top of the new copy rose to the page above, any other one dropped to the page below.
+        top_market_cap = rows[0].market_cap
+        for row in previous_rows:
+            if row.currency_id in fetched_ids:
+                continue
+            rose = row.market_cap is not None and top_market_cap is not None and row.market_cap > top_market_cap
+            moved_to = page_number - 1 if rose else page_number + 1
+            # past the last page it left the listing, a page fetched now would have listed it
+            if 1 <= moved_to <= self.page_count and moved_to not in pages:
+                self._carried[row.currency_id] = (moved_to, page_number, row)
+                self._page_of[row.currency_id] = moved_to
+
+    def _get_demanded_pages(self, now):
+        while self._demand:
+            currency_id, requested_at = next(iter(self._demand.items()))
+            if now - requested_at < self.demand_window:
+                break
+            del self._demand[currency_id]
+        counts = {}
+        for currency_id in self._demand:
+            page = self._page_of.get(currency_id)
+            if page is not None and page > self.hot_pages:
+                counts[page] = counts.get(page, 0) + 1
+        return sorted(counts, key=lambda page: (-counts[page], page))
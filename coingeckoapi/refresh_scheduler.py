@@ -0,0 +1,131 @@
+import random
+import threading
+import time
+from collections import deque
+
+from coingeckoapi.coingecko_api import PAGE_COUNT
+
+# seconds between two refreshes when nothing is wrong
+INTERVAL = 10
+# page requests allowed per BUDGET_WINDOW seconds. coingecko's demo plan allows 30 calls a minute
+BUDGET = 30
+BUDGET_WINDOW = 60
+# delay after the first rate limited refresh, doubled for every further one in a row up to MAX_BACKOFF
+MIN_BACKOFF = 30
+MAX_BACKOFF = 600
+# failed refreshes in a row that open the circuit, and how long it then stays open before one trial refresh
+FAILURE_THRESHOLD = 5
+OPEN_TIME = 300
+# share of a delay added at random, so restarted bots do not all hit the API at the same moment
+JITTER = 0.1
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class RefreshScheduler:
+    # Decides when the next CoinGecko refresh may start. Every refresh is reported with record() and a
+    # coingecko_api.RefreshReport, then the refresh loop sleeps for next_delay() seconds, which is the longest of:
+    # - the regular interval,
+    # - the wait until page_count more requests fit in the budget of the sliding budget window,
+    # - the backoff after 429s: at least the Retry-After coingecko sent, doubling from min_backoff for every rate
+    #   limited refresh in a row,
+    # - while the circuit is open (failure_threshold failed refreshes in a row), the rest of open_time. The refresh
+    #   after that is a trial: success closes the circuit, failure opens it again right away.
+    # plus up to `jitter` of that delay at random. clock and rng are only replaced in tests.
+    def __init__(self, interval=INTERVAL, budget=BUDGET, budget_window=BUDGET_WINDOW, page_count=PAGE_COUNT,
+                 min_backoff=MIN_BACKOFF, max_backoff=MAX_BACKOFF, failure_threshold=FAILURE_THRESHOLD,
+                 open_time=OPEN_TIME, jitter=JITTER, clock=time.monotonic, rng=None):
+        self.interval = interval
+        self.budget = budget
+        self.budget_window = budget_window
+        self.page_count = page_count
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.open_time = open_time
+        self.jitter = jitter
+        self.clock = clock
+        self.rng = random.Random() if rng is None else rng
+        self.state = CLOSED
+        self.failures = 0
+        self.refreshes = 0
+        self.rate_limited = 0
+        self._backoff = 0
+        self._backoff_until = 0
+        self._open_until = 0
+        # (time, page requests) of the refreshes inside the budget window
+        self._requests = deque()
+        self._lock = threading.Lock()
+
+    def record(self, report, ok):
+        # ok is whether the refresh produced a snapshot worth publishing
+        with self._lock:
+            now = self.clock()
+            self.refreshes += 1
+            if report.requests:
+                self._requests.append((now, report.requests))
+            if report.rate_limited:
+                self.rate_limited += 1
+                self._back_off(now, report)
+            elif ok:
+                self._backoff = 0
+            if ok:
+                self.failures = 0
+                self.state = CLOSED
+            else:
+                self.failures += 1
+                # a failed trial refresh opens the circuit again right away
+                if self.state == OPEN or self.failures >= self.failure_threshold:
+                    self.state = OPEN
+                    self._open_until = now + self.open_time
+
+    def record_late(self, report):
+        # the report of a call that finished after its refresh was recorded, e.g. a hedge loser of a
+        # price_providers.ProviderSet: its requests still count against the budget and its 429s still back off, the
+        # refresh itself is not counted again
+        with self._lock:
+            now = self.clock()
+            if report.requests:
+                self._requests.append((now, report.requests))
+            if report.rate_limited:
+                self._back_off(now, report)
+
+    def next_delay(self):
+        with self._lock:
+            now = self.clock()
+            delay = max(self.interval, self._backoff_until - now, self._get_budget_wait(now))
+            if self.state == OPEN:
+                delay = max(delay, self._open_until - now)
+            return delay + self.rng.uniform(0, self.jitter * delay)
+
+    def stats(self):
+        with self._lock:
+            now = self.clock()
+            self._expire_requests(now)
+            state = HALF_OPEN if self.state == OPEN and now >= self._open_until else self.state
+            return {'state': state, 'failures': self.failures, 'refreshes': self.refreshes,
+                    'rate_limited': self.rate_limited, 'backoff': self._backoff,
+                    'budget_used': sum(count for _, count in self._requests)}
+
+    def _back_off(self, now, report):
+        self._backoff = min(max(self._backoff * 2, self.min_backoff), self.max_backoff)
+        self._backoff_until = max(self._backoff_until, now + max(self._backoff, report.retry_after or 0))
+
+    def _get_budget_wait(self, now):
+        # seconds until page_count more requests fit in the window. a refresh larger than the whole budget waits for
+        # the window to empty, so it runs at most once per window
+        self._expire_requests(now)
+        used = sum(count for _, count in self._requests)
+        wait = 0
+        for timestamp, count in self._requests:
+            if used + self.page_count <= self.budget:
+                break
+            used -= count
+            wait = timestamp + self.budget_window - now
+        return wait
+
+    def _expire_requests(self, now):
+        while self._requests and self._requests[0][0] <= now - self.budget_window:
+            self._requests.popleft()
@@ -0,0 +1,238 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from coingeckoapi import coingecko_api
+from coingeckoapi.coingecko_provider import CoinGeckoProvider
+from coingeckoapi.page_tiers import PageTiers
+
+
+def build_item(coin_id, symbol, price, volume=1000):
+    return {'id': coin_id, 'name': coin_id.title(), 'symbol': symbol, 'current_price': price,
+            'market_cap': price * 100, 'total_volume': volume,
+            'price_change_percentage_1h_in_currency': 1.0,
+            'price_change_percentage_24h_in_currency': 2.0,
+            'price_change_percentage_7d_in_currency': 3.0,
+            'price_change_percentage_30d_in_currency': 4.0,
+            'price_change_percentage_1y_in_currency': 5.0}
+
+
+class StubMarketsHandler(BaseHTTPRequestHandler):
+    pages = {}
+    delays = {}
+    # {page: seconds} of pages answered with a 429 and that Retry-After
+    rate_limited = {}
+    # {page: raw response body} of pages answered with something else than json.dumps(pages[page])
+    bodies = {}
+    requested = []
+    # body of /exchange_rates
+    exchange_rates = {}
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/exchange_rates':
+            self.send_json(self.exchange_rates)
+            return
+        page = int(parse_qs(urlparse(self.path).query)['page'][0])
+        self.requested.append(page)
+        time.sleep(self.delays.get(page, 0))
+        if page in self.rate_limited:
+            self.send_response(429)
+            self.send_header('Retry-After', str(self.rate_limited[page]))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if page in self.bodies:
+            self.send_body(self.bodies[page])
+        else:
+            self.send_json(self.pages.get(page, []))
+
+    def send_json(self, value):
+        self.send_body(json.dumps(value).encode())
+
+    def send_body(self, body):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GetAllTickersTests(unittest.TestCase):
+    def setUp(self):
+        StubMarketsHandler.pages = {
+            1: [build_item('bitcoin', 'btc', 10000), build_item('ethereum', 'eth', 500)],
+            2: [build_item('bitcoin-fork', 'btc', 5), build_item('litecoin', 'ltc', 50)],
+            3: [build_item('dogecoin', 'doge', 0.01)],
+        }
+        StubMarketsHandler.delays = {}
+        StubMarketsHandler.rate_limited = {}
+        StubMarketsHandler.bodies = {}
+        StubMarketsHandler.requested = []
+        StubMarketsHandler.exchange_rates = {'rates': {
+            'btc': {'name': 'Bitcoin', 'unit': 'BTC', 'value': 1.0, 'type': 'crypto'},
+            'usd': {'name': 'US Dollar', 'unit': '$', 'value': 10000.0, 'type': 'fiat'},
+            'eur': {'name': 'Euro', 'unit': '€', 'value': 9000.0, 'type': 'fiat'},
+            'xau': {'name': 'Gold - Troy Ounce', 'unit': 'XAU', 'value': 5.0, 'type': 'commodity'}}}
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubMarketsHandler)
+        self.server.daemon_threads = True
+        self.server.block_on_close = False
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_merges_pages_in_rank_order(self):
+        # page 1 is the slowest, but its BTC must still win over the lower ranked BTC on page 2
+        StubMarketsHandler.delays = {1: 0.2}
+        tickers = coingecko_api.get_all_tickers(page_count=3, base_url=self.base_url)
+        self.assertEqual(['BTC', 'ETH', 'LTC', 'DOGE'], list(tickers.keys()))
+        self.assertEqual('bitcoin', tickers['BTC'].currency_id)
+        self.assertEqual(10000, tickers['BTC'].usd_price)
+
+    def test_colliding_symbols_are_shadowed(self):
+        shadowed = []
+        tickers = coingecko_api.get_all_tickers(page_count=3, base_url=self.base_url, shadowed=shadowed)
+        self.assertEqual('bitcoin', tickers['BTC'].currency_id)
+        self.assertEqual(['bitcoin-fork'], [ticker.currency_id for ticker in shadowed])
+
+    def test_pages_are_fetched_concurrently(self):
+        StubMarketsHandler.delays = {1: 0.3, 2: 0.3, 3: 0.3}
+        start = time.monotonic()
+        tickers = coingecko_api.get_all_tickers(page_count=3, max_workers=3, base_url=self.base_url)
+        self.assertLess(time.monotonic() - start, 0.8)
+        self.assertEqual(4, len(tickers))
+
+    def test_slow_page_is_skipped(self):
+        StubMarketsHandler.delays = {3: 2}
+        tickers = coingecko_api.get_all_tickers(page_count=3, refresh_timeout=0.5, base_url=self.base_url)
+        self.assertEqual(['BTC', 'ETH', 'LTC'], list(tickers.keys()))
+
+    def test_min_volume(self):
+        StubMarketsHandler.pages[3] = [build_item('dogecoin', 'doge', 0.01, volume=10)]
+        tickers = coingecko_api.get_all_tickers(min_volume=100, page_count=3, base_url=self.base_url)
+        self.assertNotIn('DOGE', tickers)
+
+    def test_market_rows(self):
+        invalid = build_item('nothing', 'none', 1)
+        del invalid['current_price']
+        StubMarketsHandler.pages[3] = [invalid, build_item('dogecoin', 'doge', 0.01)]
+        StubMarketsHandler.pages[3][1]['price_change_percentage_1y_in_currency'] = None
+        rows = coingecko_api.get_market_rows(page_count=3, base_url=self.base_url)
+        self.assertEqual(['BTC', 'ETH', 'LTC', 'DOGE'], [row.ticker_symbol for row in rows])
+        self.assertEqual(('CoinGecko', 'dogecoin', 'Dogecoin', 'DOGE', 0.01, 1.0, 1000.0, 1.0, 2.0, 3.0, 4.0, None),
+                         rows[3])
+
+    def test_malformed_page_fails_alone(self):
+        StubMarketsHandler.bodies = {2: b' [ ' + json.dumps(build_item('litecoin', 'ltc', 50)).encode() + b', {"id'}
+        report = coingecko_api.RefreshReport()
+        tickers = coingecko_api.get_all_tickers(page_count=3, base_url=self.base_url, report=report)
+        self.assertEqual(['BTC', 'ETH', 'DOGE'], list(tickers.keys()))
+        self.assertEqual(1, report.failed)
+
+    def test_page_parsed_in_chunks(self):
+        items = [build_item('bitcoin', 'btc', 10000), build_item('ethereum', 'eth', 500.25),
+                 build_item('euro-coin', '€c', 1)]
+        body = ' [ {} ] '.format(',\n '.join(json.dumps(item, ensure_ascii=False) for item in items)).encode()
+        expected = coingecko_api._parse_page(body, 0, None)
+        self.assertEqual(['BTC', 'ETH', '€C'], [row.ticker_symbol for row in expected])
+        # chunks end inside numbers, strings and multi-byte characters
+        for chunk_size in (1, 2, 7, 64):
+            self.assertEqual(expected, coingecko_api._parse_page(body, 0, None, chunk_size=chunk_size))
+        with self.assertRaises(ValueError):
+            coingecko_api._parse_page(body[:-4], 0, None, chunk_size=7)
+        with self.assertRaises(ValueError):
+            coingecko_api._parse_page(b'[1 2]', 0, None, chunk_size=2)
+
+    def test_provider(self):
+        provider = CoinGeckoProvider(page_count=3, base_url=self.base_url)
+        report = coingecko_api.RefreshReport()
+        rows, shadowed = provider.fetch(report)
+        self.assertEqual(['BTC', 'ETH', 'LTC', 'DOGE'], [row.ticker_symbol for row in rows])
+        self.assertEqual(['bitcoin-fork'], [row.currency_id for row in shadowed])
+        self.assertEqual(3, report.requests)
+
+        async def fetch():
+            async with coingecko_api.build_async_client() as client:
+                provider.client = client
+                return await provider.fetch_async()
+
+        self.assertEqual(rows, asyncio.run(fetch())[0])
+
+    def test_exchange_rates(self):
+        report = coingecko_api.RefreshReport()
+        rates = coingecko_api.get_exchange_rates(base_url=self.base_url, report=report)
+        self.assertEqual({'USD': 1.0, 'EUR': 0.9}, rates)
+        self.assertEqual(1, report.requests)
+        StubMarketsHandler.exchange_rates = {'error': 'unavailable'}
+        self.assertEqual({}, coingecko_api.get_exchange_rates(base_url=self.base_url, report=report))
+        self.assertEqual(1, report.failed)
+
+    def test_exchange_rates_async(self):
+        async def fetch():
+            async with coingecko_api.build_async_client() as client:
+                return await coingecko_api.get_exchange_rates_async(client, base_url=self.base_url)
+
+        self.assertEqual({'USD': 1.0, 'EUR': 0.9}, asyncio.run(fetch()))
+
+    def test_report(self):
+        StubMarketsHandler.rate_limited = {2: 30, 3: 45}
+        report = coingecko_api.RefreshReport()
+        tickers = coingecko_api.get_all_tickers(page_count=3, base_url=self.base_url, report=report)
+        self.assertEqual(['BTC', 'ETH'], list(tickers.keys()))
+        self.assertEqual(3, report.requests)
+        self.assertEqual(2, report.failed)
+        self.assertEqual(2, report.rate_limited)
+        self.assertEqual(45, report.retry_after)
+
+    def test_tiered_refresh(self):
+        tiers = PageTiers(page_count=3, max_pages=2, cold_interval=3600)
+        coingecko_api.get_all_tickers(page_count=3, base_url=self.base_url, tiers=tiers)
+        self.assertEqual([1, 2, 3], sorted(StubMarketsHandler.requested))
+        StubMarketsHandler.requested = []
+        StubMarketsHandler.pages[1][0] = build_item('bitcoin', 'btc', 20000)
+        StubMarketsHandler.pages[3][0] = build_item('dogecoin', 'doge', 0.02)
+        tiers.record_demand(['litecoin'])
+        tickers = coingecko_api.get_all_tickers(page_count=3, base_url=self.base_url, tiers=tiers)
+        self.assertEqual([1, 2], sorted(StubMarketsHandler.requested))
+        # page 3 was not fetched again and is merged in from the first refresh
+        self.assertEqual(['BTC', 'ETH', 'LTC', 'DOGE'], list(tickers.keys()))
+        self.assertEqual(20000, tickers['BTC'].usd_price)
+        self.assertEqual(0.01, tickers['DOGE'].usd_price)
+
+    def test_coin_listed_on_two_pages_is_merged_once(self):
+        StubMarketsHandler.pages[3] = [build_item('litecoin', 'ltc', 49), build_item('dogecoin', 'doge', 0.01)]
+        shadowed = []
+        tickers = coingecko_api.get_all_tickers(page_count=3, base_url=self.base_url, shadowed=shadowed)
+        self.assertEqual(50, tickers['LTC'].usd_price)
+        self.assertEqual(['bitcoin-fork'], [ticker.currency_id for ticker in shadowed])
+
+    def test_async_fetch(self):
+        StubMarketsHandler.delays = {1: 0.2, 3: 2}
+
+        async def fetch():
+            async with coingecko_api.build_async_client() as client:
+                shadowed = []
+                report = coingecko_api.RefreshReport()
+                tickers = await coingecko_api.get_all_tickers_async(client, page_count=3, refresh_timeout=0.8,
+                                                                    base_url=self.base_url, shadowed=shadowed,
+                                                                    report=report)
+                return tickers, shadowed, report
+
+        tickers, shadowed, report = asyncio.run(fetch())
+        self.assertEqual(1, report.failed)
+        self.assertEqual(['BTC', 'ETH', 'LTC'], list(tickers.keys()))
+        self.assertEqual('bitcoin', tickers['BTC'].currency_id)
+        self.assertEqual(['bitcoin-fork'], [ticker.currency_id for ticker in shadowed])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+
+from coingeckoapi.exchange_rates import ExchangeRates
+from coingeckoapi.tests.page_tiers_tests import FakeClock
+
+
+class ExchangeRatesTests(unittest.TestCase):
+    def test_fetched_once_per_interval(self):
+        clock = FakeClock()
+        rates = ExchangeRates(interval=60, clock=clock)
+        self.assertTrue(rates.due())
+        self.assertEqual({'EUR': 0.9}, rates.update({'EUR': 0.9}))
+        clock.now += 30
+        self.assertFalse(rates.due())
+        clock.now += 30
+        self.assertTrue(rates.due())
+
+    def test_failed_fetch_keeps_previous_table(self):
+        clock = FakeClock()
+        rates = ExchangeRates(interval=60, clock=clock)
+        rates.update({'EUR': 0.9})
+        clock.now += 60
+        self.assertEqual({'EUR': 0.9}, rates.update({}))
+        self.assertTrue(rates.due())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+
+from coingeckoapi.page_tiers import PageTiers
+from cryptoshared.market_row import MarketRow
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def build_page(page_number):
+    return [MarketRow('CoinGecko', 'coin-{}-{}'.format(page_number, index), 'Coin', 'C{}{}'.format(page_number, index),
+                      1.0, None, None, None, None, None, None, None) for index in range(3)]
+
+
+class PageTiersTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.tiers = PageTiers(page_count=8, hot_pages=1, max_pages=3, cold_interval=60, demand_window=600,
+                               clock=self.clock)
+
+    def refresh(self, seconds=10):
+        pages = self.tiers.plan()
+        self.tiers.update({page: build_page(page) for page in pages})
+        self.clock.now += seconds
+        return pages
+
+    def test_first_refresh_fetches_everything(self):
+        self.assertEqual(list(range(1, 9)), self.refresh())
+        self.assertEqual([1], self.refresh())
+        self.assertEqual(8, len(self.tiers.pages()))
+
+    def test_cold_pages_rotate_oldest_first(self):
+        self.refresh(60)
+        self.assertEqual([1, 2, 3], self.refresh())
+        self.assertEqual([1, 4, 5], self.refresh())
+        self.assertEqual([1, 6, 7], self.refresh())
+        self.assertEqual([1, 8], self.refresh())
+        # pages 2 and 3 were fetched 40 and 50 seconds ago
+        self.assertEqual([1], self.refresh())
+        self.assertEqual([1], self.refresh())
+        self.assertEqual([1, 2, 3], self.refresh())
+
+    def test_demanded_pages_every_refresh(self):
+        self.refresh()
+        self.tiers.record_demand(['coin-5-0', 'coin-7-1', 'coin-7-2', 'coin-1-0', 'unknown'])
+        self.assertEqual([1, 5, 7], self.refresh())
+        self.assertEqual([1, 5, 7], self.refresh())
+        self.assertEqual({'hot': 10, 'demand': 10, 'cold': 30}, self.tiers.freshness())
+        # the most requested page wins when there are more demanded pages than room
+        self.tiers.record_demand(['coin-3-0'])
+        self.assertEqual([1, 3, 7], self.refresh())
+        # demand expires
+        self.clock.now += 600
+        self.assertEqual(3, len(self.refresh()))
+        self.assertNotIn('demand', self.tiers.freshness())
+
+    def test_failed_page_keeps_previous_copy(self):
+        self.refresh()
+        self.tiers.update({})
+        self.assertEqual(build_page(4), self.tiers.pages()[4])
+
+    def test_coin_that_moved_to_a_cached_page_is_kept(self):
+        def row(currency_id, market_cap):
+            return MarketRow('CoinGecko', currency_id, 'Coin', currency_id.upper(), 1.0, market_cap, None, None, None,
+                             None, None, None)
+
+        def ids(pages):
+            return [row.currency_id for page in sorted(pages) for row in pages[page]]
+
+        tiers = PageTiers(page_count=2, hot_pages=1, max_pages=2, cold_interval=60, clock=self.clock)
+        tiers.update({1: [row('aaa', 90), row('bbb', 80), row('xxx', 70)], 2: [row('yyy', 60), row('zzz', 50)]})
+        # yyy overtook xxx: page 1 is fetched again, page 2 still holds the copy from before the swap
+        tiers.update({1: [row('aaa', 90), row('bbb', 80), row('yyy', 75)]})
+        self.assertEqual(['aaa', 'bbb', 'yyy', 'xxx', 'yyy', 'zzz'], ids(tiers.pages()))
+        # the page xxx moved to is fetched by the next refresh, and a request for xxx is a request for that page
+        self.assertEqual([1, 2], tiers.plan())
+        tiers.record_demand(['xxx'])
+        self.assertEqual([2], tiers._get_demanded_pages(self.clock()))
+        tiers.update({1: [row('aaa', 90), row('bbb', 80), row('yyy', 75)], 2: [row('xxx', 70), row('zzz', 50)]})
+        self.assertEqual(['aaa', 'bbb', 'yyy', 'xxx', 'zzz'], ids(tiers.pages()))
+
+    def test_fetched_mask(self):
+        self.refresh()
+        self.tiers.update({1: build_page(1)})
+        pages = self.tiers.pages()
+        other = MarketRow('Other', 'coin-2-0', 'Coin', 'C20', 2.0, None, None, None, None, None, None, None)
+        # page 2 is the copy of the first refresh, a row of another source with the same id was fetched now
+        self.assertEqual([True, True, False, True], self.tiers.fetched_mask(pages[1][:2] + pages[2][:1] + [other]))
+
+    def test_coin_that_left_the_listing_is_not_kept(self):
+        self.refresh()
+        self.tiers.update({8: build_page(8)[:2]})
+        self.assertEqual(2, len(self.tiers.pages()[8]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import random
+import unittest
+
+from coingeckoapi.coingecko_api import RefreshReport
+from coingeckoapi.refresh_scheduler import RefreshScheduler, CLOSED, OPEN, HALF_OPEN
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def build_report(requests=12, failed=0, rate_limited=0, retry_after=None):
+    report = RefreshReport()
+    report.requests = requests
+    report.failed = failed
+    report.rate_limited = rate_limited
+    report.retry_after = retry_after
+    return report
+
+
+class RefreshSchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = RefreshScheduler(interval=10, budget=30, budget_window=60, page_count=12, min_backoff=30,
+                                          max_backoff=120, failure_threshold=3, open_time=300, jitter=0,
+                                          clock=self.clock)
+
+    def refresh(self, report=None, ok=True):
+        self.scheduler.record(build_report() if report is None else report, ok)
+        delay = self.scheduler.next_delay()
+        self.clock.now += delay
+        return delay
+
+    def test_budget(self):
+        # 12 requests per refresh and 30 per minute: two refreshes fit, the third waits for the first to expire
+        self.assertEqual(10, self.refresh())
+        self.assertEqual(50, self.refresh())
+        self.assertEqual(10, self.refresh())
+        self.assertEqual(50, self.refresh())
+        # by then only the last refresh is still inside the window
+        self.assertEqual(12, self.scheduler.stats()['budget_used'])
+
+    def test_rate_limit_backoff(self):
+        self.assertEqual(30, self.refresh(build_report(rate_limited=12), ok=False))
+        self.assertEqual(60, self.refresh(build_report(rate_limited=3), ok=True))
+        # retry-after wins when it is longer than the backoff
+        self.assertEqual(200, self.refresh(build_report(rate_limited=1, retry_after=200), ok=True))
+        self.assertEqual(120, self.refresh(build_report(rate_limited=1), ok=True))
+        # a clean refresh resets the backoff
+        self.refresh(build_report(requests=0), ok=True)
+        self.assertEqual(30, self.refresh(build_report(requests=0, rate_limited=1), ok=True))
+
+    def test_late_reports(self):
+        self.scheduler.record(build_report(requests=4), True)
+        # a hedge loser that returned after the refresh was recorded
+        self.scheduler.record_late(build_report(requests=12))
+        self.scheduler.record_late(build_report(requests=1, rate_limited=1, retry_after=90))
+        stats = self.scheduler.stats()
+        self.assertEqual((17, 1, 0, CLOSED), (stats['budget_used'], stats['refreshes'], stats['failures'],
+                                              stats['state']))
+        self.assertEqual(90, self.scheduler.next_delay())
+
+    def test_circuit_breaker(self):
+        failed = build_report(requests=12, failed=12)
+        self.refresh(failed, ok=False)
+        self.refresh(failed, ok=False)
+        self.assertEqual(CLOSED, self.scheduler.stats()['state'])
+        self.scheduler.record(failed, ok=False)
+        self.assertEqual(OPEN, self.scheduler.stats()['state'])
+        self.assertEqual(300, self.scheduler.next_delay())
+        self.clock.now += 300
+        self.assertEqual(HALF_OPEN, self.scheduler.stats()['state'])
+        # the trial refresh fails, so the circuit opens again without waiting for three more failures
+        self.scheduler.record(failed, ok=False)
+        self.assertEqual(OPEN, self.scheduler.stats()['state'])
+        self.clock.now += 300
+        self.refresh(build_report(), ok=True)
+        self.assertEqual(CLOSED, self.scheduler.stats()['state'])
+        self.assertEqual(0, self.scheduler.stats()['failures'])
+
+    def test_jitter_only_adds(self):
+        scheduler = RefreshScheduler(interval=10, jitter=0.5, clock=self.clock, rng=random.Random(1))
+        delays = [scheduler.next_delay() for _ in range(100)]
+        self.assertTrue(all(10 <= delay <= 15 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+from datetime import datetime
+
+from sqlalchemy import update
+
+from cryptodata import data_models, price_req_repo
+from cryptodata.data_models import TelegramUser, TelegramChat, CryptoCurrency
+
+
+def add_alert(session_maker, tg_user_id, tg_chat_id, ticker_symbol, metric, direction, threshold):
+    # returns the id of the new alert
+    db_session = None
+    try:
+        db_session = session_maker()
+        # the same upserts as the price request log, so rows created concurrently by another writer are reused
+        ticker_symbol = ticker_symbol[:price_req_repo.TICKER_SYMBOL_LENGTH]
+        alert = data_models.PriceAlert()
+        alert.user_id = price_req_repo._upsert_dimension(db_session, TelegramUser, TelegramUser.telegram_id,
+                                                         [tg_user_id])[tg_user_id]
+        alert.chat_id = price_req_repo._upsert_dimension(db_session, TelegramChat, TelegramChat.telegram_id,
+                                                         [tg_chat_id])[tg_chat_id]
+        alert.crypto_id = price_req_repo._upsert_dimension(db_session, CryptoCurrency, CryptoCurrency.ticker_symbol,
+                                                           [ticker_symbol])[ticker_symbol]
+        alert.metric = metric
+        alert.direction = direction
+        alert.threshold = threshold
+        alert.armed = True
+        alert.created_dt = datetime.utcnow()
+        db_session.add(alert)
+        db_session.commit()
+        return alert.id
+    finally:
+        if db_session is not None:
+            db_session.close()
+
+
+def delete_alert(session_maker, alert_id):
+    db_session = None
+    try:
+        db_session = session_maker()
+        db_session.query(data_models.PriceAlert).filter(data_models.PriceAlert.id == alert_id).delete()
+        db_session.commit()
+    finally:
+        if db_session is not None:
+            db_session.close()
+
+
+def get_alerts(session_maker):
+    # every stored alert as (id, tg_user_id, tg_chat_id, ticker_symbol, metric, direction, threshold, armed)
+    db_session = None
+    try:
+        db_session = session_maker()
+        alert = data_models.PriceAlert
+        return db_session.query(alert.id, TelegramUser.telegram_id, TelegramChat.telegram_id,
+                                CryptoCurrency.ticker_symbol, alert.metric, alert.direction, alert.threshold,
+                                alert.armed) \
+            .join(TelegramUser, alert.user_id == TelegramUser.id) \
+            .join(TelegramChat, alert.chat_id == TelegramChat.id) \
+            .join(CryptoCurrency, alert.crypto_id == CryptoCurrency.id) \
+            .order_by(alert.id).all()
+    finally:
+        if db_session is not None:
+            db_session.close()
+
+
+def set_armed(session_maker, armed_by_id):
+    # {alert_id: armed} for the alerts that fired or re-armed in the last refresh
+    if not armed_by_id:
+        return
+    db_session = None
+    try:
+        db_session = session_maker()
+        for armed in (True, False):
+            alert_ids = [alert_id for alert_id, value in armed_by_id.items() if value == armed]
+            if alert_ids:
+                db_session.execute(update(data_models.PriceAlert.__table__)
+                                   .where(data_models.PriceAlert.id.in_(alert_ids)).values(armed=armed))
+        db_session.commit()
+    finally:
+        if db_session is not None:
+            db_session.close()
+
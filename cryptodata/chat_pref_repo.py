@@ -0,0 +1,36 @@
+from cryptodata import price_req_repo
+from cryptodata.data_models import TelegramChat, ChatPreference
+
+
+def set_quote_currency(session_maker, tg_chat_id, quote_currency):
+    # None goes back to USD
+    db_session = None
+    try:
+        db_session = session_maker()
+        # the same upsert as the price request log, so a chat created concurrently by another writer is reused
+        chat_id = price_req_repo._upsert_dimension(db_session, TelegramChat, TelegramChat.telegram_id,
+                                                   [tg_chat_id])[tg_chat_id]
+        preference = db_session.query(ChatPreference).filter(ChatPreference.chat_id == chat_id).first()
+        if quote_currency is None:
+            if preference is not None:
+                db_session.delete(preference)
+        elif preference is None:
+            db_session.add(ChatPreference(chat_id=chat_id, quote_currency=quote_currency))
+        else:
+            preference.quote_currency = quote_currency
+        db_session.commit()
+    finally:
+        if db_session is not None:
+            db_session.close()
+
+
+def get_quote_currencies(session_maker):
+    # {tg_chat_id: quote currency} of every chat that set one
+    db_session = None
+    try:
+        db_session = session_maker()
+        return dict(db_session.query(TelegramChat.telegram_id, ChatPreference.quote_currency)
+                    .join(ChatPreference, ChatPreference.chat_id == TelegramChat.id).all())
+    finally:
+        if db_session is not None:
+            db_session.close()
@@ -1,5 +1,6 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, BIGINT
+from sqlalchemy import Column, Integer, String, DateTime, Date, ForeignKey, BIGINT, Float, Boolean, \
+    UniqueConstraint, inspect
 from sqlalchemy.orm import relationship
 
 from cryptodata import db_connection
@@ -38,12 +39,77 @@ class PriceRequest(Base):
     user_id = Column(Integer, ForeignKey("telegram_user.id"), nullable=False)
     chat_id = Column(Integer, ForeignKey("telegram_chat.id"), nullable=False)
     crypto_id = Column(Integer, ForeignKey("cryptocurrency.id"), nullable=False)
-    request_dt = Column(DateTime, nullable=False)
+    request_dt = Column(DateTime, nullable=False, index=True)
     user = relationship("TelegramUser", back_populates="requests")
     chat = relationship("TelegramChat", back_populates="requests")
     crypto = relationship("CryptoCurrency", back_populates="requests")
 
 
+# rollups of price_request, kept up to date by price_req_repo.log_price_requests
+class CryptoRequestHourly(Base):
+    __tablename__ = 'crypto_request_hourly'
+
+    request_hour = Column(DateTime, primary_key=True)
+    crypto_id = Column(Integer, ForeignKey("cryptocurrency.id"), primary_key=True)
+    request_count = Column(Integer, nullable=False, default=0)
+    crypto = relationship("CryptoCurrency")
+
+
+class ChatRequestDaily(Base):
+    __tablename__ = 'chat_request_daily'
+
+    request_day = Column(Date, primary_key=True)
+    chat_id = Column(Integer, ForeignKey("telegram_chat.id"), primary_key=True)
+    request_count = Column(Integer, nullable=False, default=0)
+    chat = relationship("TelegramChat")
+
+
+class PriceAlert(Base):
+    __tablename__ = 'price_alert'
+    __table_args__ = (UniqueConstraint('chat_id', 'crypto_id', 'metric', 'direction', 'threshold'),)
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("telegram_user.id"), nullable=False)
+    chat_id = Column(Integer, ForeignKey("telegram_chat.id"), nullable=False)
+    crypto_id = Column(Integer, ForeignKey("cryptocurrency.id"), nullable=False)
+    # 'price' or a change window like '1h', see cryptoshared.price_alerts
+    metric = Column(String(10), nullable=False)
+    direction = Column(String(1), nullable=False)
+    threshold = Column(Float, nullable=False)
+    armed = Column(Boolean, nullable=False, default=True)
+    created_dt = Column(DateTime, nullable=False)
+    user = relationship("TelegramUser")
+    chat = relationship("TelegramChat")
+    crypto = relationship("CryptoCurrency")
+
+
+# per chat settings, see chat_pref_repo
+class ChatPreference(Base):
+    __tablename__ = 'chat_preference'
+
+    chat_id = Column(Integer, ForeignKey("telegram_chat.id"), primary_key=True)
+    # default quote currency of /p and /cap, e.g. 'EUR'
+    quote_currency = Column(String(10), nullable=False)
+    chat = relationship("TelegramChat")
+
+
 def create_db(dbstring):
     engine = db_connection.create_db(dbstring)
     Base.metadata.create_all(engine)
+    add_missing_indexes(engine)
+
+
+def add_missing_indexes(engine):
+    # create_all only creates missing tables, so an index added to an existing table (e.g. price_request.request_dt)
+    # is created here. returns the names of the indexes created.
+    inspector = inspect(engine)
+    created = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(engine)
+                created.append(index.name)
+    return created
@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+
+from cryptodata.data_models import TelegramUser, TelegramChat, CryptoCurrency
+
+MAX_USERS = 100000
+MAX_CHATS = 50000
+MAX_CRYPTOS = 20000
+
+
+class IdCache:
+    # bounded LRU map of natural key (telegram id or ticker symbol) -> surrogate id for one dimension table
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get_many(self, keys):
+        # returns ({key: id} for the cached keys, set of keys that are not cached)
+        found = {}
+        missing = set()
+        with self._lock:
+            for key in keys:
+                row_id = self._ids.get(key)
+                if row_id is None:
+                    missing.add(key)
+                else:
+                    self._ids.move_to_end(key)
+                    found[key] = row_id
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, ids):
+        with self._lock:
+            for key, row_id in ids.items():
+                self._ids[key] = row_id
+                self._ids.move_to_end(key)
+            while len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+
+
+class DimensionCache:
+    # Ids of the telegram_user, telegram_chat and cryptocurrency rows. Those rows are never updated once created,
+    # so a cached id stays valid for the life of the process.
+    def __init__(self, max_users=MAX_USERS, max_chats=MAX_CHATS, max_cryptos=MAX_CRYPTOS):
+        self.users = IdCache(max_users)
+        self.chats = IdCache(max_chats)
+        self.cryptos = IdCache(max_cryptos)
+
+    def warm(self, session_maker):
+        # loads the most recently created rows of each table, up to the size of its cache
+        db_session = None
+        try:
+            db_session = session_maker()
+            for id_cache, model, key_column in self.dimensions():
+                rows = db_session.query(key_column, model.id).order_by(model.id.desc()).limit(id_cache.max_size).all()
+                id_cache.put_many(dict(reversed(rows)))
+        finally:
+            if db_session is not None:
+                db_session.close()
+
+    def dimensions(self):
+        return [(self.users, TelegramUser, TelegramUser.telegram_id),
+                (self.chats, TelegramChat, TelegramChat.telegram_id),
+                (self.cryptos, CryptoCurrency, CryptoCurrency.ticker_symbol)]
+
+    def stats(self):
+        return {name: {'size': len(id_cache), 'hits': id_cache.hits, 'misses': id_cache.misses}
+                for name, id_cache in [('users', self.users), ('chats', self.chats), ('cryptos', self.cryptos)]}
@@ -0,0 +1,138 @@
+import csv
+import gzip
+import os
+import threading
+from datetime import datetime, timedelta
+
+from cryptodata.data_models import *
+
+# requests newer than this stay in the price_request table
+HOT_DAYS = 90
+CHUNK_SIZE = 5000
+# seconds between archive runs, and the pause between two chunks of a run so request logging is never starved
+ARCHIVE_INTERVAL = 3600
+CHUNK_PAUSE = 0.5
+ARCHIVE_COLUMNS = ['id', 'user_id', 'chat_id', 'crypto_id', 'request_dt']
+_DT_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+class PriceRequestArchiver:
+    # Moves price_request rows older than hot_days out of the db into one gzip compressed csv file per day in
+    # archive_dir, a chunk of at most chunk_size rows per transaction. Rows are written and synced to disk before
+    # they are deleted, so a crash can at worst archive a chunk twice; read_archived() skips the duplicates.
+    # The rollup tables are left alone, so /stats keeps covering archived requests.
+    def __init__(self, session_maker, archive_dir, hot_days=HOT_DAYS, chunk_size=CHUNK_SIZE,
+                 interval=ARCHIVE_INTERVAL, chunk_pause=CHUNK_PAUSE, logger=None):
+        self.session_maker = session_maker
+        self.archive_dir = archive_dir
+        self.hot_days = hot_days
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self.chunk_pause = chunk_pause
+        self.logger = logger
+        self.archived = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='price-request-archiver')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self, timeout=30):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def archive_once(self, now=None):
+        # archives everything older than the hot window, returns the number of rows moved
+        cutoff = (datetime.utcnow() if now is None else now) - timedelta(days=self.hot_days)
+        total = 0
+        while not self._stop.is_set():
+            count = self._archive_chunk(cutoff)
+            total += count
+            if count < self.chunk_size:
+                break
+            self._stop.wait(self.chunk_pause)
+        self.archived += total
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                count = self.archive_once()
+                if count and self.logger is not None:
+                    self.logger.info('Archived {} price requests to {}'.format(count, self.archive_dir))
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.exception('An error occurred while archiving price requests:')
+            self._stop.wait(self.interval)
+
+    def _archive_chunk(self, cutoff):
+        db_session = None
+        try:
+            db_session = self.session_maker()
+            rows = db_session.query(PriceRequest.id, PriceRequest.user_id, PriceRequest.chat_id,
+                                    PriceRequest.crypto_id, PriceRequest.request_dt) \
+                .filter(PriceRequest.request_dt < cutoff) \
+                .order_by(PriceRequest.id) \
+                .limit(self.chunk_size).all()
+            if not rows:
+                return 0
+            rows_by_day = {}
+            for row in rows:
+                rows_by_day.setdefault(row.request_dt.date(), []).append(row)
+            for day, day_rows in rows_by_day.items():
+                _append_archive_file(archive_path(self.archive_dir, day), day_rows)
+            db_session.query(PriceRequest).filter(PriceRequest.id.in_([row.id for row in rows])) \
+                .delete(synchronize_session=False)
+            db_session.commit()
+            return len(rows)
+        except Exception:
+            if db_session is not None:
+                db_session.rollback()
+            raise
+        finally:
+            if db_session is not None:
+                db_session.close()
+
+
+def archive_path(archive_dir, day):
+    return os.path.join(archive_dir, 'price_request_{}.csv.gz'.format(day.isoformat()))
+
+
+def read_archived(archive_dir, start_dt, end_dt):
+    # yields archived requests with start_dt <= request_dt < end_dt as dicts, oldest file first
+    seen_ids = set()
+    day = start_dt.date()
+    while datetime.combine(day, datetime.min.time()) < end_dt:
+        path = archive_path(archive_dir, day)
+        if os.path.exists(path):
+            with gzip.open(path, 'rt', newline='') as archive_file:
+                for record in csv.DictReader(archive_file):
+                    row = {'id': int(record['id']), 'user_id': int(record['user_id']),
+                           'chat_id': int(record['chat_id']), 'crypto_id': int(record['crypto_id']),
+                           'request_dt': datetime.strptime(record['request_dt'], _DT_FORMAT)}
+                    if start_dt <= row['request_dt'] < end_dt and row['id'] not in seen_ids:
+                        seen_ids.add(row['id'])
+                        yield row
+        day += timedelta(days=1)
+
+
+def _append_archive_file(path, rows):
+    # every append is a separate gzip member, which gzip readers treat as one continuous stream
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    write_header = not os.path.exists(path)
+    with open(path, 'ab') as raw_file:
+        with gzip.GzipFile(fileobj=raw_file, mode='wb') as gzip_file:
+            lines = []
+            if write_header:
+                lines.append(','.join(ARCHIVE_COLUMNS))
+            for row in rows:
+                lines.append('{},{},{},{},{}'.format(row.id, row.user_id, row.chat_id, row.crypto_id,
+                                                     row.request_dt.strftime(_DT_FORMAT)))
+            gzip_file.write(('\n'.join(lines) + '\n').encode())
+        raw_file.flush()
+        os.fsync(raw_file.fileno())
@@ -1,9 +1,18 @@
 from datetime import datetime
 
+from collections import Counter
+
+from sqlalchemy import insert
+from sqlalchemy.dialects import mysql, sqlite
+
 from cryptodata.data_models import *
 
+# longer symbols are cut to the column's length, mysql would truncate them on insert and the lookup would miss
+TICKER_SYMBOL_LENGTH = CryptoCurrency.ticker_symbol.type.length
+
 
 def log_price_request(session_maker, tg_user_id, tg_chat_id, ticker_symbol):
+    ticker_symbol = ticker_symbol[:TICKER_SYMBOL_LENGTH]
     db_session = None
     try:
         db_session = session_maker()
@@ -31,7 +40,127 @@ def log_price_request(session_maker, tg_user_id, tg_chat_id, ticker_symbol):
         price_req.crypto_id = db_crypto.id
         price_req.request_dt = datetime.utcnow()
         db_session.add(price_req)
+        _update_rollups(db_session, [{'chat_id': db_chat.id, 'crypto_id': db_crypto.id,
+                                      'request_dt': price_req.request_dt}])
         db_session.commit()
     finally:
         if db_session is not None:
             db_session.close()
+
+
+def log_price_requests(session_maker, price_requests, dimension_cache=None):
+    # bulk version of log_price_request for a list of (tg_user_id, tg_chat_id, ticker_symbol, request_dt) tuples.
+    # missing users, chats and cryptos are inserted first (duplicates ignored), then every request row is written
+    # with one multi-row insert, all in a single transaction. with a dimension_cache.DimensionCache, ids that are
+    # already cached are not looked up again. requests whose user, chat or crypto could not be stored are skipped
+    # instead of failing the batch, returns the number of requests written.
+    if not price_requests:
+        return 0
+    price_requests = [(tg_user_id, tg_chat_id,
+                       ticker_symbol[:TICKER_SYMBOL_LENGTH] if ticker_symbol is not None else None, request_dt)
+                      for tg_user_id, tg_chat_id, ticker_symbol, request_dt in price_requests]
+    db_session = None
+    try:
+        db_session = session_maker()
+        new_ids = []
+        user_ids = _resolve_ids(db_session, TelegramUser, TelegramUser.telegram_id,
+                                {tg_user_id for tg_user_id, _, _, _ in price_requests},
+                                dimension_cache.users if dimension_cache is not None else None, new_ids)
+        chat_ids = _resolve_ids(db_session, TelegramChat, TelegramChat.telegram_id,
+                                {tg_chat_id for _, tg_chat_id, _, _ in price_requests},
+                                dimension_cache.chats if dimension_cache is not None else None, new_ids)
+        crypto_ids = _resolve_ids(db_session, CryptoCurrency, CryptoCurrency.ticker_symbol,
+                                  {ticker_symbol for _, _, ticker_symbol, _ in price_requests},
+                                  dimension_cache.cryptos if dimension_cache is not None else None, new_ids)
+        rows = [{'user_id': user_ids[tg_user_id], 'chat_id': chat_ids[tg_chat_id],
+                 'crypto_id': crypto_ids[ticker_symbol], 'request_dt': request_dt}
+                for tg_user_id, tg_chat_id, ticker_symbol, request_dt in price_requests
+                if tg_user_id in user_ids and tg_chat_id in chat_ids and ticker_symbol in crypto_ids]
+        if rows:
+            db_session.execute(insert(PriceRequest.__table__), rows)
+            _update_rollups(db_session, rows)
+        db_session.commit()
+        # only cache ids once they are committed, a rolled back insert must not leave a dangling id behind
+        for id_cache, ids in new_ids:
+            id_cache.put_many(ids)
+        return len(rows)
+    except Exception:
+        if db_session is not None:
+            db_session.rollback()
+        raise
+    finally:
+        if db_session is not None:
+            db_session.close()
+
+
+def backfill_rollups(session_maker, batch_size=10000):
+    # rebuilds the rollup tables from every row in price_request, e.g. for requests logged before they existed
+    db_session = None
+    try:
+        db_session = session_maker()
+        db_session.query(CryptoRequestHourly).delete()
+        db_session.query(ChatRequestDaily).delete()
+        batch = []
+        query = db_session.query(PriceRequest.chat_id, PriceRequest.crypto_id, PriceRequest.request_dt)
+        for chat_id, crypto_id, request_dt in query.yield_per(batch_size):
+            batch.append({'chat_id': chat_id, 'crypto_id': crypto_id, 'request_dt': request_dt})
+            if len(batch) >= batch_size:
+                _update_rollups(db_session, batch)
+                batch = []
+        _update_rollups(db_session, batch)
+        db_session.commit()
+    except Exception:
+        if db_session is not None:
+            db_session.rollback()
+        raise
+    finally:
+        if db_session is not None:
+            db_session.close()
+
+
+def _update_rollups(db_session, price_request_rows):
+    hourly_counts = Counter((row['request_dt'].replace(minute=0, second=0, microsecond=0), row['crypto_id'])
+                            for row in price_request_rows)
+    daily_counts = Counter((row['request_dt'].date(), row['chat_id']) for row in price_request_rows)
+    _increment_counts(db_session, CryptoRequestHourly.__table__, ('request_hour', 'crypto_id'), hourly_counts)
+    _increment_counts(db_session, ChatRequestDaily.__table__, ('request_day', 'chat_id'), daily_counts)
+
+
+def _increment_counts(db_session, table, key_names, counts):
+    # adds each count to its row, creating the row when it does not exist yet
+    if not counts:
+        return
+    rows = [dict(zip(key_names, key), request_count=count) for key, count in counts.items()]
+    if db_session.get_bind().dialect.name == 'mysql':
+        statement = mysql.insert(table)
+        statement = statement.on_duplicate_key_update(
+            request_count=table.c.request_count + statement.inserted.request_count)
+    else:
+        statement = sqlite.insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(key_names),
+            set_={'request_count': table.c.request_count + statement.excluded.request_count})
+    db_session.execute(statement, rows)
+
+
+def _resolve_ids(db_session, model, key_column, keys, id_cache, new_ids):
+    if id_cache is None:
+        return _upsert_dimension(db_session, model, key_column, keys)
+    ids, missing = id_cache.get_many(keys)
+    if missing:
+        missing_ids = _upsert_dimension(db_session, model, key_column, missing)
+        new_ids.append((id_cache, missing_ids))
+        ids.update(missing_ids)
+    return ids
+
+
+def _upsert_dimension(db_session, model, key_column, keys):
+    # returns {key: id}. rows that already exist, including ones another writer creates concurrently, are left as
+    # is: INSERT IGNORE skips them against the unique key and the select that follows reads back the winner's id.
+    rows = [{key_column.key: key} for key in keys]
+    db_session.execute(_insert_ignore(model.__table__), rows)
+    return dict(db_session.query(key_column, model.id).filter(key_column.in_(keys)).all())
+
+
+def _insert_ignore(table):
+    return insert(table).prefix_with('IGNORE', dialect='mysql').prefix_with('OR IGNORE', dialect='sqlite')
@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+from datetime import datetime
+
+from cryptodata import price_req_repo
+
+BATCH_SIZE = 500
+# seconds a request can wait in the queue before its batch is flushed
+FLUSH_INTERVAL = 2.0
+MAX_QUEUE_SIZE = 10000
+# what to do with a new request when the queue is full
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+
+_STOP = object()
+
+
+class PriceRequestWriter:
+    # Write-behind logging for price requests. Handlers call log_price_request(), which only puts the request on a
+    # bounded in-memory queue; a background thread writes the queued requests to the db in batches, whenever
+    # batch_size requests are waiting or the oldest one has waited flush_interval seconds.
+    def __init__(self, session_maker, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 max_queue_size=MAX_QUEUE_SIZE, overflow_policy=DROP_NEWEST, dimension_cache=None, logger=None):
+        if overflow_policy not in (DROP_NEWEST, DROP_OLDEST):
+            raise ValueError('overflow_policy must be \'{}\' or \'{}\''.format(DROP_NEWEST, DROP_OLDEST))
+        self.session_maker = session_maker
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.dimension_cache = dimension_cache
+        self.logger = logger
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='price-request-writer')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def log_price_request(self, tg_user_id, tg_chat_id, ticker_symbol):
+        return self.log_price_requests(tg_user_id, tg_chat_id, [ticker_symbol])
+
+    def log_price_requests(self, tg_user_id, tg_chat_id, ticker_symbols):
+        # queues the tickers of one command as a single entry. never blocks, returns False if the entry was dropped
+        # because the queue was full.
+        request_dt = datetime.utcnow()
+        price_requests = [(tg_user_id, tg_chat_id, ticker_symbol, request_dt) for ticker_symbol in ticker_symbols]
+        try:
+            self._queue.put_nowait(price_requests)
+            return True
+        except queue.Full:
+            pass
+        if self.overflow_policy == DROP_OLDEST:
+            try:
+                self.dropped += len(self._queue.get_nowait())
+                self._queue.put_nowait(price_requests)
+                return True
+            except (queue.Empty, queue.Full):
+                pass
+        self.dropped += len(price_requests)
+        return False
+
+    def close(self, timeout=30):
+        # writes everything still queued, then stops the writer thread
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = self.flush_interval if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                batch.extend(self._drain())
+                self._flush(batch)
+                return
+            if item is not None:
+                batch.extend(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+                deadline = None
+
+    def _drain(self):
+        items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return items
+            if item is not _STOP:
+                items.extend(item)
+
+    def _flush(self, batch):
+        for start in range(0, len(batch), self.batch_size):
+            chunk = batch[start:start + self.batch_size]
+            try:
+                written = price_req_repo.log_price_requests(self.session_maker, chunk, self.dimension_cache)
+            except Exception as e:
+                self.failed += len(chunk)
+                if self.logger is not None:
+                    self.logger.exception('Unable to write {} price requests to the db:'.format(len(chunk)))
+                continue
+            self.written += written
+            if written < len(chunk):
+                self.failed += len(chunk) - written
+                if self.logger is not None:
+                    self.logger.warning('Skipped {} price requests that could not be resolved'.format(
+                        len(chunk) - written))
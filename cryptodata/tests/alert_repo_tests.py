@@ -0,0 +1,37 @@
+import unittest
+
+from cryptodata import alert_repo, price_req_repo
+from cryptodata.data_models import TelegramUser, TelegramChat, CryptoCurrency
+from cryptodata.tests.price_req_repo_tests import build_session_maker
+
+
+class AlertRepoTests(unittest.TestCase):
+    def setUp(self):
+        self.session_maker = build_session_maker(self)
+
+    def test_add_update_delete(self):
+        first_id = alert_repo.add_alert(self.session_maker, 1, 10, 'BTC', 'price', '>', 70000)
+        second_id = alert_repo.add_alert(self.session_maker, 1, 20, 'ETH', '1h', '<', -5)
+        with self.assertRaises(Exception):
+            alert_repo.add_alert(self.session_maker, 2, 10, 'BTC', 'price', '>', 70000)
+        alert_repo.set_armed(self.session_maker, {first_id: False})
+        self.assertEqual([(first_id, 1, 10, 'BTC', 'price', '>', 70000, False),
+                          (second_id, 1, 20, 'ETH', '1h', '<', -5, True)],
+                         [tuple(row) for row in alert_repo.get_alerts(self.session_maker)])
+        alert_repo.delete_alert(self.session_maker, first_id)
+        self.assertEqual([second_id], [row[0] for row in alert_repo.get_alerts(self.session_maker)])
+
+    def test_rows_created_by_another_writer_are_reused(self):
+        long_symbol = 'X' * (price_req_repo.TICKER_SYMBOL_LENGTH + 5)
+        price_req_repo.log_price_request(self.session_maker, 1, 10, long_symbol)
+        alert_id = alert_repo.add_alert(self.session_maker, 1, 10, long_symbol, 'price', '>', 1)
+        self.assertEqual([(alert_id, 1, 10, long_symbol[:price_req_repo.TICKER_SYMBOL_LENGTH])],
+                         [tuple(row[:4]) for row in alert_repo.get_alerts(self.session_maker)])
+        db_session = self.session_maker()
+        self.addCleanup(db_session.close)
+        self.assertEqual([1, 1, 1], [db_session.query(model).count()
+                                     for model in (TelegramUser, TelegramChat, CryptoCurrency)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+from cryptodata import chat_pref_repo, price_req_repo
+from cryptodata.data_models import TelegramChat
+from cryptodata.tests.price_req_repo_tests import build_session_maker
+
+
+class ChatPrefRepoTests(unittest.TestCase):
+    def setUp(self):
+        self.session_maker = build_session_maker(self)
+
+    def test_set_change_and_reset(self):
+        chat_pref_repo.set_quote_currency(self.session_maker, 10, 'EUR')
+        chat_pref_repo.set_quote_currency(self.session_maker, 20, 'JPY')
+        chat_pref_repo.set_quote_currency(self.session_maker, 10, 'GBP')
+        self.assertEqual({10: 'GBP', 20: 'JPY'}, chat_pref_repo.get_quote_currencies(self.session_maker))
+        chat_pref_repo.set_quote_currency(self.session_maker, 20, None)
+        chat_pref_repo.set_quote_currency(self.session_maker, 30, None)
+        self.assertEqual({10: 'GBP'}, chat_pref_repo.get_quote_currencies(self.session_maker))
+
+    def test_chat_created_by_another_writer_is_reused(self):
+        price_req_repo.log_price_request(self.session_maker, 1, 10, 'BTC')
+        chat_pref_repo.set_quote_currency(self.session_maker, 10, 'EUR')
+        self.assertEqual({10: 'EUR'}, chat_pref_repo.get_quote_currencies(self.session_maker))
+        db_session = self.session_maker()
+        self.addCleanup(db_session.close)
+        self.assertEqual(1, db_session.query(TelegramChat).count())
+
+
+if __name__ == '__main__':
+    unittest.main()
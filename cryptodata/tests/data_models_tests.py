@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine, inspect
+
+from cryptodata import data_models
+from cryptodata.data_models import Base, PriceRequest
+
+
+class AddMissingIndexesTests(unittest.TestCase):
+    def setUp(self):
+        db_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(db_dir.cleanup)
+        self.engine = create_engine('sqlite:///{}'.format(os.path.join(db_dir.name, 'cryptopricebot.db')))
+        self.addCleanup(self.engine.dispose)
+
+    def index_names(self):
+        return {index['name'] for index in inspect(self.engine).get_indexes(PriceRequest.__tablename__)}
+
+    def test_index_is_added_to_an_existing_table(self):
+        Base.metadata.create_all(self.engine)
+        request_dt_index, = PriceRequest.__table__.indexes
+        # a price_request table from before request_dt was indexed
+        request_dt_index.drop(self.engine)
+        self.assertNotIn(request_dt_index.name, self.index_names())
+        self.assertEqual([request_dt_index.name], data_models.add_missing_indexes(self.engine))
+        self.assertIn(request_dt_index.name, self.index_names())
+        self.assertEqual([], data_models.add_missing_indexes(self.engine))
+
+
+if __name__ == '__main__':
+    unittest.main()
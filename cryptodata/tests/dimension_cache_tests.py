@@ -0,0 +1,71 @@
+import unittest
+from datetime import datetime
+
+from sqlalchemy import event
+
+from cryptodata import price_req_repo
+from cryptodata.data_models import TelegramUser, PriceRequest
+from cryptodata.dimension_cache import DimensionCache, IdCache
+from cryptodata.tests.price_req_repo_tests import build_session_maker
+
+
+class IdCacheTests(unittest.TestCase):
+    def test_lru_eviction(self):
+        id_cache = IdCache(max_size=2)
+        id_cache.put_many({1: 10, 2: 20})
+        id_cache.get_many([1])
+        id_cache.put_many({3: 30})
+        found, missing = id_cache.get_many([1, 2, 3])
+        self.assertEqual({1: 10, 3: 30}, found)
+        self.assertEqual({2}, missing)
+        self.assertEqual(3, id_cache.hits)
+        self.assertEqual(1, id_cache.misses)
+
+
+class DimensionCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.session_maker = build_session_maker(self)
+        self.statements = []
+        event.listen(self.session_maker.kw['bind'], 'before_cursor_execute', self.record_statement)
+
+    def record_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement.strip().split()[0].upper())
+
+    def test_steady_state_needs_no_lookups(self):
+        dimension_cache = DimensionCache()
+        now = datetime.utcnow()
+        price_req_repo.log_price_requests(self.session_maker, [(1, 10, 'BTC', now)], dimension_cache)
+        self.statements = []
+        price_req_repo.log_price_requests(self.session_maker, [(1, 10, 'BTC', now), (1, 10, 'BTC', now)],
+                                          dimension_cache)
+        self.assertNotIn('SELECT', self.statements)
+        self.assertTrue(self.statements)
+
+    def test_warm_and_concurrent_creation(self):
+        now = datetime.utcnow()
+        # two writers with their own caches both see user 1 as new, only one row is created
+        price_req_repo.log_price_requests(self.session_maker, [(1, 10, 'BTC', now)], DimensionCache())
+        price_req_repo.log_price_requests(self.session_maker, [(1, 20, 'BTC', now)], DimensionCache())
+        db_session = self.session_maker()
+        try:
+            self.assertEqual(1, db_session.query(TelegramUser).count())
+            self.assertEqual(1, len({r.user_id for r in db_session.query(PriceRequest)}))
+        finally:
+            db_session.close()
+
+        dimension_cache = DimensionCache(max_chats=1)
+        dimension_cache.warm(self.session_maker)
+        self.assertEqual(1, len(dimension_cache.users))
+        found, missing = dimension_cache.chats.get_many([10, 20])
+        self.assertEqual({20}, set(found))
+        self.assertEqual({10}, missing)
+
+    def test_rolled_back_ids_are_not_cached(self):
+        dimension_cache = DimensionCache()
+        with self.assertRaises(Exception):
+            price_req_repo.log_price_requests(self.session_maker, [(1, 10, 'BTC', None)], dimension_cache)
+        self.assertEqual(0, len(dimension_cache.users))
+
+
+if __name__ == '__main__':
+    unittest.main()
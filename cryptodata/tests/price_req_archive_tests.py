@@ -0,0 +1,49 @@
+import gzip
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from cryptodata import price_req_repo
+from cryptodata.data_models import PriceRequest
+from cryptodata.price_req_archive import PriceRequestArchiver, archive_path, read_archived
+from cryptodata.tests.price_req_repo_tests import build_session_maker
+
+
+class PriceRequestArchiverTests(unittest.TestCase):
+    def setUp(self):
+        self.session_maker = build_session_maker(self)
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        self.archive_dir = archive_dir.name
+        self.now = datetime(2026, 3, 10, 12, 0)
+        self.requests = [(1, 10, 'BTC', self.now - timedelta(days=days, hours=hours))
+                         for days in [0, 5, 31, 32, 33, 40] for hours in [1, 2]]
+        price_req_repo.log_price_requests(self.session_maker, self.requests)
+
+    def remaining_dts(self):
+        db_session = self.session_maker()
+        try:
+            return sorted(r.request_dt for r in db_session.query(PriceRequest))
+        finally:
+            db_session.close()
+
+    def test_archive_in_chunks(self):
+        archiver = PriceRequestArchiver(self.session_maker, self.archive_dir, hot_days=30, chunk_size=3,
+                                        chunk_pause=0)
+        self.assertEqual(8, archiver.archive_once(self.now))
+        self.assertEqual(sorted(r[3] for r in self.requests[:4]), self.remaining_dts())
+        self.assertEqual(0, archiver.archive_once(self.now))
+        with gzip.open(archive_path(self.archive_dir, (self.now - timedelta(days=31)).date()), 'rt') as f:
+            self.assertEqual(3, len(f.read().splitlines()))
+
+    def test_read_archived_range(self):
+        PriceRequestArchiver(self.session_maker, self.archive_dir, hot_days=30, chunk_size=5).archive_once(self.now)
+        rows = list(read_archived(self.archive_dir, self.now - timedelta(days=32, hours=1),
+                                  self.now - timedelta(days=31)))
+        self.assertEqual([self.now - timedelta(days=32, hours=1), self.now - timedelta(days=31, hours=2),
+                          self.now - timedelta(days=31, hours=1)], sorted(row['request_dt'] for row in rows))
+        self.assertEqual(8, len(list(read_archived(self.archive_dir, self.now - timedelta(days=60), self.now))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from cryptodata import price_req_repo, price_req_writer
+from cryptodata.data_models import Base, TelegramUser, TelegramChat, CryptoCurrency, PriceRequest
+
+
+def build_session_maker(test_case):
+    # file backed so the writer thread and the test use separate connections
+    db_dir = tempfile.TemporaryDirectory()
+    test_case.addCleanup(db_dir.cleanup)
+    engine = create_engine('sqlite:///{}'.format(os.path.join(db_dir.name, 'cryptopricebot.db')))
+    test_case.addCleanup(engine.dispose)
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+class LogPriceRequestsTests(unittest.TestCase):
+    def setUp(self):
+        self.session_maker = build_session_maker(self)
+
+    def count(self, model):
+        db_session = self.session_maker()
+        try:
+            return db_session.query(model).count()
+        finally:
+            db_session.close()
+
+    def test_bulk_insert_with_dimensions(self):
+        now = datetime.utcnow()
+        price_req_repo.log_price_request(self.session_maker, 1, 10, 'BTC')
+        price_req_repo.log_price_requests(self.session_maker, [(1, 10, 'BTC', now), (2, 10, 'ETH', now),
+                                                               (2, 20, 'BTC', now)])
+        self.assertEqual(2, self.count(TelegramUser))
+        self.assertEqual(2, self.count(TelegramChat))
+        self.assertEqual(2, self.count(CryptoCurrency))
+        self.assertEqual(4, self.count(PriceRequest))
+        db_session = self.session_maker()
+        try:
+            eth_request = db_session.query(PriceRequest).join(CryptoCurrency) \
+                .filter(CryptoCurrency.ticker_symbol == 'ETH').one()
+            self.assertEqual(2, eth_request.user.telegram_id)
+            self.assertEqual(10, eth_request.chat.telegram_id)
+        finally:
+            db_session.close()
+
+    def test_long_symbols_are_truncated_and_unresolved_rows_skipped(self):
+        now = datetime.utcnow()
+        long_symbol = 'X' * (price_req_repo.TICKER_SYMBOL_LENGTH + 5)
+        # a null symbol is ignored by the insert and never resolves, only its own request is dropped
+        written = price_req_repo.log_price_requests(self.session_maker, [(1, 10, long_symbol, now),
+                                                                         (1, 10, None, now), (1, 10, 'BTC', now)])
+        self.assertEqual(2, written)
+        self.assertEqual(2, self.count(PriceRequest))
+        price_req_repo.log_price_request(self.session_maker, 1, 10, long_symbol)
+        db_session = self.session_maker()
+        try:
+            symbols = [symbol for symbol, in db_session.query(CryptoCurrency.ticker_symbol)]
+        finally:
+            db_session.close()
+        self.assertEqual(sorted(['BTC', long_symbol[:price_req_repo.TICKER_SYMBOL_LENGTH]]), sorted(symbols))
+        self.assertEqual(3, self.count(PriceRequest))
+
+
+class PriceRequestWriterTests(unittest.TestCase):
+    def setUp(self):
+        self.session_maker = build_session_maker(self)
+
+    def count_requests(self):
+        db_session = self.session_maker()
+        try:
+            return db_session.query(PriceRequest).count()
+        finally:
+            db_session.close()
+
+    def test_flush_on_batch_size(self):
+        writer = price_req_writer.PriceRequestWriter(self.session_maker, batch_size=3, flush_interval=60).start()
+        for i in range(3):
+            writer.log_price_request(i, 1, 'BTC')
+        for _ in range(100):
+            if self.count_requests() == 3:
+                break
+            time.sleep(0.02)
+        self.assertEqual(3, self.count_requests())
+        writer.close()
+
+    def test_flush_on_interval_and_close(self):
+        writer = price_req_writer.PriceRequestWriter(self.session_maker, batch_size=100, flush_interval=0.1).start()
+        writer.log_price_request(1, 1, 'BTC')
+        time.sleep(0.4)
+        self.assertEqual(1, self.count_requests())
+        writer.log_price_request(1, 1, 'ETH')
+        writer.close()
+        self.assertEqual(2, self.count_requests())
+        self.assertEqual(2, writer.written)
+
+    def test_overflow_policy(self):
+        writer = price_req_writer.PriceRequestWriter(self.session_maker, max_queue_size=2)
+        self.assertTrue(writer.log_price_request(1, 1, 'BTC'))
+        self.assertTrue(writer.log_price_request(1, 1, 'ETH'))
+        self.assertFalse(writer.log_price_request(1, 1, 'LTC'))
+        self.assertEqual(1, writer.dropped)
+
+        writer = price_req_writer.PriceRequestWriter(self.session_maker, max_queue_size=2,
+                                                     overflow_policy=price_req_writer.DROP_OLDEST)
+        for ticker_symbol in ['BTC', 'ETH', 'LTC']:
+            self.assertTrue(writer.log_price_request(1, 1, ticker_symbol))
+        writer.start().close()
+        db_session = self.session_maker()
+        try:
+            self.assertEqual(['ETH', 'LTC'], sorted(c.ticker_symbol for c in db_session.query(CryptoCurrency)))
+        finally:
+            db_session.close()
+
+    def test_batch_request_is_one_queue_entry(self):
+        writer = price_req_writer.PriceRequestWriter(self.session_maker, max_queue_size=1)
+        self.assertTrue(writer.log_price_requests(1, 1, ['BTC', 'ETH', 'SOL']))
+        self.assertFalse(writer.log_price_requests(1, 1, ['LTC', 'ADA']))
+        self.assertEqual(2, writer.dropped)
+        writer.start().close()
+        self.assertEqual(3, self.count_requests())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from datetime import datetime, timedelta
+
+from cryptodata import price_req_repo, usage_stats_repo
+from cryptodata.data_models import CryptoRequestHourly, ChatRequestDaily
+from cryptodata.tests.price_req_repo_tests import build_session_maker
+
+
+class UsageStatsTests(unittest.TestCase):
+    def setUp(self):
+        self.session_maker = build_session_maker(self)
+        self.now = datetime(2026, 3, 10, 15, 30)
+        requests = [(1, 10, 'BTC', self.now), (2, 10, 'BTC', self.now - timedelta(minutes=40)),
+                    (1, 20, 'ETH', self.now - timedelta(hours=3)),
+                    (1, 10, 'ETH', self.now - timedelta(days=1)),
+                    (3, 30, 'LTC', self.now - timedelta(days=3)),
+                    (3, 30, 'DOGE', self.now - timedelta(days=10))]
+        price_req_repo.log_price_requests(self.session_maker, requests[:3])
+        price_req_repo.log_price_requests(self.session_maker, requests[3:])
+
+    def test_rollups_are_incremented(self):
+        db_session = self.session_maker()
+        try:
+            hourly = {(r.request_hour, r.crypto.ticker_symbol): r.request_count
+                      for r in db_session.query(CryptoRequestHourly)}
+            self.assertEqual(1, hourly[(datetime(2026, 3, 10, 15), 'BTC')])
+            self.assertEqual(1, hourly[(datetime(2026, 3, 10, 14), 'BTC')])
+            daily = {(r.request_day, r.chat.telegram_id): r.request_count for r in db_session.query(ChatRequestDaily)}
+            self.assertEqual(2, daily[(self.now.date(), 10)])
+        finally:
+            db_session.close()
+        price_req_repo.log_price_requests(self.session_maker, [(5, 10, 'BTC', self.now)])
+        stats = usage_stats_repo.get_usage_stats(self.session_maker, self.now)
+        self.assertEqual(4, stats['requests_today'])
+
+    def test_stats(self):
+        stats = usage_stats_repo.get_usage_stats(self.session_maker, self.now)
+        self.assertEqual(3, stats['requests_today'])
+        self.assertEqual(2, stats['active_chats_today'])
+        self.assertEqual(3, stats['requests_24h'])
+        self.assertEqual([('BTC', 2), ('ETH', 2), ('LTC', 1)], stats['top_cryptos_7d'])
+
+    def test_backfill_matches_incremental(self):
+        before = usage_stats_repo.get_usage_stats(self.session_maker, self.now)
+        price_req_repo.backfill_rollups(self.session_maker, batch_size=2)
+        self.assertEqual(before, usage_stats_repo.get_usage_stats(self.session_maker, self.now))
+
+
+if __name__ == '__main__':
+    unittest.main()
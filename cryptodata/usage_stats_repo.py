@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from cryptodata.data_models import *
+
+
+def get_usage_stats(session_maker, now=None, top_count=10):
+    # answered from the rollup tables only, never from price_request itself
+    now = datetime.utcnow() if now is None else now
+    today = now.date()
+    current_hour = now.replace(minute=0, second=0, microsecond=0)
+    db_session = None
+    try:
+        db_session = session_maker()
+        requests_today, active_chats_today = db_session.query(
+            func.coalesce(func.sum(ChatRequestDaily.request_count), 0), func.count(ChatRequestDaily.chat_id)) \
+            .filter(ChatRequestDaily.request_day == today).one()
+        requests_24h = db_session.query(func.coalesce(func.sum(CryptoRequestHourly.request_count), 0)) \
+            .filter(CryptoRequestHourly.request_hour > current_hour - timedelta(hours=24)).scalar()
+        week_total = func.sum(CryptoRequestHourly.request_count).label('week_total')
+        top_cryptos = db_session.query(CryptoCurrency.ticker_symbol, week_total) \
+            .join(CryptoRequestHourly, CryptoRequestHourly.crypto_id == CryptoCurrency.id) \
+            .filter(CryptoRequestHourly.request_hour > current_hour - timedelta(days=7)) \
+            .group_by(CryptoCurrency.ticker_symbol) \
+            .order_by(week_total.desc(), CryptoCurrency.ticker_symbol) \
+            .limit(top_count).all()
+        return {'requests_today': int(requests_today), 'active_chats_today': int(active_chats_today),
+                'requests_24h': int(requests_24h),
+                'top_cryptos_7d': [(ticker_symbol, int(count)) for ticker_symbol, count in top_cryptos]}
+    finally:
+        if db_session is not None:
+            db_session.close()
@@ -0,0 +1,311 @@
+import asyncio
+import concurrent.futures
+import signal
+
+import httpx
+
+TELEGRAM_API_URL = 'https://api.telegram.org'
+# updates handled at once. the polling loop stops reading new updates while every slot is busy
+MAX_CONCURRENCY = 256
+# seconds telegram holds a getUpdates request open when there is nothing new
+POLL_TIMEOUT = 20
+# seconds to wait before polling again after a failed getUpdates
+POLL_RETRY_DELAY = 5
+# seconds in-flight updates get to finish on shutdown
+SHUTDOWN_TIMEOUT = 30
+
+
+class BotApiError(Exception):
+    def __init__(self, message, error_code=None, retry_after=None):
+        super().__init__(message)
+        self.error_code = error_code
+        # seconds telegram asks to wait after a 429
+        self.retry_after = retry_after
+
+
+class BotApiClient:
+    # The few Telegram Bot API methods the bot uses, over one pooled async http client.
+    def __init__(self, bot_key, base_url=TELEGRAM_API_URL, max_connections=MAX_CONCURRENCY):
+        self.base_url = '{}/bot{}'.format(base_url, bot_key)
+        self.client = httpx.AsyncClient(limits=httpx.Limits(max_connections=max_connections),
+                                        timeout=httpx.Timeout(10))
+
+    async def call(self, method, http_timeout=None, **params):
+        params = {key: value for key, value in params.items() if value is not None}
+        response = await self.client.post('{}/{}'.format(self.base_url, method), json=params,
+                                          timeout=httpx.USE_CLIENT_DEFAULT if http_timeout is None else http_timeout)
+        result = response.json()
+        if not result.get('ok'):
+            raise BotApiError('{} failed: {}'.format(method, result.get('description')), result.get('error_code'),
+                              result.get('parameters', {}).get('retry_after'))
+        return result['result']
+
+    async def get_me(self):
+        return await self.call('getMe')
+
+    async def get_updates(self, offset=None, timeout=POLL_TIMEOUT):
+        return await self.call('getUpdates', http_timeout=timeout + 10, offset=offset, timeout=timeout,
+                               allowed_updates=['message', 'inline_query'])
+
+    async def delete_webhook(self):
+        return await self.call('deleteWebhook')
+
+    async def send_message(self, chat_id, text, reply_to_message_id=None):
+        return await self.call('sendMessage', chat_id=chat_id, text=text, reply_to_message_id=reply_to_message_id)
+
+    async def answer_inline_query(self, inline_query_id, results, cache_time=None):
+        return await self.call('answerInlineQuery', inline_query_id=inline_query_id, results=results,
+                               cache_time=cache_time)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class AsyncBotRuntime:
+    # Runs the bot on one asyncio event loop: an ingress that receives updates (long polling unless another one, like
+    # webhook_server.WebhookServer, is given), a task per update (at most max_concurrency at once) and background
+    # coroutines such as the ticker refresh. The handlers written for the threaded
+    # telegram.ext Updater are reused as they are: they get small stand-ins for telegram.Update whose replies are
+    # collected and sent asynchronously once the handler returns. Handlers marked as blocking wait on the db and
+    # run on the loop's default executor instead of the loop itself. Messages wait for the optional
+    # send_throttle.SendThrottle before they go out. stop(), SIGINT or SIGTERM stop the ingress and wait up to
+    # shutdown_timeout seconds for the updates already in flight, then confirm the polled updates to telegram.
+    def __init__(self, bot_key, commands, inline_handler=None, max_concurrency=MAX_CONCURRENCY,
+                 poll_timeout=POLL_TIMEOUT, shutdown_timeout=SHUTDOWN_TIMEOUT, api_base_url=TELEGRAM_API_URL,
+                 throttle=None, logger=None):
+        # commands is a list of (command, handler, blocking), handlers are called as handler(bot, update)
+        self.bot_key = bot_key
+        self.commands = {command: (handler, blocking) for command, handler, blocking in commands}
+        self.inline_handler = inline_handler
+        self.max_concurrency = max_concurrency
+        self.poll_timeout = poll_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.api_base_url = api_base_url
+        self.throttle = throttle
+        self.logger = logger
+        self.username = None
+        self.loop = None
+        self.api = None
+        self.handled = 0
+        self.failed = 0
+        self._semaphore = None
+        self._stopping = None
+        self._tasks = set()
+        # offset of the next getUpdates, past every update dispatched so far
+        self._offset = None
+
+    def run(self, background=(), ingress=None):
+        # blocks until the runtime is stopped. background is a list of coroutine functions that get this runtime
+        # and are cancelled on shutdown. ingress is a coroutine function that gets this runtime and passes updates
+        # to dispatch() until it is cancelled.
+        asyncio.run(self._main(background, ingress))
+
+    def stop(self):
+        # can be called from any thread
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._stopping.set)
+
+    def send_message(self, chat_id, text, timeout=10):
+        # for code running on other threads, like alert notifications. blocks until the message was sent.
+        return asyncio.run_coroutine_threadsafe(self._send(chat_id, text), self.loop).result(timeout)
+
+    async def dispatch(self, update):
+        # waits for a free slot, then handles the raw update (a dict parsed from the Bot API json) on its own task
+        await self._semaphore.acquire()
+        task = asyncio.ensure_future(self._handle(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    async def _main(self, background, ingress):
+        self.loop = asyncio.get_running_loop()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._stopping = asyncio.Event()
+        # every handler can be sending a reply, plus the long poll and alert notifications
+        self.api = BotApiClient(self.bot_key, self.api_base_url, self.max_concurrency + 2)
+        signals = _add_signal_handlers(self.loop, self._stopping.set)
+        tasks = []
+        try:
+            self.username = (await self.api.get_me()).get('username')
+            tasks = [asyncio.ensure_future(coroutine_function(self)) for coroutine_function in background]
+            ingress_task = asyncio.ensure_future(self._poll() if ingress is None else ingress(self))
+            # an ingress that fails, e.g. because its port is taken, stops the runtime
+            ingress_task.add_done_callback(lambda task: self._stopping.set())
+            tasks.append(ingress_task)
+            await self._stopping.wait()
+            ingress_task.cancel()
+            await asyncio.gather(ingress_task, return_exceptions=True)
+            if self._tasks:
+                if self.logger is not None:
+                    self.logger.info('Waiting for {} updates in flight...'.format(len(self._tasks)))
+                await asyncio.wait(list(self._tasks), timeout=self.shutdown_timeout)
+            if ingress is None:
+                await self._acknowledge_updates()
+            if not ingress_task.cancelled() and ingress_task.exception() is not None:
+                raise ingress_task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for sig in signals:
+                self.loop.remove_signal_handler(sig)
+            await self.api.close()
+
+    async def _poll(self):
+        # telegram refuses getUpdates with a 409 while a webhook is set, e.g. one left behind by a run with
+        # webhook_server.WebhookServer, so it is removed first. the updates it has not delivered yet are kept.
+        webhook_deleted = False
+        while True:
+            try:
+                if not webhook_deleted:
+                    await self.api.delete_webhook()
+                    webhook_deleted = True
+                updates = await self.api.get_updates(self._offset, self.poll_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.error('Unable to get updates from the Bot API: {}'.format(e))
+                await asyncio.sleep(POLL_RETRY_DELAY)
+                continue
+            for update in updates:
+                self._offset = update['update_id'] + 1
+                await self.dispatch(update)
+
+    async def _acknowledge_updates(self):
+        # telegram only forgets updates once a getUpdates asks for a later offset. like the Updater of
+        # python-telegram-bot, one last call on shutdown confirms the updates already dispatched, so a restart does
+        # not handle them again
+        if self._offset is None:
+            return
+        try:
+            await self.api.get_updates(self._offset, timeout=0)
+        except Exception as e:
+            if self.logger is not None:
+                self.logger.error('Unable to confirm the last updates: {}'.format(e))
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        self._semaphore.release()
+
+    async def _handle(self, raw_update):
+        try:
+            update = _Update(raw_update)
+            handler, blocking = self._get_handler(update)
+            if handler is None:
+                return
+            if blocking:
+                await self.loop.run_in_executor(None, handler, self, update)
+            else:
+                handler(self, update)
+            if update.message is not None:
+                await self._send_replies(update.message)
+            if update.inline_query is not None and update.inline_query.results is not None:
+                await self.api.answer_inline_query(update.inline_query.id, update.inline_query.results,
+                                                   update.inline_query.cache_time)
+            self.handled += 1
+        except Exception as e:
+            self.failed += 1
+            if self.logger is not None:
+                self.logger.exception('Update "{}" caused an error:'.format(raw_update.get('update_id')))
+
+    async def _send_replies(self, message):
+        # resolves the future of every reply: a failed send gets its exception, and the replies after it, or all the
+        # ones left when the update is cancelled on shutdown, are cancelled as never sent
+        try:
+            for text, reply_to_message_id, sent in message.replies:
+                try:
+                    sent.set_result(await self._send(message.chat.id, text, reply_to_message_id))
+                except Exception as e:
+                    sent.set_exception(e)
+                    raise
+        finally:
+            for _, _, sent in message.replies:
+                sent.cancel()
+
+    async def _send(self, chat_id, text, reply_to_message_id=None):
+        # waits for the throttle. a 429 pauses the chat for the retry_after telegram asked for, then the message is
+        # tried once more
+        for attempt in range(2):
+            if self.throttle is not None:
+                delay = self.throttle.reserve(chat_id)
+                if delay is None:
+                    return None
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            try:
+                return await self.api.send_message(chat_id, text, reply_to_message_id)
+            except BotApiError as e:
+                if attempt or e.retry_after is None or self.throttle is None:
+                    raise
+                self.throttle.pause(chat_id, e.retry_after)
+
+    def _get_handler(self, update):
+        if update.inline_query is not None:
+            return self.inline_handler, False
+        if update.message is None or not update.message.text or not update.message.text.startswith('/'):
+            return None, False
+        # '/p btc' or '/p@botname btc', commands for other bots in the same group are ignored
+        command, _, bot_name = update.message.text.split(None, 1)[0][1:].partition('@')
+        if bot_name and self.username is not None and bot_name.lower() != self.username.lower():
+            return None, False
+        return self.commands.get(command.lower(), (None, False))
+
+
+class _Identity:
+    __slots__ = ('id',)
+
+    def __init__(self, identity):
+        self.id = identity['id']
+
+
+class _Message:
+    # the parts of a telegram.Message the handlers use. reply_text() only records the reply and returns a
+    # concurrent.futures.Future of its send, which is None when the send throttle dropped it and cancelled when the
+    # reply was never tried.
+    def __init__(self, message):
+        self.message_id = message['message_id']
+        self.text = message.get('text')
+        self.from_user = _Identity(message['from']) if 'from' in message else None
+        self.chat = _Identity(message['chat'])
+        self.chat_type = message['chat'].get('type')
+        self.replies = []
+
+    def reply_text(self, text, quote=None):
+        # like telegram.Message, quotes the request by default everywhere except private chats
+        if quote is None:
+            quote = self.chat_type != 'private'
+        sent = concurrent.futures.Future()
+        self.replies.append((text, self.message_id if quote else None, sent))
+        return sent
+
+
+class _InlineQuery:
+    def __init__(self, inline_query):
+        self.id = inline_query['id']
+        self.query = inline_query.get('query', '')
+        self.from_user = _Identity(inline_query['from'])
+        self.results = None
+        self.cache_time = None
+
+    def answer(self, results, cache_time=None):
+        self.results = [result.to_dict() if hasattr(result, 'to_dict') else result for result in results]
+        self.cache_time = cache_time
+
+
+class _Update:
+    def __init__(self, update):
+        self.update_id = update['update_id']
+        self.message = _Message(update['message']) if 'message' in update else None
+        self.inline_query = _InlineQuery(update['inline_query']) if 'inline_query' in update else None
+
+
+def _add_signal_handlers(loop, callback):
+    # only possible on the main thread, and not on windows
+    signals = []
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, callback)
+            signals.append(sig)
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass
+    return signals
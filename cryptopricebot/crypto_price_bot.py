@@ -1,9 +1,26 @@
-import threading, time, pathlib, argparse
-from telegram.ext import Updater, CommandHandler
+import asyncio, threading, time, pathlib, argparse, re, concurrent.futures
+from telegram import Bot, InlineQueryResultArticle, InputTextMessageContent
+from telegram.ext import Updater, CommandHandler, InlineQueryHandler
 
 from coingeckoapi import coingecko_api
-from cryptodata import db_connection, data_models, price_req_repo
-from cryptoshared import crypto_helpers, logging_helpers
+from coingeckoapi.coingecko_provider import CoinGeckoProvider
+from coingeckoapi.exchange_rates import ExchangeRates
+from coingeckoapi.page_tiers import PageTiers
+from coingeckoapi.refresh_scheduler import RefreshScheduler
+from cryptodata import db_connection, data_models, usage_stats_repo, alert_repo, chat_pref_repo
+from cryptodata.dimension_cache import DimensionCache
+from cryptodata.price_req_archive import PriceRequestArchiver
+from cryptodata.price_req_writer import PriceRequestWriter
+from cryptoshared import crypto_helpers, logging_helpers, leaderboards, ticker_store, price_alerts, snapshot_file
+from cryptoshared.price_providers import ProviderSet
+from cryptoshared.ticker_snapshot import TickerSnapshot, EMPTY_SNAPSHOT, USD
+from cryptoshared.price_history import PriceHistory, history_key
+from cryptoshared.snapshot_channel import SnapshotSubscriber
+from cryptopricebot.reply_cache import ReplyCache
+from cryptopricebot.async_runtime import AsyncBotRuntime, TELEGRAM_API_URL
+from cryptopricebot.webhook_server import WebhookServer
+from cryptopricebot.request_coalescer import RequestCoalescer
+from cryptopricebot.send_throttle import SendThrottle, DelayedSender
 
 
 class InvalidArgument(Exception):
@@ -13,15 +30,84 @@ class InvalidArgument(Exception):
 # global variables initialized on startup
 logger = None
 session_maker = None
+price_request_writer = None
+price_request_archiver = None
 bot_key = None
+admin_ids = set()
+telegram_bot = None
+# -botapiurl and -coingeckourl, e.g. a local Bot API server or the stand-in servers of benchmarks/load_test.py
+bot_api_url = TELEGRAM_API_URL
+coingecko_base_url = coingecko_api.API_BASE_URL
 
-# updated on separate thread by get_tickers_from_api()
-crypto_list = []
-crypto_by_ticker = {}
+# row labels for the 1h, 24h, 7d, 30d and 1y change windows, in ticker_store.CHANGE_WINDOWS order
+CHANGE_LABELS = ['01H', '24H', '07D', '30D', '01Y ']
+
+# replies rendered from the current snapshot, see reply_cache.ReplyCache
+reply_cache = ReplyCache()
+
+# repeats of a request in a chat within a few seconds are not answered again, and every message waits for the
+# per chat and global send limits of the Bot API
+request_coalescer = RequestCoalescer()
+send_throttle = SendThrottle()
+# sends the messages send_throttle delays on the threaded runtime
+delayed_sender = DelayedSender()
+
+# one sample per ticker and refresh, used for custom /change windows like '/change btc 5m'
+price_history = PriceHistory(depth=0, max_tickers=0)
+
+# price alerts of every chat, evaluated after each refresh. persisted to the db when a dbstring is given
+alert_index = price_alerts.AlertIndex()
+# whether this process evaluates the alerts and sends the notifications. of several workers sharing one fetcher only
+# the one started with -alertowner does, the others only keep their index in sync with the db for /alerts
+alert_owner = True
+# seconds between two reads of the alerts other workers added or deleted
+ALERT_SYNC_INTERVAL = 30
+MAX_ALERTS_PER_CHAT = 20
+
+# most ticker symbols accepted by a single '/p btc eth sol' style request
+MAX_BATCH_TICKERS = 10
+
+# answers offered for an inline query like '@botname bit'. telegram may reuse an answer for this many seconds
+MAX_INLINE_RESULTS = 10
+INLINE_CACHE_TIME = 10
+
+# a refresh fetches the top page and the pages of recently requested coins, the rest of the pages in rotation.
+# refresh_scheduler paces the refreshes within the request budget and backs off when coingecko pushes back
+page_tiers = PageTiers()
+refresh_scheduler = RefreshScheduler(page_count=page_tiers.max_pages + 1)
+# commands whose tickers count as demand for page_tiers
+DEMAND_COMMANDS = ('/p', '/cap', '/change', '/compare')
+
+# where the market data of a refresh comes from, see price_providers.ProviderSet. more providers are added after
+# coingecko_provider, from the most to the least trusted
+coingecko_provider = CoinGeckoProvider(page_tiers)
+price_sources = ProviderSet([coingecko_provider], report_factory=coingecko_api.RefreshReport,
+                            on_late_report=refresh_scheduler.record_late)
+
+# one exchange rate table per refresh at most, every quote currency is converted from it locally. commands that
+# answer in a quote currency, e.g. '/p btc eur', and the default quote currency of chats that set one with /currency
+exchange_rates = ExchangeRates()
+QUOTE_COMMANDS = ('/p', '/cap')
+chat_currencies = {}
+
+# replies from a snapshot older than STALE_SNAPSHOT_AGE seconds say how old the prices are. a snapshot older than
+# MAX_SNAPSHOT_AGE is not used at all
+STALE_SNAPSHOT_AGE = 60
+MAX_SNAPSHOT_AGE = 30 * 60
+
+# replaced on separate thread by _get_tickers_from_api(), or by the SnapshotSubscriber of a worker. handlers read
+# it once per request and never modify it
+ticker_snapshot = EMPTY_SNAPSHOT
+
+# without a fetcher, -snapshotfile keeps the last live snapshot across restarts. the one loaded on startup is served
+# with a staleness note until the first refresh replaces it
+snapshot_path = None
+restored_snapshot = None
 
 
 def main():
-    global logger, bot_key, session_maker
+    global logger, bot_key, session_maker, price_request_writer, price_request_archiver, admin_ids, price_history
+    global snapshot_path, refresh_scheduler, bot_api_url, coingecko_base_url, alert_owner
 
     cmd_args = _get_args()
 
@@ -32,36 +118,101 @@ def main():
     logger.info('Initializing bot...')
 
     bot_key = cmd_args.botkey
+    bot_api_url = cmd_args.botapiurl
+    coingecko_base_url = cmd_args.coingeckourl
+    admin_ids = _parse_admin_ids(cmd_args.admins)
+    price_history = PriceHistory(depth=cmd_args.historydepth, path=cmd_args.historyfile)
+    # the pages and the exchange rate table
+    refresh_scheduler = RefreshScheduler(budget=cmd_args.cgbudget, page_count=page_tiers.max_pages + 1)
+    coingecko_provider.logger = logger
+    coingecko_provider.options['base_url'] = coingecko_base_url
+    price_sources.logger = logger
+    price_sources.on_late_report = refresh_scheduler.record_late
 
     # If optional dbstring argument was included, build session_maker. Used later to log price requests to db.
     if cmd_args.dbstring is not None:
         try:
             data_models.create_db(cmd_args.dbstring)
             session_maker = db_connection.get_session_maker_from_string(cmd_args.dbstring)
+            dimension_cache = DimensionCache()
+            dimension_cache.warm(session_maker)
+            price_request_writer = PriceRequestWriter(session_maker, dimension_cache=dimension_cache,
+                                                      logger=logger).start()
+            if cmd_args.archivedir is not None:
+                price_request_archiver = PriceRequestArchiver(session_maker, cmd_args.archivedir,
+                                                              hot_days=cmd_args.hotdays, logger=logger).start()
+            _load_alerts()
+            _load_chat_currencies()
             logger.info('Database connection successful!')
         except Exception as e:
             logger.error('Unable to connect to the given mysql instance.  Error Message: \'{}\''.format(e))
             logger.info('Running bot with no database connection!  Price requests will not be logged...')
 
-    api_thread = threading.Thread(target=_get_tickers_from_api)
-    api_thread.daemon = True
-    api_thread.start()
+    # a worker gets its snapshots from cryptopricebot/snapshot_fetcher.py instead of fetching them itself. the
+    # latest published one is loaded right here, so the worker can answer as soon as it is connected to telegram.
+    snapshot_subscriber = None
+    if cmd_args.snapshotsocket is not None:
+        alert_owner = cmd_args.alertowner
+        if session_maker is not None:
+            alert_sync_thread = threading.Thread(target=_sync_alerts_forever, name='alert-sync')
+            alert_sync_thread.daemon = True
+            alert_sync_thread.start()
+        snapshot_subscriber = SnapshotSubscriber(cmd_args.snapshotfile, cmd_args.snapshotsocket, _publish_snapshot,
+                                                 logger=logger).start()
+        logger.info('Attached to {} at snapshot {}'.format(cmd_args.snapshotfile, snapshot_subscriber.version))
+    elif cmd_args.snapshotfile is not None:
+        snapshot_path = cmd_args.snapshotfile
+        _restore_snapshot()
+    fetch = snapshot_subscriber is None
+
+    if cmd_args.mode == 'webhook':
+        webhook = WebhookServer(cmd_args.webhookurl, cmd_args.webhooksecret, host=cmd_args.webhookhost,
+                                port=cmd_args.webhookport, logger=logger)
+        _run_async(cmd_args.maxconcurrency, fetch, ingress=webhook.serve)
+    elif cmd_args.runtime == 'async':
+        _run_async(cmd_args.maxconcurrency, fetch)
+    else:
+        _run_threaded(fetch)
 
-    updater = Updater(bot_key)
+    if snapshot_subscriber is not None:
+        snapshot_subscriber.close()
+    if price_request_archiver is not None:
+        price_request_archiver.close()
+    if price_request_writer is not None:
+        logger.info('Writing queued price requests to the database...')
+        price_request_writer.close()
+
+
+def _run_threaded(fetch=True):
+    global telegram_bot
+    if fetch:
+        api_thread = threading.Thread(target=_get_tickers_from_api)
+        api_thread.daemon = True
+        api_thread.start()
+
+    updater = Updater(bot=_ThrottledBot(bot_key, base_url='{}/bot'.format(bot_api_url)))
+    telegram_bot = updater.bot
 
     dp = updater.dispatcher
-    dp.add_handler(CommandHandler("help", _get_help))
-    dp.add_handler(CommandHandler("p", _get_price))
-    dp.add_handler(CommandHandler("cap", _get_market_cap))
-    dp.add_handler(CommandHandler("change", _get_change))
-    dp.add_handler(CommandHandler("top", _top_ten))
-    dp.add_handler(CommandHandler("bottom", _bottom_ten))
-    dp.add_handler(CommandHandler("compare", _compare))
+    for command, handler, _ in COMMAND_HANDLERS:
+        dp.add_handler(CommandHandler(command, handler))
+    dp.add_handler(InlineQueryHandler(_inline_query))
     dp.add_error_handler(_error)
 
     updater.start_polling(timeout=20, read_latency=5)
     logger.info('Bot initialized!  Waiting for commands...')
     updater.idle()
+    delayed_sender.close()
+
+
+def _run_async(max_concurrency, fetch=True, ingress=None):
+    # handlers, the bot api and the ticker refresh all share one event loop, see async_runtime.AsyncBotRuntime
+    global telegram_bot
+    runtime = AsyncBotRuntime(bot_key, COMMAND_HANDLERS, _inline_query, max_concurrency=max_concurrency,
+                              api_base_url=bot_api_url, throttle=send_throttle, logger=logger)
+    telegram_bot = runtime
+    logger.info('Bot initialized!  Waiting for commands...')
+    runtime.run(background=[_refresh_tickers] if fetch else [], ingress=ingress)
 
 
 def _get_args():
@@ -72,6 +223,37 @@ def _get_args():
     parser.add_argument("-loglvl", default='info')
     # optional mysql db. format is 'username:password@instance'
     parser.add_argument("-dbstring")
+    # optional comma separated telegram user ids that are allowed to use admin commands like /stats
+    parser.add_argument("-admins", default='')
+    # optional directory that price requests older than -hotdays days are moved to, as compressed csv files
+    parser.add_argument("-archivedir")
+    parser.add_argument("-hotdays", type=int, default=90)
+    # samples of price history kept per ticker (one per refresh), optionally persisted to a memory-mapped file
+    parser.add_argument("-historydepth", type=int, default=360)
+    parser.add_argument("-historyfile")
+    # coingecko requests allowed per minute, 30 on the demo plan. a refresh takes one request per page fetched
+    parser.add_argument("-cgbudget", type=int, default=30)
+    # threaded runs the telegram.ext Updater, async runs every handler and api call on one asyncio event loop
+    parser.add_argument("-runtime", choices=['threaded', 'async'], default='threaded')
+    # most updates handled at once by the async runtime
+    parser.add_argument("-maxconcurrency", type=int, default=256)
+    # polling asks telegram for updates, webhook has telegram push them to -webhookurl (always on the async runtime).
+    # behind a reverse proxy -webhookurl is the public address of the proxy, which forwards to -webhookhost:-webhookport
+    parser.add_argument("-mode", choices=['polling', 'webhook'], default='polling')
+    parser.add_argument("-webhookurl")
+    parser.add_argument("-webhookhost", default='0.0.0.0')
+    parser.add_argument("-webhookport", type=int, default=8443)
+    # sent by telegram with every update. 1-256 characters out of A-Z, a-z, 0-9, _ and -
+    parser.add_argument("-webhooksecret")
+    # the last snapshot is saved to -snapshotfile and served right after a restart, until the first refresh. with
+    # -snapshotsocket the bot runs as a worker of cryptopricebot/snapshot_fetcher.py started with the same paths.
+    parser.add_argument("-snapshotfile")
+    parser.add_argument("-snapshotsocket")
+    # the one worker that evaluates price alerts and sends their notifications
+    parser.add_argument("-alertowner", action='store_true')
+    # where the bot api and coingecko are reached, e.g. a local telegram bot api server
+    parser.add_argument("-botapiurl", default=TELEGRAM_API_URL)
+    parser.add_argument("-coingeckourl", default=coingecko_api.API_BASE_URL)
     cmd_args = parser.parse_args()
     return cmd_args
 
@@ -83,284 +265,867 @@ def _validate_cmd_args(cmd_args):
     cmd_log_lvl = cmd_args.loglvl
     if cmd_log_lvl not in ['debug', 'info', 'error']:
         raise InvalidArgument('-loglvl argument is required. Options are debug|info|error')
+    _parse_admin_ids(cmd_args.admins)
+    if cmd_args.cgbudget < coingecko_api.PAGE_COUNT:
+        raise InvalidArgument('-cgbudget argument must allow at least one refresh ({} requests) per minute.'
+                              .format(coingecko_api.PAGE_COUNT))
+    if cmd_args.mode == 'webhook':
+        if not cmd_args.webhookurl:
+            raise InvalidArgument('-webhookurl argument is required in webhook mode.')
+        if cmd_args.webhooksecret is None or re.fullmatch(r'[A-Za-z0-9_-]{1,256}', cmd_args.webhooksecret) is None:
+            raise InvalidArgument('-webhooksecret argument is required in webhook mode. Use 1-256 characters out of '
+                                  'A-Z, a-z, 0-9, _ and -')
+    if cmd_args.snapshotsocket is not None and cmd_args.snapshotfile is None:
+        raise InvalidArgument('-snapshotfile argument is required with -snapshotsocket.')
+    if cmd_args.alertowner and cmd_args.snapshotsocket is None:
+        raise InvalidArgument('-alertowner argument only applies to workers started with -snapshotsocket.')
+
+
+def _parse_admin_ids(admins):
+    try:
+        return {int(admin_id) for admin_id in admins.split(',') if admin_id.strip() != ''}
+    except ValueError:
+        raise InvalidArgument('-admins argument must be a comma separated list of telegram user ids.')
 
 
 def _get_tickers_from_api():
-    # set global crypto collections, which are then referenced by the bot commands.
-    global crypto_by_ticker
-    global crypto_list
+    # publish a new snapshot each cycle, which is then referenced by the bot commands. a refresh that brings back
+    # nothing leaves the current snapshot in place.
     while True:
+        report = coingecko_api.RefreshReport()
+        rows = []
         try:
-            crypto_by_ticker = coingecko_api.get_all_tickers()
-            crypto_list = list(crypto_by_ticker.values())
+            _record_alert_demand()
+            rows, shadowed = price_sources.fetch(report)
+            if rows:
+                _publish_markets(rows, shadowed, exchange_rates.get(logger=logger, base_url=coingecko_base_url,
+                                                                    report=report))
         except Exception as e:
             logger.exception(r'An error occurred with coingecko api:')
         finally:
-            time.sleep(10)
+            time.sleep(_schedule_refresh(report, bool(rows)))
+
+
+async def _refresh_tickers(runtime):
+    # _get_tickers_from_api() for the async runtime. pages are fetched on the event loop, the snapshot is built on a
+    # worker thread so handlers keep running in the meantime.
+    async with coingecko_api.build_async_client() as client:
+        coingecko_provider.client = client
+        while True:
+            report = coingecko_api.RefreshReport()
+            rows = []
+            try:
+                _record_alert_demand()
+                rows, shadowed = await price_sources.fetch_async(report)
+                if rows:
+                    rates = await exchange_rates.get_async(client, logger=logger, base_url=coingecko_base_url,
+                                                           report=report)
+                    await runtime.loop.run_in_executor(None, _publish_markets, rows, shadowed, rates)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(r'An error occurred with coingecko api:')
+            await asyncio.sleep(_schedule_refresh(report, bool(rows)))
+
+
+def _record_alert_demand():
+    # coins with alerts are kept as fresh as the requested ones
+    snapshot = ticker_snapshot
+    tickers = [snapshot.get(ticker_symbol) for ticker_symbol in alert_index.ticker_symbols()]
+    page_tiers.record_demand([ticker.currency_id for ticker in tickers if ticker is not None and ticker.currency_id])
+
+
+def _record_demand(snapshot, request_text):
+    request_text, _ = _split_quote(snapshot, request_text)
+    currency_ids = []
+    for requested_ticker in _get_requested_tickers(request_text)[:MAX_BATCH_TICKERS]:
+        ticker = snapshot.resolve(requested_ticker)
+        if ticker is not None and ticker.currency_id:
+            currency_ids.append(ticker.currency_id)
+    if currency_ids:
+        page_tiers.record_demand(currency_ids)
+
+
+def _schedule_refresh(report, ok):
+    # seconds until the next refresh. a refresh skipped because every provider was still busy made no request and
+    # did not fail, it is not recorded
+    if report.skipped:
+        return refresh_scheduler.next_delay()
+    state = refresh_scheduler.state
+    refresh_scheduler.record(report, ok)
+    if report.rate_limited:
+        logger.error('CoinGecko rate limited {} of {} pages, retry after {}s'.format(report.rate_limited,
+                                                                                  report.requests,
+                                                                                  report.retry_after))
+    if refresh_scheduler.state != state:
+        logger.info('CoinGecko circuit {} after {} failed refreshes'.format(refresh_scheduler.state,
+                                                                           refresh_scheduler.failures))
+    return refresh_scheduler.next_delay()
+
+
+def _publish_markets(rows, shadowed, rates=None):
+    # builds the snapshot for a refresh from market_row.MarketRows. built against the current snapshot, it only
+    # rebuilds what the changed coins affect, see TickerSnapshot. page_tiers tells which rows were fetched now.
+    snapshot = TickerSnapshot.from_rows(rows, ticker_snapshot.version + 1, shadowed=shadowed,
+                                        previous=ticker_snapshot, rates=rates, fetched=page_tiers.fetched_mask(rows))
+    _publish_snapshot(snapshot)
+    if snapshot_path is not None:
+        try:
+            snapshot_file.write_snapshot(snapshot_path, snapshot)
+        except OSError as e:
+            logger.error('Unable to save snapshot to {}: {}'.format(snapshot_path, e))
+
+
+def _is_reply_current(previous, snapshot, command, request_text):
+    # whether a reply rendered from previous reads the same from snapshot, so reply_cache keeps it rather than
+    # rendering it again. only the coins the reply mentions are checked against the symbols that changed.
+    if snapshot.changed is None:
+        return False
+    if command in ('/top', '/bottom'):
+        return snapshot.leaderboards is previous.leaderboards
+    if command not in DEMAND_COMMANDS or _is_history_request(request_text):
+        return False
+    if snapshot.has_base_pairs() != previous.has_base_pairs():
+        return False
+    if command in QUOTE_COMMANDS:
+        request_text, currency = _split_quote(snapshot, request_text)
+        if currency is not None and snapshot.rates.get(currency) != previous.rates.get(currency):
+            return False
+    if command == '/compare':
+        requested_tickers = [symbol.strip().upper() for symbol in request_text.split('/')[:2]]
+    else:
+        requested_tickers = _get_requested_tickers(request_text)
+    if command == '/p' and ' ' not in request_text:
+        # single price replies include the BTC and ETH pairs
+        requested_tickers += ['BTC', 'ETH']
+    for requested_ticker in requested_tickers:
+        ticker = snapshot.resolve(requested_ticker)
+        if ticker is None or ticker.ticker_symbol in snapshot.changed:
+            return False
+        previous_ticker = previous.resolve(requested_ticker)
+        if previous_ticker is None or previous_ticker.currency_id != ticker.currency_id:
+            return False
+    return True
+
+
+def _restore_snapshot():
+    # serves the snapshot saved before the last shutdown until the first refresh. alerts are not evaluated and no
+    # history sample is added, both happened when it was live. a missing or damaged file is ignored.
+    global ticker_snapshot, restored_snapshot
+    try:
+        snapshot = snapshot_file.read_snapshot(snapshot_path)
+    except FileNotFoundError:
+        return
+    except snapshot_file.InvalidSnapshotFile as e:
+        logger.error('Ignoring saved snapshot: {}'.format(e))
+        return
+    restored_snapshot = snapshot
+    ticker_snapshot = snapshot
+    reply_cache.publish(snapshot, RENDERERS)
+    logger.info('Restored snapshot {} from {} ago'.format(snapshot.version,
+                                                          crypto_helpers.format_age(snapshot.age())))
+
+
+def _publish_snapshot(snapshot):
+    # swaps in a new snapshot with a single assignment, then refreshes everything derived from it
+    global ticker_snapshot
+    price_history.append(snapshot.store, snapshot.fetched_at, snapshot.fetched)
+    previous = ticker_snapshot
+    ticker_snapshot = snapshot
+    reply_cache.publish(ticker_snapshot, RENDERERS,
+                        keep=lambda command, request_text: _is_reply_current(previous, snapshot, command,
+                                                                             request_text))
+    # built here rather than by the first inline query or unknown symbol that needs it
+    snapshot.search_index
+    logger.debug('Reply cache: {}, coalescer: {}, send throttle: {}'.format(reply_cache.stats(),
+                                                                           request_coalescer.stats(),
+                                                                           send_throttle.stats()))
+    if not alert_owner:
+        return
+    fired, rearmed = alert_index.evaluate(snapshot.store, snapshot.changed)
+    if fired or rearmed:
+        alert_thread = threading.Thread(target=_notify_alerts, args=(snapshot, fired, rearmed))
+        alert_thread.daemon = True
+        alert_thread.start()
 
 
 def _get_price(bot, update):
+    _handle_command(update, '/p', _render_price, on_request=_log_price_request)
+
+
+def _get_market_cap(bot, update):
+    _handle_command(update, '/cap', _render_market_cap)
+
+
+def _get_change(bot, update):
+    _handle_command(update, '/change', _render_change)
+
+
+def _top_ten(bot, update):
+    _handle_command(update, '/top', _render_top)
+
+
+def _bottom_ten(bot, update):
+    _handle_command(update, '/bottom', _render_bottom)
+
+
+def _compare(bot, update):
+    _handle_command(update, '/compare', _render_compare)
+
+
+def _handle_command(update, command, render, on_request=None):
+    claim = None
     try:
         if not _validate_telegram_update(update):
             return
         _log_command(update.message.from_user.id, update.message.chat.id, update.message.text)
-
-        request_text = update.message.text.lower().replace("/p", "").strip()
-        request_text = _strip_bot_user_name(request_text)
-        if request_text == '':
-            update.message.reply_text('Invalid Request Format.  Try \'/p eth\' or /help for more info', quote=False)
-            return
-        requested_ticker = request_text.upper()
-        if requested_ticker not in crypto_by_ticker:
-            update.message.reply_text('Invalid Ticker Symbol', quote=False)
-            return
-        if 'BTC' not in crypto_by_ticker or 'ETH' not in crypto_by_ticker:
-            update.message.reply_text('We are having some API connection issues :( Please try again in a few minutes.',
-                                      quote=False)
+        snapshot = ticker_snapshot
+        age = snapshot.age()
+        if age > MAX_SNAPSHOT_AGE:
+            update.message.reply_text('We are having some API connection issues :( Please try again in a few '
+                                      'minutes.', quote=False)
             return
 
-        # if dbstring argument was used, log price request to the specified db.
-        if session_maker is not None:
-            try:
-                price_req_repo.log_price_request(session_maker, update.message.from_user.id, update.message.chat.id,
-                                                 requested_ticker)
-            except Exception as e:
-                logger.exception(r'An error occurred trying to write this request to the specified DB:')
-
-        ticker = crypto_by_ticker[requested_ticker]
-        btc_ticker = crypto_by_ticker['BTC']
-        eth_ticker = crypto_by_ticker['ETH']
-        ticker.btc_price = ticker.usd_price / btc_ticker.usd_price
-        ticker.eth_price = ticker.usd_price / eth_ticker.usd_price
-
-        reply = '{} ({}): {}'.format(ticker.currency_name, requested_ticker, crypto_helpers.format_usd(ticker.usd_price))
-        if ticker.percent_change_24h is not None:
-            reply += ' | {}'.format(crypto_helpers.format_percent_change(ticker.percent_change_24h))
-        if ticker.btc_price is not None:
-            reply += '\n{} BTC'.format(crypto_helpers.format_btc(ticker.btc_price))
-            if ticker.percent_change_24h is not None and btc_ticker.percent_change_24h is not None:
-                reply += ' | {}'.format(
-                    crypto_helpers.format_percent_change(crypto_helpers.get_relative_percent_change(ticker.usd_price,
-                                                                                                    ticker.percent_change_24h,
-                                                                                                    btc_ticker.usd_price,
-                                                                                                    btc_ticker.percent_change_24h)))
-        if ticker.eth_price is not None:
-            reply += '\n{} ETH'.format(crypto_helpers.format_eth(ticker.eth_price))
-            if ticker.percent_change_24h is not None and eth_ticker.percent_change_24h is not None:
-                reply += ' | {}'.format(
-                    crypto_helpers.format_percent_change(crypto_helpers.get_relative_percent_change(ticker.usd_price,
-                                                                                                    ticker.percent_change_24h,
-                                                                                                    eth_ticker.usd_price,
-                                                                                                    eth_ticker.percent_change_24h)))
-        if ticker.volume_24h is not None:
-            reply += '\nVolume: {}'.format(crypto_helpers.format_volume(ticker.volume_24h))
-        update.message.reply_text(reply, quote=False)
+        request_text = _get_request_text(update.message.text, command)
+        if command in QUOTE_COMMANDS:
+            request_text = _apply_chat_currency(update.message.chat.id, snapshot, request_text)
+        if on_request is not None:
+            on_request(update, snapshot, request_text)
+        if command in DEMAND_COMMANDS:
+            _record_demand(snapshot, request_text)
+        claim = (update.message.chat.id, command, request_text, snapshot.version)
+        if not request_coalescer.claim(*claim):
+            claim = None
+            return
+        reply = reply_cache.get_or_render(command, request_text, snapshot, render)
+        if snapshot is restored_snapshot or age > STALE_SNAPSHOT_AGE:
+            reply += _render_staleness(snapshot)
+        _release_claim_unless_sent(update.message.reply_text(reply, quote=False), claim)
     except Exception as e:
+        if claim is not None:
+            request_coalescer.release(*claim)
         logger.exception(r'An error occurred while processing this command:')
         update.message.reply_text('Oops! Something went wrong with this request. Please try again later.')
 
 
-def _get_market_cap(bot, update):
+def _release_claim_unless_sent(sent, claim):
+    # sent is what reply_text() returned: the sent message, None when the send throttle dropped it, or a
+    # concurrent.futures.Future of a send that happens later, cancelled if it never does. a repeat of a request
+    # whose reply never went out is answered again
+    def on_sent(future):
+        if future.cancelled() or future.exception() is not None or future.result() is None:
+            request_coalescer.release(*claim)
+
+    if sent is None:
+        request_coalescer.release(*claim)
+    elif isinstance(sent, concurrent.futures.Future):
+        sent.add_done_callback(on_sent)
+
+
+def _log_price_request(update, snapshot, request_text):
+    # if dbstring argument was used, queue the price request(s) to be written to the specified db.
+    if price_request_writer is None or not snapshot.has_base_pairs():
+        return
+    request_text, _ = _split_quote(snapshot, request_text)
+    requested_tickers = []
+    for requested_ticker in _get_requested_tickers(request_text):
+        ticker = snapshot.resolve(requested_ticker)
+        # coins reached by id because their symbol belongs to another coin are not logged under that symbol
+        if ticker is not None and _get_request_key(snapshot, ticker) == ticker.ticker_symbol:
+            requested_tickers.append(ticker.ticker_symbol)
+    if not requested_tickers:
+        return
+    if not price_request_writer.log_price_requests(update.message.from_user.id, update.message.chat.id,
+                                                   requested_tickers):
+        logger.debug('Price request queue is full, request was not logged.')
+
+
+# the _render_* functions build the reply for a command from the snapshot and the normalized request text only,
+# which is what lets reply_cache reuse a reply until the next snapshot is published.
+def _render_price(snapshot, request_text):
+    if request_text == '':
+        return 'Invalid Request Format.  Try \'/p eth\' or /help for more info'
+    request_text, currency = _split_quote(snapshot, request_text)
+    snapshot = snapshot.in_currency(currency or USD)
+    if ' ' in request_text:
+        # price rows need the BTC and ETH pairs, /cap and /change rows do not
+        if not snapshot.has_base_pairs():
+            return 'We are having some API connection issues :( Please try again in a few minutes.'
+        return _render_batch(snapshot, request_text, lambda ticker: _render_price_row(ticker, snapshot.currency))
+    ticker = snapshot.resolve(request_text)
+    if ticker is None:
+        return _render_invalid_ticker(snapshot, request_text)
+    if not snapshot.has_base_pairs():
+        return 'We are having some API connection issues :( Please try again in a few minutes.'
+
+    reply = '{} ({}): {}'.format(ticker.currency_name, ticker.ticker_symbol,
+                                 crypto_helpers.format_price(ticker.usd_price, snapshot.currency))
+    if ticker.percent_change_24h is not None:
+        reply += ' | {}'.format(crypto_helpers.format_percent_change(ticker.percent_change_24h))
+    if ticker.btc_price is not None:
+        reply += '\n{} BTC'.format(crypto_helpers.format_btc(ticker.btc_price))
+        if ticker.btc_percent_change_24h is not None:
+            reply += ' | {}'.format(crypto_helpers.format_percent_change(ticker.btc_percent_change_24h))
+    if ticker.eth_price is not None:
+        reply += '\n{} ETH'.format(crypto_helpers.format_eth(ticker.eth_price))
+        if ticker.eth_percent_change_24h is not None:
+            reply += ' | {}'.format(crypto_helpers.format_percent_change(ticker.eth_percent_change_24h))
+    if ticker.volume_24h is not None:
+        reply += '\nVolume: {}'.format(crypto_helpers.format_volume(ticker.volume_24h, snapshot.currency))
+    return reply
+
+
+def _render_market_cap(snapshot, request_text):
+    if request_text == '':
+        return 'Invalid Request Format.  Try \'/cap eth\' or /help for more info'
+    request_text, currency = _split_quote(snapshot, request_text)
+    snapshot = snapshot.in_currency(currency or USD)
+    if ' ' in request_text:
+        return _render_batch(snapshot, request_text,
+                             lambda ticker: _render_market_cap_row(ticker, snapshot.currency))
+    ticker = snapshot.resolve(request_text)
+    if ticker is None:
+        return _render_invalid_ticker(snapshot, request_text)
+
+    reply = '{} ({}) Market Cap:\n'.format(ticker.currency_name, ticker.ticker_symbol)
+    if ticker.market_cap is not None:
+        reply += crypto_helpers.format_market_cap(ticker.market_cap, snapshot.currency)
+    else:
+        reply += 'Not Available'
+    return reply
+
+
+def _render_change(snapshot, request_text):
+    if request_text == '':
+        return 'Invalid Request Format.  Try \'/change eth\' or /help for more info'
+    if _is_history_request(request_text):
+        return _render_history_change(snapshot, request_text)
+    if ' ' in request_text:
+        return _render_batch(snapshot, request_text, _render_change_row)
+    ticker = snapshot.resolve(request_text)
+    if ticker is None:
+        return _render_invalid_ticker(snapshot, request_text)
+
+    reply = '{} ({}) Change:'.format(ticker.currency_name, ticker.ticker_symbol)
+    changes = [ticker.percent_change_1h, ticker.percent_change_24h, ticker.percent_change_7d,
+               ticker.percent_change_30d, ticker.percent_change_1y]
+    for label, change in zip(CHANGE_LABELS, changes):
+        if change is not None:
+            reply += '\n{} | {}'.format(label, crypto_helpers.format_percent_change(change))
+        else:
+            reply += '\n{} | Not Available'.format(label)
+    return reply
+
+
+def _render_batch(snapshot, request_text, render_row):
+    # '/p btc eth sol' style requests: one compact line per ticker, all from the same snapshot
+    requested_tickers = _get_requested_tickers(request_text)
+    if len(requested_tickers) > MAX_BATCH_TICKERS:
+        return 'Too many ticker symbols.  Up to {} can be requested at once.'.format(MAX_BATCH_TICKERS)
+    rows = []
+    for requested_ticker in requested_tickers:
+        ticker = snapshot.resolve(requested_ticker)
+        if ticker is None:
+            rows.append('{}: Invalid Ticker Symbol'.format(requested_ticker))
+        else:
+            rows.append(render_row(ticker))
+    return '\n'.join(rows)
+
+
+def _render_invalid_ticker(snapshot, query):
+    reply = 'Invalid Ticker Symbol'
+    suggestions = snapshot.search_index.suggest(query)
+    if suggestions:
+        reply += '\nDid you mean {}?'.format(', '.join('{} ({})'.format(_get_request_key(snapshot, ticker),
+                                                                       ticker.currency_name)
+                                                      for ticker in suggestions))
+    return reply
+
+
+def _render_staleness(snapshot, now=None):
+    # appended to replies served from a snapshot that was saved before a restart or while coingecko is unavailable
+    return '\n\n(Prices from {} ago, refreshing...)'.format(crypto_helpers.format_age(snapshot.age(now)))
+
+
+def _get_request_key(snapshot, ticker):
+    # what to type to get this ticker: its symbol, or its CoinGecko id when the symbol belongs to a higher ranked coin
+    if snapshot.resolve(ticker.ticker_symbol).currency_id == ticker.currency_id:
+        return ticker.ticker_symbol
+    return ticker.currency_id
+
+
+def _render_price_row(ticker, currency=USD):
+    row = '{}:{}'.format(ticker.ticker_symbol, crypto_helpers.format_price(ticker.usd_price, currency))
+    if ticker.percent_change_24h is not None:
+        row += ' | {}'.format(crypto_helpers.format_percent_change(ticker.percent_change_24h))
+    return row
+
+
+def _render_market_cap_row(ticker, currency=USD):
+    if ticker.market_cap is None:
+        return '{}: Not Available'.format(ticker.ticker_symbol)
+    return '{}: {}'.format(ticker.ticker_symbol, crypto_helpers.format_market_cap(ticker.market_cap, currency))
+
+
+def _render_change_row(ticker):
+    changes = [ticker.percent_change_1h, ticker.percent_change_24h, ticker.percent_change_7d]
+    columns = []
+    for label, change in zip(CHANGE_LABELS, changes):
+        columns.append('{} {}'.format(label, crypto_helpers.format_percent_change(change) if change is not None
+                                      else 'N/A'))
+    return '{}: {}'.format(ticker.ticker_symbol, ' | '.join(columns))
+
+
+def _split_quote(snapshot, request_text):
+    # ('btc eth', 'EUR') for 'btc eth eur', (request_text, None) when no quote currency is named. a last word with an
+    # exchange rate is a quote currency rather than one more ticker symbol
+    words = request_text.split(' ')
+    if len(words) > 1 and words[-1].upper() in snapshot.rates:
+        return ' '.join(words[:-1]), words[-1].upper()
+    return request_text, None
+
+
+def _apply_chat_currency(chat_id, snapshot, request_text):
+    # requests that do not name a quote currency get the chat's default one, so the reply is cached per currency
+    currency = chat_currencies.get(chat_id)
+    if currency is None or request_text == '' or currency not in snapshot.rates or \
+            _split_quote(snapshot, request_text)[1] is not None:
+        return request_text
+    return '{} {}'.format(request_text, currency.lower())
+
+
+def _get_requested_tickers(request_text):
+    # upper case ticker symbols in request order, without duplicates
+    return list(dict.fromkeys(request_text.upper().split()))
+
+
+def _is_history_request(request_text):
+    args = request_text.split(' ')
+    return len(args) == 2 and re.fullmatch(r'\d+[smh]', args[1]) is not None
+
+
+def _render_history_change(snapshot, request_text):
+    # custom windows, e.g. '/change btc 5m', answered from the local price history
+    requested_ticker, duration_text = request_text.split(' ', 1)
+    try:
+        seconds = _parse_duration(duration_text)
+    except InvalidArgument:
+        return 'Invalid Request Format.  Try \'/change eth 15m\' or /help for more info'
+    ticker = snapshot.resolve(requested_ticker)
+    if ticker is None:
+        return _render_invalid_ticker(snapshot, requested_ticker)
+
+    stats = price_history.window_stats(history_key(ticker.currency_id, ticker.ticker_symbol), seconds,
+                                       snapshot.fetched_at)
+    reply = '{} ({}) Change:'.format(ticker.currency_name, ticker.ticker_symbol)
+    if stats is None:
+        reply += '\n{} | Not Available'.format(duration_text.upper())
+        return reply
+    reply += '\n{} | {}'.format(duration_text.upper(), crypto_helpers.format_percent_change(stats['percent_change']))
+    reply += '\nLow:{}'.format(crypto_helpers.format_usd(stats['low']))
+    reply += '\nHigh:{}'.format(crypto_helpers.format_usd(stats['high']))
+    reply += '\nVWAP:{}'.format(crypto_helpers.format_usd(stats['vwap']))
+    return reply
+
+
+def _parse_duration(duration_text):
+    # '90s', '5m', '2h' -> seconds
+    match = re.fullmatch(r'(\d+)([smh])', duration_text)
+    if match is None or int(match.group(1)) == 0:
+        raise InvalidArgument('Invalid duration: \'{}\''.format(duration_text))
+    return int(match.group(1)) * {'s': 1, 'm': 60, 'h': 3600}[match.group(2)]
+
+
+def _render_top(snapshot, request_text):
+    return _render_leaderboard(snapshot, request_text, '/top', gainers=True)
+
+
+def _render_bottom(snapshot, request_text):
+    return _render_leaderboard(snapshot, request_text, '/bottom', gainers=False)
+
+
+def _render_leaderboard(snapshot, request_text, command, gainers):
+    try:
+        window, count, universe = _parse_leaderboard_args(request_text)
+    except InvalidArgument:
+        return 'Invalid Request Format.  Try \'{} 7d 20\' or /help for more info'.format(command)
+
+    if gainers:
+        entries = snapshot.leaderboards.top(window, universe, count)
+        result = 'Biggest {} gainers out of top {} by market cap:\n'.format(window, universe)
+    else:
+        entries = snapshot.leaderboards.bottom(window, universe, count)
+        result = 'Biggest {} losers out of top {} by market cap:\n'.format(window, universe)
+    for index, (currency_name, ticker_symbol, percent_change) in enumerate(entries):
+        result += '{}. {} ({}): {}\n'.format(index + 1, currency_name, ticker_symbol,
+                                             crypto_helpers.format_percent_change(percent_change))
+    return result
+
+
+def _parse_leaderboard_args(request_text):
+    # format is '[window] [count] [universe]', e.g. '7d 20' or '1h 10 500'. anything left out uses the default.
+    window, count, universe = '24h', leaderboards.DEFAULT_COUNT, leaderboards.DEFAULT_UNIVERSE
+    args = request_text.split()
+    if args and args[0] in ticker_store.CHANGE_WINDOWS:
+        window = args.pop(0)
+    if len(args) > 2 or not all(arg.isdigit() for arg in args):
+        raise InvalidArgument('Invalid leaderboard arguments: \'{}\''.format(request_text))
+    if args:
+        count = int(args[0])
+    if len(args) > 1:
+        universe = int(args[1])
+    if count < 1 or count > leaderboards.MAX_COUNT or universe not in leaderboards.UNIVERSE_SIZES:
+        raise InvalidArgument('Invalid leaderboard arguments: \'{}\''.format(request_text))
+    return window, count, universe
+
+
+def _render_compare(snapshot, request_text):
+    if request_text == '' or '/' not in request_text:
+        return 'Invalid Request Format.  Try \'/compare eth/btc\' or /help for more info'
+    symbols = request_text.split('/')
+    if symbols[0].strip() == '' or symbols[1].strip() == '':
+        return 'Invalid Request Format.  Try \'/compare eth/btc\' or /help for more info'
+    requested_ticker_1 = symbols[0].strip().upper()
+    requested_ticker_2 = symbols[1].strip().upper()
+    if requested_ticker_1 not in snapshot or requested_ticker_2 not in snapshot:
+        return 'Invalid Ticker Symbol'
+    if requested_ticker_1 == requested_ticker_2:
+        return 'Use two different ticker symbols.  Try \'/compare eth/btc\' or /help for more info'
+    ticker_1 = snapshot.get(requested_ticker_1)
+    ticker_2 = snapshot.get(requested_ticker_2)
+
+    reply = '{} ({}) vs. {} ({}):'.format(ticker_1.currency_name, requested_ticker_1, ticker_2.currency_name, requested_ticker_2)
+    relative_changes = snapshot.relative_percent_changes(requested_ticker_1, requested_ticker_2)
+    for label, relative_change in zip(CHANGE_LABELS, relative_changes):
+        if relative_change is not None:
+            reply += '\n{} | {}'.format(label, crypto_helpers.format_percent_change(relative_change))
+        else:
+            reply += '\n{} | Not Available'.format(label)
+    return reply
+
+
+# used by reply_cache to pre-render the most requested replies whenever a new snapshot is published
+RENDERERS = {'/p': _render_price, '/cap': _render_market_cap, '/change': _render_change, '/top': _render_top,
+             '/bottom': _render_bottom, '/compare': _render_compare}
+
+
+def _get_stats(bot, update):
     try:
         if not _validate_telegram_update(update):
             return
         _log_command(update.message.from_user.id, update.message.chat.id, update.message.text)
-
-        request_text = update.message.text.lower().replace("/cap", "").strip()
-        request_text = _strip_bot_user_name(request_text)
-        if request_text == '':
-            update.message.reply_text('Invalid Request Format.  Try \'/cap eth\' or /help for more info', quote=False)
+        if update.message.from_user.id not in admin_ids:
             return
-        requested_ticker = request_text.upper()
-        if requested_ticker not in crypto_by_ticker:
-            update.message.reply_text('Invalid Ticker Symbol', quote=False)
+        if session_maker is None:
+            update.message.reply_text('Stats are not available without a database connection.', quote=False)
             return
-
-        ticker = crypto_by_ticker[requested_ticker]
-
-        reply = '{} ({}) Market Cap:\n'.format(ticker.currency_name, requested_ticker)
-        if ticker.market_cap is not None:
-            reply += crypto_helpers.format_market_cap(ticker.market_cap)
-        else:
-            reply += 'Not Available'.format(ticker.market_cap)
-        update.message.reply_text(reply, quote=False)
+        stats = usage_stats_repo.get_usage_stats(session_maker)
+        update.message.reply_text(_render_stats(stats, request_coalescer.stats(), send_throttle.stats(),
+                                                refresh_scheduler.stats(), page_tiers.freshness(),
+                                                price_sources.stats()), quote=False)
     except Exception as e:
         logger.exception(r'An error occurred while processing this command:')
         update.message.reply_text('Oops! Something went wrong with this request. Please try again later.')
 
 
-def _get_change(bot, update):
+def _render_stats(stats, coalescer_stats, throttle_stats, scheduler_stats, freshness, provider_stats):
+    reply = 'Usage stats (UTC):\n'
+    reply += 'Requests today: {:,}\n'.format(stats['requests_today'])
+    reply += 'Active chats today: {:,}\n'.format(stats['active_chats_today'])
+    reply += 'Requests in the past 24h: {:,}\n'.format(stats['requests_24h'])
+    reply += 'Most requested in the past 7 days:'
+    for index, (ticker_symbol, count) in enumerate(stats['top_cryptos_7d']):
+        reply += '\n{}. {}: {:,}'.format(index + 1, ticker_symbol, count)
+    reply += '\nSince start: {:,} repeated requests merged, {:,} messages delayed ({:,.0f}s in total), {:,} dropped' \
+        .format(coalescer_stats['merged'], throttle_stats['delayed'], throttle_stats['total_delay'],
+                throttle_stats['dropped'])
+    reply += '\nCoinGecko: circuit {}, {:,} of {:,} refreshes rate limited, {} requests in the past minute' \
+        .format(scheduler_stats['state'], scheduler_stats['rate_limited'], scheduler_stats['refreshes'],
+                scheduler_stats['budget_used'])
+    reply += '\nOldest page: {}'.format(', '.join('{} {}'.format(tier, crypto_helpers.format_age(freshness[tier]))
+                                                 for tier in ('hot', 'demand', 'cold') if tier in freshness))
+    for name, provider in provider_stats.items():
+        reply += '\n{}: {:,} calls, {:,} failed, {:,} used'.format(name, provider['calls'], provider['failures'],
+                                                                 provider['wins'])
+        if provider['p50'] is not None:
+            reply += ', latency p50 {:.1f}s p95 {:.1f}s'.format(provider['p50'], provider['p95'])
+    return reply
+
+
+def _load_alerts():
+    for alert_id, tg_user_id, tg_chat_id, ticker_symbol, metric, direction, threshold, armed in \
+            alert_repo.get_alerts(session_maker):
+        alert_index.add(price_alerts.PriceAlert(alert_id, tg_user_id, tg_chat_id, ticker_symbol, metric, direction,
+                                                threshold, armed))
+    logger.info('Loaded {} price alerts.'.format(len(alert_index)))
+
+
+def _sync_alerts():
+    # workers share their alerts through the db: alerts another worker added are indexed, ones it deleted are dropped
+    stored = {row[0]: row for row in alert_repo.get_alerts(session_maker)}
+    indexed = alert_index.alert_ids()
+    for alert_id in indexed - stored.keys():
+        alert_index.remove(alert_id)
+    store = ticker_snapshot.store
+    for alert_id in stored.keys() - indexed:
+        alert = price_alerts.PriceAlert(*stored[alert_id])
+        alert_index.add(alert, price_alerts.get_value(store, alert.ticker_symbol, alert.metric))
+
+
+def _sync_alerts_forever():
+    while True:
+        time.sleep(ALERT_SYNC_INTERVAL)
+        try:
+            _sync_alerts()
+        except Exception as e:
+            logger.exception(r'An error occurred trying to read alerts from the specified DB:')
+
+
+def _load_chat_currencies():
+    chat_currencies.update(chat_pref_repo.get_quote_currencies(session_maker))
+    logger.info('Loaded the quote currency of {} chats.'.format(len(chat_currencies)))
+
+
+def _set_currency(bot, update):
+    # '/currency eur' makes /p and /cap answer in euros in this chat, '/currency usd' goes back to USD
     try:
         if not _validate_telegram_update(update):
             return
         _log_command(update.message.from_user.id, update.message.chat.id, update.message.text)
-
-        request_text = update.message.text.lower().replace("/change", "").strip()
-        request_text = _strip_bot_user_name(request_text)
-        if request_text == '':
-            update.message.reply_text('Invalid Request Format.  Try \'/change eth\' or /help for more info', quote=False)
+        tg_chat_id = update.message.chat.id
+        currency = _get_request_text(update.message.text, '/currency').upper()
+        if currency == '':
+            update.message.reply_text('Prices in this chat are in {}.  Try \'/currency eur\', or \'/p btc eur\' for '
+                                      'a single request.'.format(chat_currencies.get(tg_chat_id, USD)), quote=False)
             return
-        requested_ticker = request_text.upper()
-        if requested_ticker not in crypto_by_ticker:
-            update.message.reply_text('Invalid Ticker Symbol', quote=False)
+        if currency != USD and currency not in ticker_snapshot.rates:
+            update.message.reply_text('Unknown currency.  Try one of: {}'.format(
+                ', '.join(sorted(ticker_snapshot.rates) or [USD])), quote=False)
             return
-
-        ticker = crypto_by_ticker[requested_ticker]
-
-        reply = '{} ({}) Change:'.format(ticker.currency_name, requested_ticker)
-        if ticker.percent_change_1h is not None:
-            reply += '\n01H | {}'.format(crypto_helpers.format_percent_change(ticker.percent_change_1h))
-        else:
-            reply += '\n01H | Not Available'
-        if ticker.percent_change_24h is not None:
-            reply += '\n24H | {}'.format(crypto_helpers.format_percent_change(ticker.percent_change_24h))
-        else:
-            reply += '\n24H | Not Available'
-        if ticker.percent_change_7d is not None:
-            reply += '\n07D | {}'.format(crypto_helpers.format_percent_change(ticker.percent_change_7d))
-        else:
-            reply += '\n07D | Not Available'
-        if ticker.percent_change_30d is not None:
-            reply += '\n30D | {}'.format(crypto_helpers.format_percent_change(ticker.percent_change_30d))
-        else:
-            reply += '\n30D | Not Available'
-        if ticker.percent_change_1y is not None:
-            reply += '\n01Y  | {}'.format(crypto_helpers.format_percent_change(ticker.percent_change_1y))
+        if session_maker is not None:
+            chat_pref_repo.set_quote_currency(session_maker, tg_chat_id, None if currency == USD else currency)
+        if currency == USD:
+            chat_currencies.pop(tg_chat_id, None)
         else:
-            reply += '\n01Y  | Not Available'
-        update.message.reply_text(reply, quote=False)
+            chat_currencies[tg_chat_id] = currency
+        update.message.reply_text('Prices in this chat are now in {}.'.format(currency), quote=False)
     except Exception as e:
         logger.exception(r'An error occurred while processing this command:')
         update.message.reply_text('Oops! Something went wrong with this request. Please try again later.')
 
 
-def _top_ten(bot, update):
+def _add_alert(bot, update):
     try:
         if not _validate_telegram_update(update):
             return
         _log_command(update.message.from_user.id, update.message.chat.id, update.message.text)
+        snapshot = ticker_snapshot
+        # without a db an alert set on this worker would never reach the alert owner
+        if not alert_owner and session_maker is None:
+            update.message.reply_text('Price alerts are not available right now.', quote=False)
+            return
 
-        tickers = crypto_list[:200]
-        tickers = list(filter(lambda x: x.percent_change_24h is not None, tickers))
-        tickers.sort(key=lambda x: x.percent_change_24h, reverse=True)
-        top_tickers = tickers[:10]
-
-        top_result = 'Biggest 24h gainers out of top 200 by market cap:\n'
-        for index, ticker in enumerate(top_tickers):
-            top_result += '{}. {} ({}): {}\n'.format(index + 1, ticker.currency_name, ticker.ticker_symbol,
-                                                crypto_helpers.format_percent_change(ticker.percent_change_24h))
-        update.message.reply_text(top_result, quote=False)
+        request_text = _get_request_text(update.message.text, '/alert')
+        try:
+            ticker_symbol, metric, direction, threshold = _parse_alert_args(request_text)
+        except InvalidArgument:
+            update.message.reply_text('Invalid Request Format.  Try \'/alert btc > 70000\' or \'/alert eth -5% 1h\'',
+                                      quote=False)
+            return
+        if ticker_symbol not in snapshot:
+            update.message.reply_text('Invalid Ticker Symbol', quote=False)
+            return
+        tg_user_id, tg_chat_id = update.message.from_user.id, update.message.chat.id
+        if len(alert_index.get_chat_alerts(tg_chat_id)) >= MAX_ALERTS_PER_CHAT:
+            update.message.reply_text('This chat already has {} alerts.  Remove one with /delalert first.'
+                                      .format(MAX_ALERTS_PER_CHAT), quote=False)
+            return
+        alert = price_alerts.PriceAlert(None, tg_user_id, tg_chat_id, ticker_symbol, metric, direction, threshold)
+        current_value = price_alerts.get_value(snapshot.store, ticker_symbol, metric)
+        if current_value is not None and (current_value >= threshold if direction == price_alerts.ABOVE
+                                          else current_value <= threshold):
+            update.message.reply_text('Alert not set: {} is already true.  Alerts fire when the threshold is crossed.'
+                                      .format(_describe_alert(alert)), quote=False)
+            return
+        if alert_index.contains_key(alert):
+            update.message.reply_text('This alert already exists.  See /alerts', quote=False)
+            return
+        if session_maker is not None:
+            alert.alert_id = alert_repo.add_alert(session_maker, tg_user_id, tg_chat_id, ticker_symbol, metric,
+                                                  direction, threshold)
+        else:
+            alert.alert_id = alert_index.next_id()
+        alert_index.add(alert, current_value)
+        update.message.reply_text('Alert {} set: {}'.format(alert.alert_id, _describe_alert(alert)), quote=False)
     except Exception as e:
         logger.exception(r'An error occurred while processing this command:')
         update.message.reply_text('Oops! Something went wrong with this request. Please try again later.')
 
 
-def _bottom_ten(bot, update):
+def _list_alerts(bot, update):
     try:
         if not _validate_telegram_update(update):
             return
         _log_command(update.message.from_user.id, update.message.chat.id, update.message.text)
-
-        tickers = crypto_list[:200]
-        tickers = list(filter(lambda x: x.percent_change_24h is not None, tickers))
-        tickers.sort(key=lambda x: x.percent_change_24h)
-        bottom_tickers = tickers[:10]
-
-        bottom_result = 'Biggest 24h losers out of top 200 by market cap:\n'
-        for index, ticker in enumerate(bottom_tickers):
-            bottom_result += '{}. {} ({}): {}\n'.format(index + 1, ticker.currency_name, ticker.ticker_symbol,
-                                                   crypto_helpers.format_percent_change(ticker.percent_change_24h))
-        update.message.reply_text(bottom_result, quote=False)
+        alerts = alert_index.get_chat_alerts(update.message.chat.id)
+        if not alerts:
+            update.message.reply_text('There are no alerts in this chat.  Try \'/alert btc > 70000\'', quote=False)
+            return
+        reply = 'Alerts in this chat:'
+        for alert in alerts:
+            reply += '\n{}. {}'.format(alert.alert_id, _describe_alert(alert))
+        update.message.reply_text(reply, quote=False)
     except Exception as e:
         logger.exception(r'An error occurred while processing this command:')
         update.message.reply_text('Oops! Something went wrong with this request. Please try again later.')
 
 
-def _compare(bot, update):
+def _delete_alert(bot, update):
     try:
         if not _validate_telegram_update(update):
             return
         _log_command(update.message.from_user.id, update.message.chat.id, update.message.text)
-
-        request_text = update.message.text.lower().replace("/compare", "").strip()
-        request_text = _strip_bot_user_name(request_text)
-        if request_text == '' or '/' not in request_text:
-            update.message.reply_text('Invalid Request Format.  Try \'/compare eth/btc\' or /help for more info', quote=False)
-            return
-        symbols = request_text.split('/')
-        if symbols[0].strip() == '' or symbols[1].strip() == '':
-            update.message.reply_text('Invalid Request Format.  Try \'/compare eth/btc\' or /help for more info', quote=False)
-            return
-        requested_ticker_1 = symbols[0].strip().upper()
-        requested_ticker_2 = symbols[1].strip().upper()
-        if requested_ticker_1 not in crypto_by_ticker or requested_ticker_2 not in crypto_by_ticker:
-            update.message.reply_text('Invalid Ticker Symbol', quote=False)
+        request_text = _get_request_text(update.message.text, '/delalert')
+        if not request_text.isdigit():
+            update.message.reply_text('Invalid Request Format.  Try \'/delalert 12\', ids are listed by /alerts',
+                                      quote=False)
             return
-        if requested_ticker_1 == requested_ticker_2:
-            update.message.reply_text('Use two different ticker symbols.  Try \'/compare eth/btc\' or /help for more info', quote=False)
+        alert_id = int(request_text)
+        chat_alert_ids = [alert.alert_id for alert in alert_index.get_chat_alerts(update.message.chat.id)]
+        if alert_id not in chat_alert_ids:
+            update.message.reply_text('Alert {} was not found in this chat.'.format(alert_id), quote=False)
             return
-        ticker_1 = crypto_by_ticker[requested_ticker_1]
-        ticker_2 = crypto_by_ticker[requested_ticker_2]
-
-        reply = '{} ({}) vs. {} ({}):'.format(ticker_1.currency_name, requested_ticker_1, ticker_2.currency_name, requested_ticker_2)
-        if ticker_1.percent_change_1h is not None and ticker_2.percent_change_1h is not None:
-            reply += '\n01H | {}'.format(
-                crypto_helpers.format_percent_change(crypto_helpers.get_relative_percent_change(ticker_1.usd_price,
-                                                                                                ticker_1.percent_change_1h, ticker_2.usd_price,
-                                                                                                ticker_2.percent_change_1h)))
-        else:
-            reply += '\n01H | Not Available'
-        if ticker_1.percent_change_24h is not None and ticker_2.percent_change_24h is not None:
-            reply += '\n24H | {}'.format(
-                crypto_helpers.format_percent_change(crypto_helpers.get_relative_percent_change(ticker_1.usd_price,
-                                                                                                ticker_1.percent_change_24h, ticker_2.usd_price,
-                                                                                                ticker_2.percent_change_24h)))
-        else:
-            reply += '\n24H | Not Available'
-        if ticker_1.percent_change_7d is not None and ticker_2.percent_change_7d is not None:
-            reply += '\n07D | {}'.format(
-                crypto_helpers.format_percent_change(crypto_helpers.get_relative_percent_change(ticker_1.usd_price,
-                                                                                                ticker_1.percent_change_7d, ticker_2.usd_price,
-                                                                                                ticker_2.percent_change_7d)))
-        else:
-            reply += '\n07D | Not Available'
-        if ticker_1.percent_change_30d is not None and ticker_2.percent_change_30d is not None:
-            reply += '\n30D | {}'.format(
-                crypto_helpers.format_percent_change(crypto_helpers.get_relative_percent_change(ticker_1.usd_price,
-                                                                                                ticker_1.percent_change_30d, ticker_2.usd_price,
-                                                                                                ticker_2.percent_change_30d)))
-        else:
-            reply += '\n30D | Not Available'
-        if ticker_1.percent_change_1y is not None and ticker_2.percent_change_1y is not None:
-            reply += '\n01Y  | {}'.format(
-                crypto_helpers.format_percent_change(crypto_helpers.get_relative_percent_change(ticker_1.usd_price,
-                                                                                                ticker_1.percent_change_1y, ticker_2.usd_price,
-                                                                                                ticker_2.percent_change_1y)))
-        else:
-            reply += '\n01Y  | Not Available'
-        update.message.reply_text(reply, quote=False)
+        if session_maker is not None:
+            alert_repo.delete_alert(session_maker, alert_id)
+        alert_index.remove(alert_id)
+        update.message.reply_text('Alert {} deleted.'.format(alert_id), quote=False)
     except Exception as e:
         logger.exception(r'An error occurred while processing this command:')
         update.message.reply_text('Oops! Something went wrong with this request. Please try again later.')
 
 
+def _parse_alert_args(request_text):
+    # '{ticker} > {usd price}', '{ticker} < {usd price}' or '{ticker} {+/-percent}% {window}'
+    # returns (ticker_symbol, metric, direction, threshold)
+    match = re.fullmatch(r'(\S+?) ?([<>]) ?\$?(\d+(?:\.\d+)?)', request_text)
+    if match is not None:
+        return match.group(1).upper(), price_alerts.PRICE, match.group(2), float(match.group(3))
+    match = re.fullmatch(r'(\S+) ([+-]?\d+(?:\.\d+)?)% (\S+)', request_text)
+    if match is not None and match.group(3) in ticker_store.CHANGE_WINDOWS:
+        threshold = float(match.group(2))
+        direction = price_alerts.BELOW if match.group(2).startswith('-') else price_alerts.ABOVE
+        return match.group(1).upper(), match.group(3), direction, threshold
+    raise InvalidArgument('Invalid alert arguments: \'{}\''.format(request_text))
+
+
+def _describe_alert(alert):
+    if alert.metric == price_alerts.PRICE:
+        return '{} price {}{}'.format(alert.ticker_symbol, alert.direction, crypto_helpers.format_usd(alert.threshold))
+    return '{} {} change {} {}'.format(alert.ticker_symbol, alert.metric, alert.direction,
+                                       crypto_helpers.format_percent_change(alert.threshold))
+
+
+def _notify_alerts(snapshot, fired, rearmed):
+    # runs on its own thread so sending messages never delays the next refresh
+    try:
+        if session_maker is not None:
+            armed_by_id = {alert.alert_id: False for alert, _ in fired}
+            armed_by_id.update({alert.alert_id: True for alert in rearmed})
+            alert_repo.set_armed(session_maker, armed_by_id)
+    except Exception as e:
+        logger.exception(r'An error occurred trying to update alerts in the specified DB:')
+    if telegram_bot is None:
+        return
+    fired_by_chat = {}
+    for alert, value in fired:
+        fired_by_chat.setdefault(alert.tg_chat_id, []).append((alert, value))
+    for tg_chat_id, chat_alerts in fired_by_chat.items():
+        message = 'Price alert!'
+        for alert, value in chat_alerts:
+            ticker = snapshot.get(alert.ticker_symbol)
+            if alert.metric == price_alerts.PRICE:
+                current = crypto_helpers.format_usd(value)
+            else:
+                current = ' {}'.format(crypto_helpers.format_percent_change(value))
+            message += '\n{} ({}): now{} | alert was {}'.format(ticker.currency_name, alert.ticker_symbol, current,
+                                                                 _describe_alert(alert))
+        try:
+            telegram_bot.send_message(tg_chat_id, message)
+        except Exception as e:
+            logger.exception('Unable to send price alert to chat {}:'.format(tg_chat_id))
+
+
 def _get_help(bot, update):
     if not _validate_telegram_update(update):
         return
     _log_command(update.message.from_user.id, update.message.chat.id, update.message.text)
     update.message.reply_text('The following commands are available:\n' \
                 '/p {ticker_symbol} - get the price of a crypto. volume and % change are for the past 24h\n' \
+                '/p, /cap and /change also take several ticker symbols, e.g. \'/p btc eth sol\', or a CoinGecko id for ' \
+                'coins that share a symbol, e.g. \'/p wrapped-bitcoin\'.\n' \
+                'Type @{bot_name} {name or symbol} in any chat to search for a crypto.\n' \
                 '/cap {ticker_symbol} - get the market cap of a crypto.\n' \
+                '/p and /cap answer in another currency when it is added at the end, e.g. \'/p btc eur\'. ' \
+                '/currency {currency} sets the default for a chat, e.g. \'/currency eur\'. % changes are in USD.\n' \
                 '/change {ticker_symbol} - get % change over time for a crypto.\n' \
+                '/change {ticker_symbol} {window} - get % change, low, high and VWAP over a recent window, e.g. 15m.\n' \
                 '/compare {ticker_symbol}/{ticker_symbol} - compare crypto A vs crypto B over time.\n' \
+                '/alert {ticker_symbol} > {price} - get a message when the price crosses a threshold. also < {price} or ' \
+                '{+/-percent}% {window}, e.g. \'/alert eth -5% 1h\'. /alerts lists the alerts in a chat, /delalert {id} ' \
+                'removes one.\n' \
                 '/top - get the 10 best performing cryptos (out of top 200 market cap) in the past 24 hours.\n' \
-                '/bottom - get the 10 worst performing cryptos (out of top 200 market cap) in the past 24 hours.', quote=False)
+                '/bottom - get the 10 worst performing cryptos (out of top 200 market cap) in the past 24 hours.\n' \
+                '/top {window} {count} {universe} - e.g. \'/top 7d 20\'. window is 1h|24h|7d|30d|1y, count is up to 25, ' \
+                'universe is the top 100|200|500 by market cap. /bottom takes the same options.', quote=False)
+
+
+def _inline_query(bot, update):
+    # '@botname bit' in any chat: the best ranked tickers matching the text, each sending its /p reply when picked
+    try:
+        if update is None or update.inline_query is None:
+            return
+        query = update.inline_query.query.strip()
+        if query == '':
+            return
+        snapshot = ticker_snapshot
+        results = []
+        for ticker in snapshot.search_index.complete(query, MAX_INLINE_RESULTS):
+            request_key = _get_request_key(snapshot, ticker)
+            reply = reply_cache.get_or_render('/p', request_key.lower(), snapshot, _render_price)
+            results.append(InlineQueryResultArticle(id=request_key,
+                                                    title='{} ({})'.format(ticker.currency_name, ticker.ticker_symbol),
+                                                    description=crypto_helpers.format_usd(ticker.usd_price).strip(),
+                                                    input_message_content=InputTextMessageContent(reply)))
+        update.inline_query.answer(results, cache_time=INLINE_CACHE_TIME)
+    except Exception as e:
+        logger.exception(r'An error occurred while answering this inline query:')
+
+
+class _ThrottledBot(Bot):
+    # the threaded runtime's bot: replies and alert notifications go through send_throttle. a message that has to
+    # wait is handed to delayed_sender and a concurrent.futures.Future of the send is returned instead of the
+    # message, so the dispatcher thread moves on to the next update
+    def send_message(self, chat_id, *args, **kwargs):
+        delay = send_throttle.reserve(chat_id)
+        if delay is None:
+            logger.debug('Send limit reached, message to chat {} was dropped.'.format(chat_id))
+            return None
+        if delay > 0:
+            return delayed_sender.submit(delay, super().send_message, chat_id, *args, **kwargs)
+        return super().send_message(chat_id, *args, **kwargs)
 
 
 def _validate_telegram_update(update):
     return update is not None and update.message is not None and update.message.from_user is not None and update.message.chat is not None
 
 
+def _get_request_text(message_text, command):
+    # lower case command arguments with the command, bot user name and repeated whitespace removed
+    request_text = message_text.lower().replace(command, "").strip()
+    request_text = _strip_bot_user_name(request_text)
+    return ' '.join(request_text.split())
+
+
 def _strip_bot_user_name(request_text):
     # commands can be sent from telegram with this format sometimes: /command@botusername
     # in this case we strip out the username so we can get raw command text
@@ -382,5 +1147,20 @@ def _error(bot, update, error):
         logger.exception('Update "%s" caused error "%s"' % (update, error))
 
 
+# (command, handler, blocking). the async runtime runs blocking handlers, which wait on the db, on a worker thread
+COMMAND_HANDLERS = [('help', _get_help, False),
+                    ('p', _get_price, False),
+                    ('cap', _get_market_cap, False),
+                    ('change', _get_change, False),
+                    ('top', _top_ten, False),
+                    ('bottom', _bottom_ten, False),
+                    ('compare', _compare, False),
+                    ('stats', _get_stats, True),
+                    ('alert', _add_alert, True),
+                    ('alerts', _list_alerts, False),
+                    ('delalert', _delete_alert, True),
+                    ('currency', _set_currency, True)]
+
+
 if __name__ == '__main__':
     main()
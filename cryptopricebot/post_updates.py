@@ -0,0 +1,44 @@
+import argparse
+import json
+
+import requests
+
+from cryptopricebot.webhook_server import SECRET_TOKEN_HEADER
+
+
+def main():
+    # posts recorded telegram updates to a bot running with '-mode webhook', the way telegram would, e.g.
+    # python cryptopricebot/post_updates.py -url http://localhost:8443/telegram -secret my_secret -file updates.json
+    cmd_args = _get_args()
+    with open(cmd_args.file) as updates_file:
+        updates = _read_updates(updates_file.read())
+    session = requests.Session()
+    statuses = {}
+    for update in updates:
+        response = session.post(cmd_args.url, json=update, headers={SECRET_TOKEN_HEADER: cmd_args.secret},
+                                timeout=10)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        if response.status_code != 200:
+            print('update {}: HTTP {}'.format(update.get('update_id'), response.status_code))
+    print('Posted {} updates: {}'.format(len(updates), ', '.join('{} x HTTP {}'.format(count, status)
+                                                                 for status, count in sorted(statuses.items()))))
+
+
+def _get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-url", required=True)
+    parser.add_argument("-secret", required=True)
+    # a json list of updates, or one update per line
+    parser.add_argument("-file", required=True)
+    return parser.parse_args()
+
+
+def _read_updates(text):
+    text = text.strip()
+    if text.startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+if __name__ == '__main__':
+    main()
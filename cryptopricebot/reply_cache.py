@@ -0,0 +1,94 @@
+import threading
+from collections import Counter, OrderedDict
+
+MAX_SIZE = 5000
+# how many of the most requested (command, args) pairs are rendered right after a new snapshot is published
+PRERENDER_COUNT = 50
+
+
+class ReplyCache:
+    # Rendered reply text keyed by (command, normalized args, snapshot version). A reply only depends on the
+    # snapshot it was rendered from, so every entry stays valid until the next snapshot is published, at which
+    # point the cache is dropped, except for the replies the publisher says still read the same. Least recently used
+    # entries are evicted once max_size is reached.
+    def __init__(self, max_size=MAX_SIZE, prerender_count=PRERENDER_COUNT):
+        self.max_size = max_size
+        self.prerender_count = prerender_count
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.prerendered = 0
+        self.carried = 0
+        self._replies = OrderedDict()
+        self._request_counts = Counter()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, command, args, snapshot, render):
+        key = (command, args, snapshot.version)
+        with self._lock:
+            self._count_request(command, args)
+            reply = self._replies.get(key)
+            if reply is not None:
+                self._replies.move_to_end(key)
+                self.hits += 1
+                return reply
+            self.misses += 1
+        reply = render(snapshot, args)
+        self._put(key, reply)
+        return reply
+
+    def publish(self, snapshot, renderers=None, keep=None):
+        # called by the refresh thread after it swaps in a new snapshot. renderers maps a command to the function
+        # get_or_render() is called with for that command and is used to pre-render the popular requests. keep is
+        # called with (command, args) of every cached reply and returns whether it is still right for snapshot, those
+        # are carried over to the new version instead of being rendered again.
+        with self._lock:
+            if self.version is not None and snapshot.version <= self.version:
+                return
+            self.version = snapshot.version
+            replies = self._replies
+            self._replies = OrderedDict()
+            popular = [key for key, count in self._request_counts.most_common(self.prerender_count)]
+        if keep is not None:
+            carried = [((command, args, snapshot.version), reply) for (command, args, _), reply in replies.items()
+                       if keep(command, args)]
+            with self._lock:
+                for key, reply in carried:
+                    # handlers may have rendered the same request from the new snapshot in the meantime
+                    self._replies.setdefault(key, reply)
+                self.carried += len(carried)
+        if renderers is None:
+            return
+        for command, args in popular:
+            render = renderers.get(command)
+            with self._lock:
+                if (command, args, snapshot.version) in self._replies:
+                    continue
+            if render is not None:
+                self._put((command, args, snapshot.version), render(snapshot, args))
+                with self._lock:
+                    self.prerendered += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'version': self.version, 'size': len(self._replies), 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / total if total else 0.0, 'prerendered': self.prerendered,
+                    'carried': self.carried}
+
+    def _put(self, key, reply):
+        with self._lock:
+            # a handler still holding an older snapshot must not refill the cache after a publish
+            if self.version is not None and key[2] < self.version:
+                return
+            self._replies[key] = reply
+            self._replies.move_to_end(key)
+            while len(self._replies) > self.max_size:
+                self._replies.popitem(last=False)
+
+    def _count_request(self, command, args):
+        self._request_counts[(command, args)] += 1
+        # keep the popularity counter bounded; halving keeps the ranking while letting old favourites fade out
+        if len(self._request_counts) > self.max_size:
+            self._request_counts = Counter({key: count // 2 for key, count in
+                                            self._request_counts.most_common(self.max_size // 2) if count // 2})
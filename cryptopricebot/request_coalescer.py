@@ -0,0 +1,45 @@
+import threading
+import time
+from collections import OrderedDict
+
+# seconds during which a repeat of a request in the same chat is answered by the reply already sent
+WINDOW = 3.0
+
+
+class RequestCoalescer:
+    # Merges identical requests in a chat: the first (chat, command, args, snapshot version) inside window seconds
+    # gets a reply, repeats are dropped because that reply is already in the chat. A claim whose reply did not go
+    # out is released. Keys are kept in arrival order,
+    # so expired ones are always at the front. clock is only replaced in tests.
+    def __init__(self, window=WINDOW, clock=time.monotonic):
+        self.window = window
+        self.clock = clock
+        self.merged = 0
+        self._expiries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, tg_chat_id, command, args, version):
+        # True if the caller should reply, False if the request was merged into an earlier one
+        key = (tg_chat_id, command, args, version)
+        with self._lock:
+            now = self.clock()
+            while self._expiries:
+                oldest_key, expiry = next(iter(self._expiries.items()))
+                if expiry > now:
+                    break
+                del self._expiries[oldest_key]
+            if key in self._expiries:
+                self.merged += 1
+                return False
+            self._expiries[key] = now + self.window
+            return True
+
+    def release(self, tg_chat_id, command, args, version):
+        # forgets a claim whose reply was never sent, e.g. because rendering failed or the send throttle dropped it,
+        # so a repeat of the request is answered
+        with self._lock:
+            self._expiries.pop((tg_chat_id, command, args, version), None)
+
+    def stats(self):
+        with self._lock:
+            return {'merged': self.merged, 'pending': len(self._expiries)}
@@ -0,0 +1,175 @@
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+# telegram allows about 30 messages per second overall, one per second in a private chat and 20 per minute in a
+# group. group chats have negative ids.
+GLOBAL_RATE = 30.0
+GLOBAL_BURST = 30
+CHAT_RATE = 1.0
+CHAT_BURST = 3
+GROUP_RATE = 20 / 60
+GROUP_BURST = 5
+# a message that would have to wait longer than this is dropped, by then the reply is stale anyway
+MAX_DELAY = 10.0
+MAX_CHATS = 50000
+# threads sending the delayed messages once they are due, a send waits on the Bot API for a round trip
+SEND_WORKERS = 4
+
+
+class TokenBucket:
+    # Holds up to burst tokens and refills at rate tokens per second. A reservation always takes a token; when there
+    # is none the balance goes negative and the caller is told how long to wait for its turn, so waiting callers are
+    # served in order at exactly the refill rate.
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def reserve(self, now):
+        # seconds until the reserved token is available
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self):
+        self.tokens = min(self.tokens + 1, self.burst)
+
+    def pause(self, seconds, now):
+        # nothing goes out for the next `seconds`, e.g. after a 429 with retry_after
+        self._refill(now)
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class SendThrottle:
+    # Outbound rate limiting for the Bot API: every message reserves a token from the bucket of its chat and from
+    # the global bucket and is sent once both are available. Chat buckets are kept for the max_chats most recently
+    # used chats. clock is only replaced in tests.
+    def __init__(self, global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST,
+                 group_rate=GROUP_RATE, group_burst=GROUP_BURST, max_delay=MAX_DELAY, max_chats=MAX_CHATS,
+                 clock=time.monotonic):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_delay = max_delay
+        self.max_chats = max_chats
+        self.clock = clock
+        self.sent = 0
+        self.delayed = 0
+        self.dropped = 0
+        self.total_delay = 0.0
+        self._global = TokenBucket(global_rate, global_burst, clock())
+        self._chats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def reserve(self, chat_id):
+        # seconds the caller has to wait before sending to chat_id, or None if the message should be dropped
+        with self._lock:
+            now = self.clock()
+            chat_bucket = self._get_chat_bucket(chat_id, now)
+            delay = max(chat_bucket.reserve(now), self._global.reserve(now))
+            if delay > self.max_delay:
+                chat_bucket.refund()
+                self._global.refund()
+                self.dropped += 1
+                return None
+            self.sent += 1
+            if delay > 0:
+                self.delayed += 1
+                self.total_delay += delay
+            return delay
+
+    def pause(self, chat_id, seconds):
+        with self._lock:
+            now = self.clock()
+            self._get_chat_bucket(chat_id, now).pause(seconds, now)
+
+    def stats(self):
+        with self._lock:
+            return {'sent': self.sent, 'delayed': self.delayed, 'dropped': self.dropped,
+                    'total_delay': round(self.total_delay, 3), 'chats': len(self._chats)}
+
+    def _get_chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst, now)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst, now)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+
+class DelayedSender:
+    # Sends the messages the throttle delayed for the threaded runtime, so the dispatcher threads that handle updates
+    # never sleep waiting for their turn. One timer thread keeps the pending sends ordered by due time and hands each
+    # one to a small pool of send_workers threads once it is due. submit() returns a concurrent.futures.Future with
+    # the result of the send.
+    def __init__(self, send_workers=SEND_WORKERS):
+        self.send_workers = send_workers
+        self._pending = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._executor = None
+        self._thread = None
+        self._closed = False
+
+    def submit(self, delay, send, *args, **kwargs):
+        # calls send(*args, **kwargs) in delay seconds
+        future = concurrent.futures.Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('DelayedSender is closed')
+            if self._thread is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(self.send_workers,
+                                                                       thread_name_prefix='delayed-send')
+                self._thread = threading.Thread(target=self._run, name='delayed-sender', daemon=True)
+                self._thread.start()
+            heapq.heappush(self._pending, (time.monotonic() + delay, next(self._sequence), future, send, args, kwargs))
+            self._condition.notify()
+        return future
+
+    def close(self, timeout=15):
+        # sends what is still pending right away, then stops the threads
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            self._executor.shutdown(wait=True)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._pending and (self._closed or self._pending[0][0] <= time.monotonic()):
+                        _, _, future, send, args, kwargs = heapq.heappop(self._pending)
+                        break
+                    if self._closed:
+                        return
+                    self._condition.wait(self._pending[0][0] - time.monotonic() if self._pending else None)
+            if future.set_running_or_notify_cancel():
+                self._executor.submit(_run_send, future, send, args, kwargs)
+
+
+def _run_send(future, send, args, kwargs):
+    try:
+        future.set_result(send(*args, **kwargs))
+    except BaseException as e:
+        future.set_exception(e)
@@ -0,0 +1,76 @@
+import argparse
+import pathlib
+import time
+
+from coingeckoapi import coingecko_api
+from coingeckoapi.coingecko_provider import CoinGeckoProvider
+from coingeckoapi.exchange_rates import ExchangeRates
+from coingeckoapi.page_tiers import PageTiers
+from coingeckoapi.refresh_scheduler import RefreshScheduler
+from cryptoshared import logging_helpers, snapshot_file
+from cryptoshared.price_providers import ProviderSet
+from cryptoshared.snapshot_channel import SnapshotPublisher
+from cryptoshared.ticker_snapshot import TickerSnapshot
+
+
+def main():
+    # fetches tickers from coingecko for any number of bot workers on the same machine, each started with the same
+    # -snapshotfile and -snapshotsocket, e.g.
+    # python cryptopricebot/snapshot_fetcher.py -snapshotfile /run/cpb/snapshot.bin -snapshotsocket /run/cpb/snapshot.sock
+    cmd_args = _get_args()
+    pathlib.Path('logs').mkdir(parents=True, exist_ok=True)
+    logger = logging_helpers.build_logger('fetcher-logger', 'logs/snapshotfetcher.log', cmd_args.loglvl)
+
+    # workers do not report requests to the fetcher, so besides the top page every page is refreshed in rotation
+    tiers = PageTiers()
+    exchange_rates = ExchangeRates()
+    scheduler = RefreshScheduler(budget=cmd_args.cgbudget, page_count=tiers.max_pages + 1)
+    price_sources = ProviderSet([CoinGeckoProvider(tiers, logger, base_url=cmd_args.coingeckourl)],
+                                report_factory=coingecko_api.RefreshReport, logger=logger,
+                                on_late_report=scheduler.record_late)
+    publisher = SnapshotPublisher(cmd_args.snapshotfile, cmd_args.snapshotsocket, logger=logger).start()
+    # workers ignore versions they have already seen, so a restarted fetcher continues where the file left off
+    version = snapshot_file.read_version(cmd_args.snapshotfile)
+    logger.info('Publishing snapshots to {} from version {}'.format(cmd_args.snapshotfile, version + 1))
+    snapshot = None
+    try:
+        while True:
+            report = coingecko_api.RefreshReport()
+            rows = []
+            try:
+                rows, shadowed = price_sources.fetch(report)
+                if rows:
+                    version += 1
+                    rates = exchange_rates.get(logger=logger, base_url=cmd_args.coingeckourl, report=report)
+                    snapshot = TickerSnapshot.from_rows(rows, version, shadowed=shadowed, previous=snapshot,
+                                                        rates=rates, fetched=tiers.fetched_mask(rows))
+                    publisher.publish(snapshot)
+                    logger.debug('Published snapshot {} to {} workers'.format(version, publisher.subscribers()))
+            except Exception:
+                logger.exception(r'An error occurred with coingecko api:')
+            # a refresh skipped because the previous one is still running made no request and did not fail
+            if not report.skipped:
+                scheduler.record(report, bool(rows))
+            if report.rate_limited:
+                logger.error('CoinGecko rate limited {} of {} pages'.format(report.rate_limited, report.requests))
+            time.sleep(scheduler.next_delay())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        price_sources.close()
+        publisher.close()
+
+
+def _get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-loglvl", default='info', choices=['debug', 'info', 'error'])
+    parser.add_argument("-snapshotfile", required=True)
+    parser.add_argument("-snapshotsocket", required=True)
+    # coingecko requests allowed per minute, see crypto_price_bot.py
+    parser.add_argument("-cgbudget", type=int, default=30)
+    parser.add_argument("-coingeckourl", default=coingecko_api.API_BASE_URL)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
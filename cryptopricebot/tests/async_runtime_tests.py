@@ -0,0 +1,181 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptopricebot.async_runtime import AsyncBotRuntime
+from cryptopricebot.send_throttle import SendThrottle
+
+BOT_KEY = '123:abc'
+
+
+class StubBotApiHandler(BaseHTTPRequestHandler):
+    # getUpdates hands out the queued updates and records its (offset, timeout), deleteWebhook is counted and every
+    # other call is recorded.
+    # errors holds the error responses to return for the next calls, by method.
+    updates = []
+    polls = []
+    calls = []
+    webhook_deletions = 0
+    errors = {}
+    lock = threading.Lock()
+
+    def do_POST(self):
+        method = self.path.rsplit('/', 1)[-1]
+        error = None
+        params = json.loads(self.rfile.read(int(self.headers['Content-Length'])) or b'{}')
+        if method == 'getMe':
+            result = {'id': 1, 'username': 'test_bot'}
+        elif method == 'deleteWebhook':
+            with self.lock:
+                StubBotApiHandler.webhook_deletions += 1
+            result = True
+        elif method == 'getUpdates':
+            with self.lock:
+                self.polls.append((params.get('offset'), params.get('timeout')))
+                result = [update for update in self.updates if update['update_id'] >= params.get('offset', 0)]
+            if not result:
+                time.sleep(0.05)
+        else:
+            with self.lock:
+                error = self.errors.get(method, []).pop(0) if self.errors.get(method) else None
+                if error is None:
+                    self.calls.append((method, params))
+            result = True
+        body = json.dumps(error or {'ok': True, 'result': result}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def build_message(update_id, text, chat_id=10):
+    return {'update_id': update_id, 'message': {'message_id': update_id, 'text': text, 'from': {'id': 5},
+                                                'chat': {'id': chat_id, 'type': 'private'}}}
+
+
+class AsyncBotRuntimeTests(unittest.TestCase):
+    def setUp(self):
+        StubBotApiHandler.updates = []
+        StubBotApiHandler.polls = []
+        StubBotApiHandler.calls = []
+        StubBotApiHandler.webhook_deletions = 0
+        StubBotApiHandler.errors = {}
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubBotApiHandler)
+        self.server.daemon_threads = True
+        self.server.block_on_close = False
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def start_runtime(self, commands, **kwargs):
+        runtime = AsyncBotRuntime(BOT_KEY, commands, poll_timeout=1, api_base_url=self.base_url, **kwargs)
+        thread = threading.Thread(target=runtime.run, daemon=True)
+        thread.start()
+        return runtime, thread
+
+    def wait_for_calls(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(StubBotApiHandler.calls) < count and time.monotonic() < deadline:
+            time.sleep(0.02)
+        return sorted(StubBotApiHandler.calls, key=lambda call: call[1].get('chat_id', 0))
+
+    def test_commands_and_inline_queries(self):
+        def echo(bot, update):
+            update.message.reply_text('echo ' + update.message.text, quote=False)
+
+        def answer(bot, update):
+            update.inline_query.answer([{'type': 'article', 'id': update.inline_query.query}], cache_time=5)
+
+        StubBotApiHandler.updates = [build_message(1, '/p btc', chat_id=1), build_message(2, '/P@test_bot eth', chat_id=2),
+                                     build_message(3, '/p@other_bot ltc'), build_message(4, 'hello'),
+                                     build_message(5, '/unknown'),
+                                     {'update_id': 6, 'inline_query': {'id': 'q', 'query': 'bit', 'from': {'id': 5}}}]
+        runtime, thread = self.start_runtime([('p', echo, False)], inline_handler=answer)
+        calls = self.wait_for_calls(3)
+        runtime.stop()
+        thread.join(5)
+        self.assertEqual([('answerInlineQuery', {'inline_query_id': 'q', 'results': [{'type': 'article', 'id': 'bit'}],
+                                                 'cache_time': 5}),
+                          ('sendMessage', {'chat_id': 1, 'text': 'echo /p btc'}),
+                          ('sendMessage', {'chat_id': 2, 'text': 'echo /P@test_bot eth'})], calls)
+        self.assertEqual(3, runtime.handled)
+        # a webhook left behind by an earlier run would make every getUpdates fail
+        self.assertEqual(1, StubBotApiHandler.webhook_deletions)
+        # the last updates were confirmed on shutdown
+        self.assertEqual((7, 0), StubBotApiHandler.polls[-1])
+
+    def test_bounded_concurrency_and_drain_on_stop(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def slow(bot, update):
+            with lock:
+                running.append(update.update_id)
+                peak.append(len(running))
+            time.sleep(0.2)
+            with lock:
+                running.remove(update.update_id)
+            update.message.reply_text('done')
+
+        StubBotApiHandler.updates = [build_message(update_id, '/slow', chat_id=update_id) for update_id in range(1, 6)]
+        runtime, thread = self.start_runtime([('slow', slow, True)], max_concurrency=2)
+        while not peak:
+            time.sleep(0.01)
+        runtime.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertLessEqual(max(peak), 2)
+        # everything already dispatched when stop() was called still got its reply
+        self.assertEqual(len(peak), len(StubBotApiHandler.calls))
+        self.assertEqual(len(peak), runtime.handled)
+
+    def test_retry_after_pauses_chat(self):
+        def echo(bot, update):
+            update.message.reply_text('echo', quote=False)
+
+        StubBotApiHandler.errors = {'sendMessage': [{'ok': False, 'error_code': 429, 'description': 'Too Many Requests',
+                                                     'parameters': {'retry_after': 0.3}}]}
+        StubBotApiHandler.updates = [build_message(1, '/p btc')]
+        throttle = SendThrottle()
+        runtime, thread = self.start_runtime([('p', echo, False)], throttle=throttle)
+        start = time.monotonic()
+        calls = self.wait_for_calls(1)
+        elapsed = time.monotonic() - start
+        runtime.stop()
+        thread.join(5)
+        self.assertEqual([('sendMessage', {'chat_id': 10, 'text': 'echo'})], calls)
+        self.assertGreaterEqual(elapsed, 0.3)
+        self.assertEqual(1, throttle.stats()['delayed'])
+
+    def test_failed_send_resolves_every_reply(self):
+        sent = []
+
+        def echo_twice(bot, update):
+            sent.extend([update.message.reply_text('first'), update.message.reply_text('second')])
+
+        StubBotApiHandler.errors = {'sendMessage': [{'ok': False, 'error_code': 400, 'description': 'Bad Request'}]}
+        StubBotApiHandler.updates = [build_message(1, '/p btc')]
+        runtime, thread = self.start_runtime([('p', echo_twice, False)])
+        deadline = time.monotonic() + 5
+        while runtime.failed == 0 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        runtime.stop()
+        thread.join(5)
+        self.assertIsNotNone(sent[0].exception(0))
+        # the second reply was never tried
+        self.assertTrue(sent[1].cancelled())
+        self.assertEqual([], StubBotApiHandler.calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
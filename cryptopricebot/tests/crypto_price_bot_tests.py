@@ -1,5 +1,18 @@
+import logging
+import os
+import tempfile
+import time
 import unittest
+from coingeckoapi import coingecko_api
+from coingeckoapi.refresh_scheduler import RefreshScheduler
+from cryptodata import alert_repo
+from cryptodata.tests.price_req_repo_tests import build_session_maker
 from cryptopricebot import crypto_price_bot
+from cryptopricebot.async_runtime import _Update
+from cryptopricebot.tests.async_runtime_tests import build_message
+from cryptoshared import market_row, snapshot_file
+from cryptoshared.ticker_result import TickerResult
+from cryptoshared.ticker_snapshot import TickerSnapshot
 
 
 class MockHelper(object):
@@ -24,6 +37,49 @@ class ValidateArgTests(unittest.TestCase):
             crypto_price_bot._validate_cmd_args(cmd_args)
         self.assertTrue('loglvl' in str(context.exception))
 
+    def test_admin_ids(self):
+        self.assertEqual(set(), crypto_price_bot._parse_admin_ids(''))
+        self.assertEqual({12, 345}, crypto_price_bot._parse_admin_ids('12, 345'))
+        cmd_args = MockHelper(botkey='valid-string-for-bot-key', loglvl='info', admins='12,abc')
+        with self.assertRaises(crypto_price_bot.InvalidArgument) as context:
+            crypto_price_bot._validate_cmd_args(cmd_args)
+        self.assertTrue('admins' in str(context.exception))
+
+    def test_webhook_args(self):
+        cmd_args = MockHelper(botkey='valid-string-for-bot-key', loglvl='info', admins='', mode='webhook',
+                              webhookurl='https://example.com/telegram', webhooksecret='not a valid secret',
+                              cgbudget=30, snapshotfile=None, snapshotsocket=None, alertowner=False)
+        with self.assertRaises(crypto_price_bot.InvalidArgument) as context:
+            crypto_price_bot._validate_cmd_args(cmd_args)
+        self.assertTrue('webhooksecret' in str(context.exception))
+        cmd_args.webhooksecret = 'valid_Secret-123'
+        crypto_price_bot._validate_cmd_args(cmd_args)
+        cmd_args.webhookurl = None
+        with self.assertRaises(crypto_price_bot.InvalidArgument) as context:
+            crypto_price_bot._validate_cmd_args(cmd_args)
+        self.assertTrue('webhookurl' in str(context.exception))
+
+    def test_snapshot_args(self):
+        cmd_args = MockHelper(botkey='valid-string-for-bot-key', loglvl='info', admins='', cgbudget=30,
+                              mode='polling', snapshotfile=None, snapshotsocket='snapshot.sock', alertowner=True)
+        with self.assertRaises(crypto_price_bot.InvalidArgument) as context:
+            crypto_price_bot._validate_cmd_args(cmd_args)
+        self.assertTrue('snapshotfile' in str(context.exception))
+        cmd_args.snapshotfile = 'snapshot.bin'
+        crypto_price_bot._validate_cmd_args(cmd_args)
+        cmd_args.snapshotsocket = None
+        with self.assertRaises(crypto_price_bot.InvalidArgument) as context:
+            crypto_price_bot._validate_cmd_args(cmd_args)
+        self.assertTrue('alertowner' in str(context.exception))
+        cmd_args.alertowner = False
+        crypto_price_bot._validate_cmd_args(cmd_args)
+
+    def test_coingecko_budget(self):
+        cmd_args = MockHelper(botkey='valid-string-for-bot-key', loglvl='info', admins='', cgbudget=5)
+        with self.assertRaises(crypto_price_bot.InvalidArgument) as context:
+            crypto_price_bot._validate_cmd_args(cmd_args)
+        self.assertTrue('cgbudget' in str(context.exception))
+
 
 class StripBotUserNameTests(unittest.TestCase):
     def test_strip_bot_name(self):
@@ -46,5 +102,289 @@ class StripBotUserNameTests(unittest.TestCase):
         self.assertEqual('btc', result)
 
 
+class ParseLeaderboardArgsTests(unittest.TestCase):
+    def test_defaults(self):
+        self.assertEqual(('24h', 10, 200), crypto_price_bot._parse_leaderboard_args(''))
+
+    def test_window_count_universe(self):
+        self.assertEqual(('7d', 20, 200), crypto_price_bot._parse_leaderboard_args('7d 20'))
+        self.assertEqual(('1h', 5, 500), crypto_price_bot._parse_leaderboard_args('1h 5 500'))
+        self.assertEqual(('24h', 3, 200), crypto_price_bot._parse_leaderboard_args('3'))
+
+    def test_invalid_args(self):
+        for request_text in ['2w', '7d 0', '7d 26', '7d 10 300', '7d ten', '7d 1 100 5']:
+            with self.assertRaises(crypto_price_bot.InvalidArgument):
+                crypto_price_bot._parse_leaderboard_args(request_text)
+
+
+class ParseDurationTests(unittest.TestCase):
+    def test_valid_durations(self):
+        self.assertEqual(90, crypto_price_bot._parse_duration('90s'))
+        self.assertEqual(300, crypto_price_bot._parse_duration('5m'))
+        self.assertEqual(7200, crypto_price_bot._parse_duration('2h'))
+
+    def test_invalid_durations(self):
+        for duration_text in ['', '5', 'm', '0m', '5d', '-5m', '5 m']:
+            with self.assertRaises(crypto_price_bot.InvalidArgument):
+                crypto_price_bot._parse_duration(duration_text)
+
+
+class ParseAlertArgsTests(unittest.TestCase):
+    def test_price_alerts(self):
+        self.assertEqual(('BTC', 'price', '>', 70000), crypto_price_bot._parse_alert_args('btc > 70000'))
+        self.assertEqual(('DOGE', 'price', '<', 0.05), crypto_price_bot._parse_alert_args('doge<$0.05'))
+
+    def test_change_alerts(self):
+        self.assertEqual(('ETH', '1h', '<', -5), crypto_price_bot._parse_alert_args('eth -5% 1h'))
+        self.assertEqual(('ETH', '24h', '>', 7.5), crypto_price_bot._parse_alert_args('eth +7.5% 24h'))
+
+    def test_invalid_alerts(self):
+        for request_text in ['', 'btc', 'btc > ', 'btc = 5', 'eth -5%', 'eth -5% 2w', 'btc > 5 6']:
+            with self.assertRaises(crypto_price_bot.InvalidArgument):
+                crypto_price_bot._parse_alert_args(request_text)
+
+
+class BatchRequestTests(unittest.TestCase):
+    def test_requested_tickers(self):
+        self.assertEqual(['BTC', 'ETH', 'SOL'], crypto_price_bot._get_requested_tickers('btc eth btc sol'))
+
+    def test_history_request(self):
+        self.assertTrue(crypto_price_bot._is_history_request('btc 15m'))
+        self.assertFalse(crypto_price_bot._is_history_request('btc eth'))
+        self.assertFalse(crypto_price_bot._is_history_request('btc 15m eth'))
+
+    def test_only_price_batches_need_the_base_pairs(self):
+        tickers = build_tickers(10000)
+        del tickers['BTC']
+        snapshot = TickerSnapshot.from_tickers(tickers)
+        self.assertIn('API connection issues', crypto_price_bot._render_price(snapshot, 'eth xyz'))
+        self.assertEqual('ETH: Not Available\nXYZ: Invalid Ticker Symbol',
+                         crypto_price_bot._render_market_cap(snapshot, 'eth xyz'))
+        self.assertIn('ETH: 01H N/A', crypto_price_bot._render_change(snapshot, 'eth xyz'))
+
+
+class QuoteCurrencyTests(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = TickerSnapshot.from_tickers(build_tickers(10000), rates={'USD': 1.0, 'EUR': 0.5})
+        self.saved = dict(crypto_price_bot.chat_currencies)
+        self.addCleanup(lambda: (crypto_price_bot.chat_currencies.clear(),
+                                 crypto_price_bot.chat_currencies.update(self.saved)))
+
+    def test_split_quote(self):
+        self.assertEqual(('btc', 'EUR'), crypto_price_bot._split_quote(self.snapshot, 'btc eur'))
+        self.assertEqual(('btc eth', 'USD'), crypto_price_bot._split_quote(self.snapshot, 'btc eth usd'))
+        self.assertEqual(('btc eth', None), crypto_price_bot._split_quote(self.snapshot, 'btc eth'))
+        self.assertEqual(('eur', None), crypto_price_bot._split_quote(self.snapshot, 'eur'))
+
+    def test_price_in_quote_currency(self):
+        reply = crypto_price_bot._render_price(self.snapshot, 'btc eur')
+        self.assertIn('Btc (BTC):  5000.00000000 EUR', reply)
+        self.assertIn('ETH: 250.00000000 EUR', crypto_price_bot._render_price(self.snapshot, 'btc eth eur'))
+        self.assertIn('$10000', crypto_price_bot._render_price(self.snapshot, 'btc usd'))
+
+    def test_chat_default(self):
+        crypto_price_bot.chat_currencies[10] = 'EUR'
+        self.assertEqual('btc eur', crypto_price_bot._apply_chat_currency(10, self.snapshot, 'btc'))
+        self.assertEqual('btc usd', crypto_price_bot._apply_chat_currency(10, self.snapshot, 'btc usd'))
+        self.assertEqual('btc', crypto_price_bot._apply_chat_currency(20, self.snapshot, 'btc'))
+        # without an exchange rate table the chat gets USD prices
+        self.assertEqual('btc', crypto_price_bot._apply_chat_currency(10, TickerSnapshot.from_tickers(
+            build_tickers(10000)), 'btc'))
+
+
+class ReplyCarryOverTests(unittest.TestCase):
+    def setUp(self):
+        rows = [market_row.MarketRow('CoinGecko', symbol.lower(), symbol.title(), symbol, price, None, None, None,
+                                     1.0, None, None, None)
+                for symbol, price in (('BTC', 10000), ('ETH', 500), ('LTC', 50), ('DOGE', 0.1))]
+        self.previous = TickerSnapshot.from_rows(rows)
+        rows[3] = rows[3]._replace(usd_price=0.2)
+        self.snapshot = TickerSnapshot.from_rows(rows, previous=self.previous)
+
+    def is_current(self, command, request_text):
+        return crypto_price_bot._is_reply_current(self.previous, self.snapshot, command, request_text)
+
+    def test_replies_about_unchanged_coins_are_kept(self):
+        self.assertTrue(self.is_current('/p', 'ltc'))
+        self.assertTrue(self.is_current('/cap', 'ltc eth'))
+        self.assertTrue(self.is_current('/compare', 'ltc/eth'))
+
+    def test_replies_about_changed_coins_are_dropped(self):
+        self.assertFalse(self.is_current('/p', 'doge'))
+        self.assertFalse(self.is_current('/cap', 'ltc doge'))
+        self.assertFalse(self.is_current('/compare', 'ltc/doge'))
+        self.assertFalse(self.is_current('/p', 'xyz'))
+        self.assertFalse(self.is_current('/change', 'ltc 5m'))
+        # DOGE is among the top coins the leaderboards are built from
+        self.assertFalse(self.is_current('/top', ''))
+
+
+
+def build_tickers(btc_price):
+    tickers = {}
+    for symbol, usd_price in (('BTC', btc_price), ('ETH', 500)):
+        ticker = TickerResult()
+        ticker.ticker_symbol = symbol
+        ticker.currency_name = symbol.title()
+        ticker.usd_price = usd_price
+        tickers[symbol] = ticker
+    return tickers
+
+
+class WarmStartTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'snapshot.bin')
+        self.saved = {name: getattr(crypto_price_bot, name)
+                      for name in ('logger', 'snapshot_path', 'restored_snapshot', 'ticker_snapshot')}
+        crypto_price_bot.logger = logging.getLogger('crypto-price-bot-tests')
+        crypto_price_bot.snapshot_path = self.path
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(crypto_price_bot, name, value)
+        self.directory.cleanup()
+
+    def request_price(self):
+        update = _Update(build_message(1, '/p btc'))
+        crypto_price_bot._get_price(None, update)
+        return update.message.replies[0][0]
+
+    def test_restored_snapshot_is_marked_until_refresh(self):
+        snapshot_file.write_snapshot(self.path, TickerSnapshot.from_tickers(build_tickers(10000), version=41,
+                                                                            fetched_at=time.time() - 120))
+        crypto_price_bot._restore_snapshot()
+        reply = self.request_price()
+        self.assertIn('$10000', reply)
+        self.assertIn('(Prices from 2m ago, refreshing...)', reply)
+
+        crypto_price_bot._publish_markets([market_row.from_ticker(ticker)
+                                           for ticker in build_tickers(20000).values()], [])
+        reply = self.request_price()
+        self.assertIn('$20000', reply)
+        self.assertNotIn('refreshing...', reply)
+        # the refresh was saved for the next restart
+        self.assertEqual(42, snapshot_file.read_version(self.path))
+
+    def test_stale_snapshots(self):
+        crypto_price_bot.ticker_snapshot = TickerSnapshot.from_tickers(build_tickers(10000), version=50,
+                                                                       fetched_at=time.time() - 10)
+        self.assertNotIn('refreshing...', self.request_price())
+        # coingecko has not answered for a few minutes
+        crypto_price_bot.ticker_snapshot = TickerSnapshot.from_tickers(build_tickers(10000), version=51,
+                                                                       fetched_at=time.time() - 300)
+        self.assertIn('(Prices from 5m ago, refreshing...)', self.request_price())
+        crypto_price_bot.ticker_snapshot = TickerSnapshot.from_tickers(build_tickers(10000), version=52,
+                                                                       fetched_at=time.time() - 7200)
+        self.assertIn('API connection issues', self.request_price())
+
+    def test_damaged_snapshot_is_ignored(self):
+        snapshot_file.write_snapshot(self.path, TickerSnapshot.from_tickers(build_tickers(10000), version=41))
+        with open(self.path, 'r+b') as f:
+            f.seek(-4, os.SEEK_END)
+            f.write(b'\xff\xff\xff\xff')
+        crypto_price_bot.ticker_snapshot = crypto_price_bot.EMPTY_SNAPSHOT
+        crypto_price_bot._restore_snapshot()
+        self.assertIsNone(crypto_price_bot.restored_snapshot)
+        self.assertIs(crypto_price_bot.EMPTY_SNAPSHOT, crypto_price_bot.ticker_snapshot)
+
+
+class CoalescedReplyTests(unittest.TestCase):
+    def setUp(self):
+        self.saved = {name: getattr(crypto_price_bot, name)
+                      for name in ('logger', 'ticker_snapshot', 'request_coalescer', 'reply_cache')}
+        crypto_price_bot.logger = logging.getLogger('crypto-price-bot-tests')
+        crypto_price_bot.ticker_snapshot = TickerSnapshot.from_tickers(build_tickers(10000), version=60,
+                                                                       fetched_at=time.time())
+        crypto_price_bot.request_coalescer = crypto_price_bot.RequestCoalescer()
+        crypto_price_bot.reply_cache = crypto_price_bot.ReplyCache()
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(crypto_price_bot, name, value)
+
+    def request_price(self, render=None):
+        update = _Update(build_message(1, '/p btc'))
+        crypto_price_bot._handle_command(update, '/p', render or crypto_price_bot._render_price)
+        return update.message.replies
+
+    def test_repeat_is_answered_when_the_reply_was_not_sent(self):
+        # the send throttle dropped the first reply
+        self.request_price()[0][2].set_result(None)
+        replies = self.request_price()
+        self.assertEqual(1, len(replies))
+        # the second one went out, so the next repeat is merged
+        replies[0][2].set_result({'message_id': 2})
+        self.assertEqual([], self.request_price())
+
+    def test_repeat_is_answered_when_the_reply_was_never_tried(self):
+        # an earlier reply of the update failed, or the runtime shut down first
+        self.request_price()[0][2].cancel()
+        self.assertEqual(1, len(self.request_price()))
+
+    def test_repeat_is_answered_after_a_failed_render(self):
+        def fail(snapshot, request_text):
+            raise ValueError('render failed')
+
+        self.assertIn('Oops!', self.request_price(fail)[0][0])
+        self.assertIn('$10000', self.request_price()[0][0])
+
+
+class AlertOwnerTests(unittest.TestCase):
+    def setUp(self):
+        names = ('logger', 'ticker_snapshot', 'session_maker', 'alert_index', 'alert_owner', '_notify_alerts')
+        self.saved = {name: getattr(crypto_price_bot, name) for name in names}
+        self.addCleanup(lambda: [setattr(crypto_price_bot, name, value) for name, value in self.saved.items()])
+        crypto_price_bot.logger = logging.getLogger('crypto-price-bot-tests')
+        crypto_price_bot.session_maker = build_session_maker(self)
+        crypto_price_bot.alert_index = crypto_price_bot.price_alerts.AlertIndex()
+        crypto_price_bot.ticker_snapshot = TickerSnapshot.from_tickers(build_tickers(10000), version=70)
+        self.notified = []
+        crypto_price_bot._notify_alerts = lambda snapshot, fired, rearmed: self.notified.extend(fired)
+
+    def publish(self, btc_price, version):
+        crypto_price_bot._publish_snapshot(TickerSnapshot.from_tickers(build_tickers(btc_price), version=version,
+                                                                       previous=crypto_price_bot.ticker_snapshot))
+        time.sleep(0.05)
+
+    def test_alerts_set_on_other_workers_are_synced(self):
+        kept_id = alert_repo.add_alert(crypto_price_bot.session_maker, 1, 10, 'BTC', 'price', '>', 15000)
+        deleted_id = alert_repo.add_alert(crypto_price_bot.session_maker, 1, 10, 'ETH', 'price', '<', 100)
+        crypto_price_bot._sync_alerts()
+        self.assertEqual({kept_id, deleted_id}, crypto_price_bot.alert_index.alert_ids())
+        alert_repo.delete_alert(crypto_price_bot.session_maker, deleted_id)
+        crypto_price_bot._sync_alerts()
+        self.assertEqual({kept_id}, crypto_price_bot.alert_index.alert_ids())
+        # the synced alert started from the current price, so crossing the threshold fires it on the owner
+        self.publish(20000, 71)
+        self.assertEqual([kept_id], [alert.alert_id for alert, _ in self.notified])
+
+    def test_only_the_owner_evaluates(self):
+        crypto_price_bot.alert_index.add(crypto_price_bot.price_alerts.PriceAlert(1, 1, 10, 'BTC', 'price', '>',
+                                                                                  15000), 10000)
+        crypto_price_bot.alert_owner = False
+        self.publish(20000, 71)
+        self.assertEqual([], self.notified)
+        self.assertTrue(crypto_price_bot.alert_index.get_chat_alerts(10)[0].armed)
+
+
+class ScheduleRefreshTests(unittest.TestCase):
+    def setUp(self):
+        saved = {name: getattr(crypto_price_bot, name) for name in ('refresh_scheduler', 'logger')}
+        self.addCleanup(lambda: [setattr(crypto_price_bot, name, value) for name, value in saved.items()])
+        crypto_price_bot.logger = logging.getLogger('crypto-price-bot-tests')
+        crypto_price_bot.refresh_scheduler = RefreshScheduler(failure_threshold=2, jitter=0)
+
+    def test_skipped_refresh_is_not_a_failure(self):
+        skipped = coingecko_api.RefreshReport()
+        skipped.skipped = True
+        for _ in range(3):
+            crypto_price_bot._schedule_refresh(skipped, False)
+        stats = crypto_price_bot.refresh_scheduler.stats()
+        self.assertEqual((0, 0, 'closed'), (stats['refreshes'], stats['failures'], stats['state']))
+        crypto_price_bot._schedule_refresh(coingecko_api.RefreshReport(), False)
+        self.assertEqual(1, crypto_price_bot.refresh_scheduler.stats()['failures'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from cryptopricebot.reply_cache import ReplyCache
+
+
+class MockSnapshot(object):
+    def __init__(self, version):
+        self.version = version
+
+
+class ReplyCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.render_calls = []
+
+    def render(self, snapshot, args):
+        self.render_calls.append((snapshot.version, args))
+        return '{}:{}'.format(args, snapshot.version)
+
+    def test_hit_after_miss(self):
+        cache = ReplyCache()
+        snapshot = MockSnapshot(1)
+        cache.publish(snapshot)
+        self.assertEqual('btc:1', cache.get_or_render('/p', 'btc', snapshot, self.render))
+        self.assertEqual('btc:1', cache.get_or_render('/p', 'btc', snapshot, self.render))
+        self.assertEqual([(1, 'btc')], self.render_calls)
+        self.assertEqual(1, cache.stats()['hits'])
+        self.assertEqual(1, cache.stats()['misses'])
+
+    def test_publish_invalidates(self):
+        cache = ReplyCache()
+        old_snapshot, new_snapshot = MockSnapshot(1), MockSnapshot(2)
+        cache.publish(old_snapshot)
+        cache.get_or_render('/p', 'btc', old_snapshot, self.render)
+        cache.publish(new_snapshot)
+        self.assertEqual(0, cache.stats()['size'])
+        self.assertEqual('btc:2', cache.get_or_render('/p', 'btc', new_snapshot, self.render))
+        # a late handler still holding the old snapshot does not repopulate the cache
+        cache.get_or_render('/p', 'eth', old_snapshot, self.render)
+        self.assertEqual(1, cache.stats()['size'])
+
+    def test_lru_eviction(self):
+        cache = ReplyCache(max_size=2)
+        snapshot = MockSnapshot(1)
+        cache.publish(snapshot)
+        cache.get_or_render('/p', 'btc', snapshot, self.render)
+        cache.get_or_render('/p', 'eth', snapshot, self.render)
+        cache.get_or_render('/p', 'btc', snapshot, self.render)
+        cache.get_or_render('/p', 'ltc', snapshot, self.render)
+        self.render_calls = []
+        cache.get_or_render('/p', 'btc', snapshot, self.render)
+        cache.get_or_render('/p', 'eth', snapshot, self.render)
+        self.assertEqual([(1, 'eth')], self.render_calls)
+
+    def test_carry_over_unchanged_replies(self):
+        cache = ReplyCache()
+        snapshot = MockSnapshot(1)
+        cache.publish(snapshot)
+        for args in ['btc', 'eth']:
+            cache.get_or_render('/p', args, snapshot, self.render)
+        self.render_calls = []
+        new_snapshot = MockSnapshot(2)
+        cache.publish(new_snapshot, keep=lambda command, args: args == 'eth')
+        self.assertEqual(1, cache.stats()['carried'])
+        self.assertEqual('eth:1', cache.get_or_render('/p', 'eth', new_snapshot, self.render))
+        self.assertEqual('btc:2', cache.get_or_render('/p', 'btc', new_snapshot, self.render))
+        self.assertEqual([(2, 'btc')], self.render_calls)
+
+    def test_prerender_popular_requests(self):
+        cache = ReplyCache(prerender_count=1)
+        snapshot = MockSnapshot(1)
+        cache.publish(snapshot)
+        for args in ['btc', 'btc', 'eth']:
+            cache.get_or_render('/p', args, snapshot, self.render)
+        self.render_calls = []
+        new_snapshot = MockSnapshot(2)
+        cache.publish(new_snapshot, {'/p': self.render})
+        self.assertEqual([(2, 'btc')], self.render_calls)
+        cache.get_or_render('/p', 'btc', new_snapshot, self.render)
+        self.assertEqual(1, len(self.render_calls))
+        self.assertEqual(1, cache.stats()['prerendered'])
+
+
+if __name__ == '__main__':
+    unittest.main()
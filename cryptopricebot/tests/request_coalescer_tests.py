@@ -0,0 +1,45 @@
+import unittest
+from cryptopricebot.request_coalescer import RequestCoalescer
+from cryptopricebot.tests.send_throttle_tests import FakeClock
+
+
+class RequestCoalescerTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.coalescer = RequestCoalescer(window=3, clock=self.clock)
+
+    def test_repeats_are_merged_within_window(self):
+        self.assertTrue(self.coalescer.claim(1, '/p', 'btc', 7))
+        self.clock.now += 2
+        self.assertFalse(self.coalescer.claim(1, '/p', 'btc', 7))
+        self.clock.now += 1
+        self.assertTrue(self.coalescer.claim(1, '/p', 'btc', 7))
+        self.assertEqual(1, self.coalescer.stats()['merged'])
+
+    def test_different_requests_are_not_merged(self):
+        self.assertTrue(self.coalescer.claim(1, '/p', 'btc', 7))
+        self.assertTrue(self.coalescer.claim(2, '/p', 'btc', 7))
+        self.assertTrue(self.coalescer.claim(1, '/cap', 'btc', 7))
+        self.assertTrue(self.coalescer.claim(1, '/p', 'eth', 7))
+        # a new snapshot has a new reply
+        self.assertTrue(self.coalescer.claim(1, '/p', 'btc', 8))
+        self.assertEqual(0, self.coalescer.stats()['merged'])
+
+    def test_released_claims_are_answered_again(self):
+        self.assertTrue(self.coalescer.claim(1, '/p', 'btc', 7))
+        self.coalescer.release(1, '/p', 'btc', 7)
+        self.assertTrue(self.coalescer.claim(1, '/p', 'btc', 7))
+        self.assertFalse(self.coalescer.claim(1, '/p', 'btc', 7))
+        # releasing an unknown claim does nothing
+        self.coalescer.release(2, '/p', 'btc', 7)
+
+    def test_expired_keys_are_pruned(self):
+        for chat_id in range(5):
+            self.coalescer.claim(chat_id, '/p', 'btc', 1)
+        self.clock.now += 3
+        self.coalescer.claim(9, '/p', 'btc', 1)
+        self.assertEqual(1, self.coalescer.stats()['pending'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import threading
+import time
+import unittest
+from cryptopricebot.send_throttle import SendThrottle, TokenBucket, DelayedSender
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTests(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=2, burst=2, now=0)
+        self.assertEqual([0, 0, 0.5, 1.0], [bucket.reserve(0) for _ in range(4)])
+        self.assertEqual(0.5, bucket.reserve(1.0))
+
+    def test_pause(self):
+        bucket = TokenBucket(rate=1, burst=3, now=0)
+        bucket.pause(5, 0)
+        self.assertEqual(6, bucket.reserve(0))
+
+
+class SendThrottleTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_per_chat_limits(self):
+        throttle = SendThrottle(chat_rate=1, chat_burst=2, group_rate=0.5, group_burst=1, clock=self.clock)
+        self.assertEqual([0, 0, 1.0], [throttle.reserve(1) for _ in range(3)])
+        self.assertEqual([0, 2.0], [throttle.reserve(-1) for _ in range(2)])
+        # other chats are not held back by a busy one
+        self.assertEqual(0, throttle.reserve(2))
+        self.assertEqual(2, throttle.stats()['delayed'])
+
+    def test_global_limit(self):
+        throttle = SendThrottle(global_rate=10, global_burst=2, clock=self.clock)
+        self.assertEqual([0, 0, 0.1, 0.2], [throttle.reserve(chat_id) for chat_id in range(1, 5)])
+
+    def test_drop_when_delay_too_long(self):
+        throttle = SendThrottle(chat_rate=1, chat_burst=1, max_delay=1.5, clock=self.clock)
+        self.assertEqual([0, 1.0, None], [throttle.reserve(1) for _ in range(3)])
+        self.clock.now += 2
+        # the dropped message did not use up a token
+        self.assertEqual(0, throttle.reserve(1))
+        self.assertEqual({'sent': 3, 'delayed': 1, 'dropped': 1, 'total_delay': 1.0, 'chats': 1}, throttle.stats())
+
+    def test_pause_chat(self):
+        throttle = SendThrottle(max_delay=60, clock=self.clock)
+        throttle.pause(1, 30)
+        self.assertEqual(31, throttle.reserve(1))
+        self.assertEqual(0, throttle.reserve(2))
+
+    def test_max_chats(self):
+        throttle = SendThrottle(chat_burst=1, max_chats=2, clock=self.clock)
+        for chat_id in [1, 2, 3]:
+            throttle.reserve(chat_id)
+        self.assertEqual(2, throttle.stats()['chats'])
+        # chat 1 was evicted and starts with a full bucket again
+        self.assertEqual(0, throttle.reserve(1))
+
+
+class DelayedSenderTests(unittest.TestCase):
+    def test_sends_in_due_order_without_blocking(self):
+        sender = DelayedSender(send_workers=1)
+        self.addCleanup(sender.close)
+        sent = []
+        lock = threading.Lock()
+
+        def send(text):
+            with lock:
+                sent.append(text)
+            if text == 'fail':
+                raise ValueError(text)
+            return text
+
+        start = time.monotonic()
+        late = sender.submit(0.3, send, 'late')
+        early = sender.submit(0.1, send, 'early')
+        failing = sender.submit(0.2, send, 'fail')
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual('late', late.result(5))
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+        self.assertEqual('early', early.result(0))
+        self.assertIsInstance(failing.exception(0), ValueError)
+        self.assertEqual(['early', 'fail', 'late'], sent)
+
+    def test_close_sends_what_is_pending(self):
+        sender = DelayedSender()
+        future = sender.submit(60, lambda: 'sent')
+        sender.close()
+        self.assertEqual('sent', future.result(0))
+        self.assertRaises(RuntimeError, sender.submit, 0, lambda: None)
+
+
+if __name__ == '__main__':
+    unittest.main()
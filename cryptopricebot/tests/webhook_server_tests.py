@@ -0,0 +1,116 @@
+import json
+import socket
+import threading
+import time
+import unittest
+from http.server import ThreadingHTTPServer
+
+import requests
+
+from cryptopricebot import post_updates, webhook_server
+from cryptopricebot.async_runtime import AsyncBotRuntime
+from cryptopricebot.tests.async_runtime_tests import StubBotApiHandler, build_message, BOT_KEY
+from cryptopricebot.webhook_server import WebhookServer, SECRET_TOKEN_HEADER
+
+SECRET = 'test_secret-1'
+
+
+class WebhookServerTests(unittest.TestCase):
+    def setUp(self):
+        StubBotApiHandler.updates = []
+        StubBotApiHandler.calls = []
+        StubBotApiHandler.errors = {}
+        self.api_server = ThreadingHTTPServer(('127.0.0.1', 0), StubBotApiHandler)
+        self.api_server.daemon_threads = True
+        self.api_server.block_on_close = False
+        threading.Thread(target=self.api_server.serve_forever, daemon=True).start()
+        self.api_url = 'http://127.0.0.1:{}'.format(self.api_server.server_address[1])
+        self.enqueue_timeout = webhook_server.ENQUEUE_TIMEOUT
+        self.request_timeout = webhook_server.REQUEST_TIMEOUT
+
+    def tearDown(self):
+        webhook_server.ENQUEUE_TIMEOUT = self.enqueue_timeout
+        webhook_server.REQUEST_TIMEOUT = self.request_timeout
+        self.api_server.shutdown()
+        self.api_server.server_close()
+
+    def start_runtime(self, commands, max_concurrency=10, **kwargs):
+        webhook = WebhookServer('https://example.com/telegram', SECRET, host='127.0.0.1', port=0, **kwargs)
+        runtime = AsyncBotRuntime(BOT_KEY, commands, max_concurrency=max_concurrency, api_base_url=self.api_url)
+        thread = threading.Thread(target=runtime.run, kwargs={'ingress': webhook.serve}, daemon=True)
+        thread.start()
+        while webhook._server is None:
+            time.sleep(0.01)
+        return runtime, thread, 'http://127.0.0.1:{}/telegram'.format(webhook.port), webhook
+
+    def post(self, url, update, secret=SECRET):
+        return requests.post(url, json=update, headers={SECRET_TOKEN_HEADER: secret}, timeout=5).status_code
+
+    def test_accepts_only_signed_updates(self):
+        def echo(bot, update):
+            update.message.reply_text('echo ' + update.message.text, quote=False)
+
+        runtime, thread, url, webhook = self.start_runtime([('p', echo, False)])
+        self.assertEqual(403, self.post(url, build_message(1, '/p btc'), secret='wrong'))
+        self.assertEqual(404, self.post(url + '/other', build_message(2, '/p btc')))
+        self.assertEqual(405, requests.get(url, timeout=5).status_code)
+        self.assertEqual(400, requests.post(url, data='not json', headers={SECRET_TOKEN_HEADER: SECRET},
+                                            timeout=5).status_code)
+        self.assertEqual(200, self.post(url, build_message(3, '/p btc')))
+        runtime.stop()
+        thread.join(5)
+        self.assertEqual([('setWebhook', {'url': 'https://example.com/telegram', 'secret_token': SECRET,
+                                          'max_connections': webhook_server.MAX_CONNECTIONS,
+                                          'allowed_updates': ['message', 'inline_query']}),
+                          ('sendMessage', {'chat_id': 10, 'text': 'echo /p btc'})], StubBotApiHandler.calls)
+        self.assertEqual({'received': 1, 'refused': 0, 'rejected': 2, 'queued': 0}, webhook.stats())
+
+    def test_full_queue_refuses_updates_and_drains_on_stop(self):
+        webhook_server.ENQUEUE_TIMEOUT = 0.1
+        release = threading.Event()
+
+        def wait(bot, update):
+            release.wait(5)
+            update.message.reply_text('done', quote=False)
+
+        runtime, thread, url, webhook = self.start_runtime([('wait', wait, True)], max_concurrency=1,
+                                                           max_queue_size=1)
+        statuses = []
+        for update_id in range(1, 5):
+            statuses.append(self.post(url, build_message(update_id, '/wait')))
+            time.sleep(0.05)
+        # one update in its handler, one waiting for a handler slot, one queued, the last one refused
+        self.assertEqual([200, 200, 200, 503], statuses)
+        runtime.stop()
+        release.set()
+        thread.join(5)
+        self.assertEqual(3, runtime.handled)
+        self.assertEqual(3, len([call for call in StubBotApiHandler.calls if call[0] == 'sendMessage']))
+
+    def test_slow_and_oversized_requests_are_cut_off(self):
+        webhook_server.REQUEST_TIMEOUT = 0.2
+        runtime, thread, url, webhook = self.start_runtime([])
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(runtime.stop)
+        address = ('127.0.0.1', webhook.port)
+        # headers that never end: the connection is closed without an answer once REQUEST_TIMEOUT is up
+        with socket.create_connection(address, timeout=5) as connection:
+            connection.sendall(b'POST /telegram HTTP/1.1\r\nHost: x\r\n')
+            start = time.monotonic()
+            self.assertEqual(b'', connection.recv(1024))
+            self.assertLess(time.monotonic() - start, 2)
+        with socket.create_connection(address, timeout=5) as connection:
+            headers = ''.join('X-{}: 1\r\n'.format(i) for i in range(webhook_server.MAX_HEADERS + 1))
+            connection.sendall('POST /telegram HTTP/1.1\r\n{}\r\n'.format(headers).encode())
+            self.assertTrue(connection.recv(1024).startswith(b'HTTP/1.1 431 '))
+
+
+class PostUpdatesTests(unittest.TestCase):
+    def test_read_updates(self):
+        updates = [build_message(1, '/p btc'), build_message(2, '/p eth')]
+        self.assertEqual(updates, post_updates._read_updates(json.dumps(updates)))
+        self.assertEqual(updates, post_updates._read_updates('\n'.join(json.dumps(update) for update in updates)))
+
+
+if __name__ == '__main__':
+    unittest.main()
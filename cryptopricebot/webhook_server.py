@@ -0,0 +1,154 @@
+import asyncio
+import hmac
+import json
+from urllib.parse import urlparse
+
+# updates accepted from telegram but not dispatched yet. when it is full new updates wait up to ENQUEUE_TIMEOUT
+# seconds for room and are then refused with a 503, which makes telegram deliver them again later
+MAX_QUEUE_SIZE = 1000
+ENQUEUE_TIMEOUT = 1.0
+# seconds an idle keep-alive connection is kept open
+IDLE_TIMEOUT = 60
+# seconds the headers and body of a request get to arrive once its request line did, so a client trickling bytes
+# cannot hold a connection forever
+REQUEST_TIMEOUT = 10
+MAX_HEADERS = 100
+MAX_BODY_SIZE = 1024 * 1024
+# most connections telegram opens to the webhook at once
+MAX_CONNECTIONS = 40
+SECRET_TOKEN_HEADER = 'x-telegram-bot-api-secret-token'
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+            413: 'Payload Too Large', 431: 'Request Header Fields Too Large', 503: 'Service Unavailable'}
+
+
+class _RequestError(Exception):
+    # a request that is answered with status and then the connection is closed
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class WebhookServer:
+    # Receives the updates telegram pushes to the bot, as an ingress for async_runtime.AsyncBotRuntime in place of
+    # long polling. A minimal HTTP/1.1 server on host:port accepts POSTs to the path of url that carry the secret
+    # token, acknowledges them as soon as they are queued and leaves the work to the runtime: a single task moves
+    # queued updates to AsyncBotRuntime.dispatch(), which waits while every handler slot is busy. When the queue
+    # fills up, updates are refused and telegram retries them, so a burst never piles up in memory.
+    # url is the public address telegram posts to. Behind a reverse proxy it is the proxy's address, and the proxy
+    # forwards that path to host:port. With url=None the webhook is not registered with telegram.
+    def __init__(self, url, secret_token, host='0.0.0.0', port=8443, path=None, max_queue_size=MAX_QUEUE_SIZE,
+                 max_connections=MAX_CONNECTIONS, logger=None):
+        self.url = url
+        self.secret_token = secret_token
+        self.host = host
+        self.port = port
+        self.path = path if path is not None else (urlparse(url).path if url else '') or '/'
+        self.max_queue_size = max_queue_size
+        self.max_connections = max_connections
+        self.logger = logger
+        self.received = 0
+        self.refused = 0
+        self.rejected = 0
+        self._queue = None
+        self._server = None
+
+    async def serve(self, runtime):
+        # runs until cancelled. updates that were already acknowledged are still dispatched on the way out.
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        update = None
+        try:
+            if self.url is not None:
+                await runtime.api.call('setWebhook', url=self.url, secret_token=self.secret_token,
+                                       max_connections=self.max_connections,
+                                       allowed_updates=['message', 'inline_query'])
+            if self.logger is not None:
+                self.logger.info('Listening for webhook updates on {}:{}{}'.format(self.host, self.port, self.path))
+            while True:
+                update = await self._queue.get()
+                await runtime.dispatch(update)
+                update = None
+        finally:
+            self._server.close()
+            # cancelled while waiting for a handler slot for this one
+            if update is not None:
+                await runtime.dispatch(update)
+            while not self._queue.empty():
+                await runtime.dispatch(self._queue.get_nowait())
+
+    def stats(self):
+        return {'received': self.received, 'refused': self.refused, 'rejected': self.rejected,
+                'queued': 0 if self._queue is None else self._queue.qsize()}
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                try:
+                    headers, body = await asyncio.wait_for(_read_request(reader), REQUEST_TIMEOUT)
+                except _RequestError as e:
+                    await _respond(writer, e.status, close=True)
+                    break
+                status = await self._accept(method, urlparse(target).path, headers, body)
+                close = headers.get('connection', '').lower() == 'close'
+                await _respond(writer, status, close)
+                if close:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _accept(self, method, path, headers, body):
+        if path != self.path:
+            return 404
+        if method != 'POST':
+            return 405
+        if not hmac.compare_digest(headers.get(SECRET_TOKEN_HEADER, '').encode(), self.secret_token.encode()):
+            self.rejected += 1
+            return 403
+        try:
+            update = json.loads(body)
+            if not isinstance(update, dict) or 'update_id' not in update:
+                raise ValueError('not an update')
+        except ValueError:
+            self.rejected += 1
+            return 400
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self._queue.put(update), ENQUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.refused += 1
+                return 503
+        self.received += 1
+        return 200
+
+
+async def _read_request(reader):
+    # (headers, body) of the request whose request line was just read
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise _RequestError(431)
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_SIZE:
+        raise _RequestError(413)
+    return headers, await reader.readexactly(length)
+
+
+async def _respond(writer, status, close=False):
+    writer.write('HTTP/1.1 {} {}\r\nContent-Length: 0\r\nConnection: {}\r\n\r\n'
+                 .format(status, _REASONS[status], 'close' if close else 'keep-alive').encode('latin-1'))
+    await writer.drain()
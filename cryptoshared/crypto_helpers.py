@@ -33,16 +33,34 @@ def format_usd_short(value):
     return ' ${:.2f}'.format(value)
 
 
-def format_volume(value):
-    return '${:,.0f}'.format(value)
+def format_price(value, currency='USD'):
+    # format_usd() for USD, e.g. ' 0.12345678 EUR' for other quote currencies
+    if currency == 'USD':
+        return format_usd(value)
+    return ' {:.8f} {}'.format(value, currency)
 
 
-def format_market_cap(value):
-    return '${:,.0f}'.format(value)
+def format_volume(value, currency='USD'):
+    return format_market_cap(value, currency)
+
+
+def format_market_cap(value, currency='USD'):
+    if currency == 'USD':
+        return '${:,.0f}'.format(value)
+    return '{:,.0f} {}'.format(value, currency)
 
 
 def format_percent_change(percent_change):
     if percent_change > 0:
         return '+{:.2f}%'.format(percent_change)
     else:
-        return '{:.2f}%'.format(percent_change)
\ No newline at end of file
+        return '{:.2f}%'.format(percent_change)
+
+
+def format_age(seconds):
+    # '45s', '12m', '3h', '2d'
+    seconds = max(int(seconds), 0)
+    for unit, unit_seconds in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= unit_seconds:
+            return '{}{}'.format(seconds // unit_seconds, unit)
+    return '{}s'.format(seconds)
\ No newline at end of file
@@ -0,0 +1,49 @@
+import numpy as np
+
+from cryptoshared.ticker_store import CHANGE_WINDOWS
+
+# a leaderboard can be requested over the top 100, 200 or 500 tickers in the ranking
+UNIVERSE_SIZES = (100, 200, 500)
+DEFAULT_UNIVERSE = 200
+DEFAULT_COUNT = 10
+# longest leaderboard kept per (window, universe)
+MAX_COUNT = 25
+
+
+class Leaderboards:
+    # Best and worst performers for every change window and universe size, ranked once when a snapshot is built.
+    # Each entry is a (currency_name, ticker_symbol, percent_change) tuple, so handlers only slice a ready list.
+    __slots__ = ('gainers', 'losers')
+
+    def __init__(self, store, universe_sizes=UNIVERSE_SIZES, max_count=MAX_COUNT):
+        self.gainers = {}
+        self.losers = {}
+        for column, window in enumerate(CHANGE_WINDOWS):
+            for universe in universe_sizes:
+                changes = store.percent_change[:universe, column]
+                rows = np.flatnonzero(~np.isnan(changes))
+                changes = changes[rows]
+                self.gainers[(window, universe)] = _build_entries(store, column, rows[_select(-changes, max_count)])
+                self.losers[(window, universe)] = _build_entries(store, column, rows[_select(changes, max_count)])
+
+    def top(self, window='24h', universe=DEFAULT_UNIVERSE, count=DEFAULT_COUNT):
+        return self.gainers.get((window, universe), [])[:count]
+
+    def bottom(self, window='24h', universe=DEFAULT_UNIVERSE, count=DEFAULT_COUNT):
+        return self.losers.get((window, universe), [])[:count]
+
+
+def _select(keys, count):
+    # positions of the smallest `count` keys, ordered by key and then by position (the ranking order), which
+    # matches a stable full sort. np.partition finds the cut-off without sorting the whole universe.
+    if count < len(keys):
+        cutoff = np.partition(keys, count - 1)[count - 1]
+        candidates = np.flatnonzero(keys <= cutoff)
+    else:
+        candidates = np.arange(len(keys))
+    order = np.lexsort((candidates, keys[candidates]))[:count]
+    return candidates[order]
+
+
+def _build_entries(store, column, rows):
+    return [(store.names[row], store.symbols[row], float(store.percent_change[row, column])) for row in rows]
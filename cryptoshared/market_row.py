@@ -0,0 +1,20 @@
+from collections import namedtuple
+
+# One coin as parsed from the market data of a refresh: who it is, then the numeric columns of
+# ticker_store.TickerStore in order. Missing numbers are None. The field names match the TickerResult attributes.
+MarketRow = namedtuple('MarketRow', ['exchange_name', 'currency_id', 'currency_name', 'ticker_symbol', 'usd_price',
+                                     'market_cap', 'volume_24h', 'percent_change_1h', 'percent_change_24h',
+                                     'percent_change_7d', 'percent_change_30d', 'percent_change_1y'])
+# where the numeric fields start
+NUMERIC_START = 4
+
+
+def from_ticker(ticker):
+    return MarketRow(*[getattr(ticker, field) for field in MarketRow._fields])
+
+
+def to_ticker(row, ticker):
+    # fills in a TickerResult, the btc and eth prices are left to ticker_store.TickerStore
+    for field, value in zip(MarketRow._fields, row):
+        setattr(ticker, field, value)
+    return ticker
@@ -0,0 +1,177 @@
+import bisect
+import itertools
+import math
+import threading
+
+from cryptoshared.ticker_store import CHANGE_WINDOWS
+
+ABOVE = '>'
+BELOW = '<'
+# an alert watches the usd price or one of the ticker_store.CHANGE_WINDOWS percent changes
+PRICE = 'price'
+# once an alert fires it is only re-armed after the value moves back past the threshold by this much, so a price
+# hovering around the threshold does not fire it on every refresh. relative for prices, percentage points otherwise.
+PRICE_HYSTERESIS = 0.01
+CHANGE_HYSTERESIS = 1.0
+
+
+class PriceAlert:
+    __slots__ = ('alert_id', 'tg_user_id', 'tg_chat_id', 'ticker_symbol', 'metric', 'direction', 'threshold', 'armed')
+
+    def __init__(self, alert_id, tg_user_id, tg_chat_id, ticker_symbol, metric, direction, threshold, armed=True):
+        self.alert_id = alert_id
+        self.tg_user_id = tg_user_id
+        self.tg_chat_id = tg_chat_id
+        self.ticker_symbol = ticker_symbol
+        self.metric = metric
+        self.direction = direction
+        self.threshold = threshold
+        self.armed = armed
+
+    def key(self):
+        # two alerts with the same key in the same chat would always fire together
+        return self.tg_chat_id, self.ticker_symbol, self.metric, self.direction, self.threshold
+
+    def trigger_value(self):
+        # the value whose crossing changes the state of this alert: the threshold while armed, the re-arm level
+        # after it fired
+        if self.armed:
+            return self.threshold
+        if self.metric == PRICE:
+            hysteresis = self.threshold * PRICE_HYSTERESIS
+        else:
+            hysteresis = CHANGE_HYSTERESIS
+        return self.threshold - hysteresis if self.direction == ABOVE else self.threshold + hysteresis
+
+    def triggers_on_rise(self):
+        # an armed '>' alert and a fired '<' alert both wait for the value to go up
+        return self.armed == (self.direction == ABOVE)
+
+
+class _AlertBook:
+    # all alerts for one (ticker, metric): trigger values sorted separately for rising and falling values
+    __slots__ = ('value', 'rising', 'falling')
+
+    def __init__(self):
+        self.value = None
+        self.rising = []
+        self.falling = []
+
+
+class AlertIndex:
+    # Alerts indexed by (ticker, metric) and sorted by trigger value. On every refresh only the trigger values
+    # between the previous and the new value of a ticker are touched, found by bisecting, so a cycle costs
+    # O(tickers with alerts x log alerts + alerts that change state) no matter how many alerts exist.
+    def __init__(self):
+        self._alerts = {}
+        self._keys = set()
+        self._books = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._alerts)
+
+    def next_id(self):
+        # ids for alerts that are not persisted to a db
+        with self._lock:
+            alert_id = next(self._ids)
+            while alert_id in self._alerts:
+                alert_id = next(self._ids)
+            return alert_id
+
+    def contains_key(self, alert):
+        with self._lock:
+            return alert.key() in self._keys
+
+    def add(self, alert, current_value=None):
+        with self._lock:
+            if alert.key() in self._keys:
+                return False
+            book = self._books.setdefault((alert.ticker_symbol, alert.metric), _AlertBook())
+            if book.value is None and current_value is not None:
+                book.value = current_value
+            self._alerts[alert.alert_id] = alert
+            self._keys.add(alert.key())
+            self._insert(book, alert)
+            return True
+
+    def remove(self, alert_id):
+        with self._lock:
+            alert = self._alerts.pop(alert_id, None)
+            if alert is None:
+                return None
+            self._keys.discard(alert.key())
+            book = self._books[(alert.ticker_symbol, alert.metric)]
+            entries = book.rising if alert.triggers_on_rise() else book.falling
+            entries.pop(bisect.bisect_left(entries, (alert.trigger_value(), alert.alert_id)))
+            if not book.rising and not book.falling:
+                del self._books[(alert.ticker_symbol, alert.metric)]
+            return alert
+
+    def alert_ids(self):
+        with self._lock:
+            return set(self._alerts)
+
+    def ticker_symbols(self):
+        # every ticker with at least one alert
+        with self._lock:
+            return {ticker_symbol for ticker_symbol, _ in self._books}
+
+    def get_chat_alerts(self, tg_chat_id):
+        with self._lock:
+            return sorted((alert for alert in self._alerts.values() if alert.tg_chat_id == tg_chat_id),
+                          key=lambda alert: alert.alert_id)
+
+    def evaluate(self, store, changed=None):
+        # compares each watched value in the ticker_store.TickerStore with the previous refresh. returns the list of
+        # (alert, value) that fired and the list of alerts that re-armed. changed is the set of symbols whose values
+        # changed since the previous refresh when known, the other books are skipped.
+        fired = []
+        rearmed = []
+        with self._lock:
+            for (ticker_symbol, metric), book in self._books.items():
+                # a book without a value yet still needs its first one
+                if changed is not None and ticker_symbol not in changed and book.value is not None:
+                    continue
+                value = get_value(store, ticker_symbol, metric)
+                if value is None:
+                    continue
+                previous_value, book.value = book.value, value
+                if previous_value is None or value == previous_value:
+                    continue
+                if value > previous_value:
+                    start = bisect.bisect_right(book.rising, (previous_value, math.inf))
+                    end = bisect.bisect_right(book.rising, (value, math.inf))
+                    crossed = book.rising[start:end]
+                    del book.rising[start:end]
+                else:
+                    start = bisect.bisect_left(book.falling, (value, -math.inf))
+                    end = bisect.bisect_left(book.falling, (previous_value, -math.inf))
+                    crossed = book.falling[start:end]
+                    del book.falling[start:end]
+                for _, alert_id in crossed:
+                    alert = self._alerts[alert_id]
+                    if alert.armed:
+                        fired.append((alert, value))
+                    else:
+                        rearmed.append(alert)
+                    alert.armed = not alert.armed
+                    self._insert(book, alert)
+        return fired, rearmed
+
+    def _insert(self, book, alert):
+        entries = book.rising if alert.triggers_on_rise() else book.falling
+        bisect.insort(entries, (alert.trigger_value(), alert.alert_id))
+
+
+def get_value(store, ticker_symbol, metric):
+    row = store.row(ticker_symbol)
+    if row is None:
+        return None
+    if metric == PRICE:
+        value = store.usd_price[row]
+    else:
+        value = store.percent_change[row, CHANGE_WINDOWS.index(metric)]
+    value = float(value)
+    return value if math.isfinite(value) else None
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+# samples kept per ticker. at one sample per 10 second refresh the default covers the past hour
+DEPTH = 360
+MAX_TICKERS = 4000
+KEY_BYTES = 64
+
+
+def history_dtype(depth):
+    # one record per ticker: a ring buffer of (timestamp, usd_price, volume_24h) samples, head is the next write
+    # position, count the number of valid samples and last_seen the timestamp of the latest append that listed it
+    return np.dtype([('key', 'S{}'.format(KEY_BYTES)), ('head', 'i8'), ('count', 'i8'), ('last_seen', 'f8'),
+                     ('timestamp', 'f8', (depth,)), ('usd_price', 'f8', (depth,)), ('volume_24h', 'f8', (depth,))])
+
+
+def history_key(currency_id, ticker_symbol):
+    # tickers are kept by CoinGecko id, so coins sharing a symbol each have their own history. the symbol is the
+    # fallback for a source without ids
+    return currency_id or ticker_symbol
+
+
+class PriceHistory:
+    # Recent price history for every ticker in a fixed amount of memory: max_tickers x depth samples, allocated up
+    # front, keyed by history_key(). When every slot is taken, a new ticker reuses the slot of the ticker that was
+    # least recently listed. With a path the records live in a memory-mapped .npy file, so the history survives a
+    # restart; a file written with a different depth or ticker count is replaced.
+    def __init__(self, depth=DEPTH, max_tickers=MAX_TICKERS, path=None):
+        self.depth = depth
+        self.max_tickers = max_tickers
+        self.path = path
+        self._data = _open_records(path, history_dtype(depth), max_tickers)
+        self._slots = {key.decode(): slot for slot, key in enumerate(self._data['key']) if key}
+        self._free = [slot for slot in range(max_tickers - 1, -1, -1) if not self._data['key'][slot]]
+        self._lock = threading.Lock()
+
+    def append(self, store, timestamp=None, fetched=None):
+        # adds one sample for every ticker in a ticker_store.TickerStore, or with fetched (a bool per row) for the
+        # rows it marks, so prices kept from an earlier refresh are not sampled again. when there are more tickers
+        # than slots the lowest ranked ones are skipped.
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            rows, slots, new_rows = [], [], []
+            seen = set()
+            for row, key in enumerate(map(history_key, store.currency_ids, store.symbols)):
+                if key in seen or (fetched is not None and not fetched[row]):
+                    continue
+                seen.add(key)
+                slot = self._slots.get(key)
+                if slot is not None:
+                    rows.append(row)
+                    slots.append(slot)
+                elif key and len(key.encode()) <= KEY_BYTES:
+                    new_rows.append((row, key))
+            if new_rows:
+                new_slots = self._take_slots(len(new_rows), slots)
+                for (row, key), slot in zip(new_rows, new_slots):
+                    self._data['key'][slot] = key.encode()
+                    self._slots[key] = slot
+                    rows.append(row)
+                    slots.append(slot)
+            if not slots:
+                return
+            rows = np.array(rows)
+            slots = np.array(slots)
+            self._data['last_seen'][slots] = timestamp
+            heads = self._data['head'][slots]
+            self._data['timestamp'][slots, heads] = timestamp
+            self._data['usd_price'][slots, heads] = store.usd_price[rows]
+            self._data['volume_24h'][slots, heads] = store.volume_24h[rows]
+            self._data['head'][slots] = (heads + 1) % self.depth
+            self._data['count'][slots] = np.minimum(self._data['count'][slots] + 1, self.depth)
+            if isinstance(self._data, np.memmap):
+                self._data.flush()
+
+    def samples(self, key, since=None):
+        # (timestamps, usd_prices, volumes) arrays of a history_key(), oldest first, optionally only the samples at
+        # or after since
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                return np.empty(0), np.empty(0), np.empty(0)
+            record = self._data[slot]
+            count, head = int(record['count']), int(record['head'])
+            order = np.arange(head - count, head) % self.depth
+            timestamps = record['timestamp'][order]
+            prices = record['usd_price'][order]
+            volumes = record['volume_24h'][order]
+        if since is not None:
+            start = np.searchsorted(timestamps, since, side='left')
+            timestamps, prices, volumes = timestamps[start:], prices[start:], volumes[start:]
+        return timestamps, prices, volumes
+
+    def price_at(self, key, timestamp):
+        # price of the last sample taken at or before timestamp, None when the history does not go back that far
+        timestamps, prices, _ = self.samples(key)
+        index = np.searchsorted(timestamps, timestamp, side='right') - 1
+        if index < 0:
+            return None
+        return float(prices[index])
+
+    def window_stats(self, key, seconds, now=None):
+        # percent change, low, high and volume weighted average price over the past `seconds`, or None when the
+        # history does not cover the whole window
+        now = time.time() if now is None else now
+        start_price = self.price_at(key, now - seconds)
+        if start_price is None:
+            return None
+        timestamps, prices, volumes = self.samples(key, since=now - seconds)
+        if len(prices) == 0:
+            return None
+        valid_volumes = np.nan_to_num(volumes)
+        volume_total = valid_volumes.sum()
+        vwap = float((prices * valid_volumes).sum() / volume_total) if volume_total > 0 else float(prices.mean())
+        return {'percent_change': (float(prices[-1]) - start_price) / start_price * 100,
+                'low': float(np.nanmin(prices)), 'high': float(np.nanmax(prices)), 'vwap': vwap,
+                'start_price': start_price, 'end_price': float(prices[-1])}
+
+    def _take_slots(self, count, in_use):
+        # up to count empty slots, then the least recently seen slots that are not in in_use, emptied for reuse
+        slots = [self._free.pop() for _ in range(min(count, len(self._free)))]
+        if len(slots) < count:
+            last_seen = self._data['last_seen'].copy()
+            last_seen[in_use] = np.inf
+            last_seen[slots] = np.inf
+            oldest = np.argsort(last_seen, kind='stable')[:count - len(slots)]
+            for slot in oldest[np.isfinite(last_seen[oldest])].tolist():
+                del self._slots[self._data['key'][slot].decode()]
+                self._data['head'][slot] = 0
+                self._data['count'][slot] = 0
+                slots.append(slot)
+        return slots
+
+
+def _open_records(path, dtype, max_tickers):
+    if path is None:
+        return np.zeros(max_tickers, dtype=dtype)
+    if os.path.exists(path):
+        try:
+            records = np.lib.format.open_memmap(path, mode='r+')
+            if records.dtype == dtype and records.shape == (max_tickers,):
+                return records
+        except ValueError:
+            pass
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(max_tickers,))
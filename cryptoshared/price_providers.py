@@ -0,0 +1,334 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+import warnings
+from collections import deque
+
+import numpy as np
+
+from cryptoshared.market_row import MarketRow, NUMERIC_START
+
+# seconds a provider gets before the next one is asked as well
+HEDGE_DELAY = 2.0
+# seconds after which a refresh gives up on the providers that have not answered, longer than a coingecko refresh
+TIMEOUT = 30
+# latencies kept per provider for its percentiles
+LATENCY_SAMPLES = 100
+
+# the first good answer wins, coins it does not list are filled in from the other answers that arrived by then
+PRECEDENCE = 'precedence'
+# every provider is asked at once, each number is the median of the answers that list the coin
+MEDIAN = 'median'
+
+
+class PriceProvider:
+    # A source of market data. fetch() returns (rows, shadowed): the market_row.MarketRows of every coin in
+    # ranking order, and the rows of coins whose symbol belongs to a higher ranked coin. report is whatever the
+    # ProviderSet's report_factory builds, e.g. a coingecko_api.RefreshReport, or None. fetch_async() runs fetch() on
+    # a worker thread unless a provider has a native async version.
+    name = None
+
+    @property
+    def native_async(self):
+        # whether fetch_async() runs on the event loop, so cancelling it stops the call
+        return type(self).fetch_async is not PriceProvider.fetch_async
+
+    def fetch(self, report=None):
+        raise NotImplementedError
+
+    async def fetch_async(self, report=None):
+        return await asyncio.get_running_loop().run_in_executor(None, self.fetch, report)
+
+
+class ProviderStats:
+    # latency and outcome of the calls to one provider
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self.calls = 0
+        self.failures = 0
+        self.wins = 0
+        self.skipped = 0
+        self.last_error = None
+        self._latencies = deque(maxlen=samples)
+        self._lock = threading.Lock()
+
+    def record(self, latency, error=None):
+        with self._lock:
+            self.calls += 1
+            self._latencies.append(latency)
+            if error is not None:
+                self.failures += 1
+                self.last_error = str(error) or type(error).__name__
+
+    def stats(self):
+        with self._lock:
+            latencies = list(self._latencies)
+            p50, p95 = np.percentile(latencies, [50, 95]) if latencies else (None, None)
+            return {'calls': self.calls, 'failures': self.failures, 'wins': self.wins, 'skipped': self.skipped,
+                    'p50': p50, 'p95': p95, 'last_error': self.last_error}
+
+
+class ProviderSet:
+    # Fans a refresh out to several PriceProviders, listed from the most to the least trusted, and merges their
+    # answers into one list of rows with policy:
+    # - PRECEDENCE: hedged requests. The first provider is asked, and the next one too whenever hedge_delay seconds
+    #   pass without a good answer or a provider fails. The first good (non empty) answer wins.
+    # - MEDIAN: every provider is asked at once and the answers that arrive within timeout are merged.
+    # Coins are matched by ticker symbol, their names, ids and ranking come from the most trusted answer. A provider
+    # whose call from an earlier refresh is still running is not asked again until it returns. Every call gets its
+    # own report_factory() report, merged into the caller's report once it is done. A call that is only done after
+    # fetch() returned, e.g. a hedge loser, hands its report to on_late_report instead, so the requests it made are
+    # still accounted for, e.g. by refresh_scheduler.RefreshScheduler.record_late(). When every provider is still
+    # busy, fetch() returns without asking any and sets skipped on the caller's report.
+    def __init__(self, providers, policy=PRECEDENCE, hedge_delay=HEDGE_DELAY, timeout=TIMEOUT,
+                 report_factory=None, logger=None, on_late_report=None):
+        if policy not in (PRECEDENCE, MEDIAN):
+            raise ValueError('Unknown merge policy: {}'.format(policy))
+        self.providers = list(providers)
+        self.policy = policy
+        self.hedge_delay = hedge_delay
+        self.timeout = timeout
+        self.report_factory = report_factory
+        self.logger = logger
+        self.on_late_report = on_late_report
+        self._stats = [ProviderStats() for _ in self.providers]
+        self._busy = set()
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(self.providers), 1),
+                                                               thread_name_prefix='price-provider')
+
+    def fetch(self, report=None):
+        # (rows, shadowed), both empty when no provider answered in time
+        pending = {}
+        answers = {}
+        launcher = _Launcher(self, self.policy == MEDIAN)
+        deadline = time.monotonic() + self.timeout
+        refresh = _Refresh(report)
+        try:
+            for index in launcher.due(time.monotonic()):
+                pending[self._executor.submit(self._call, index, refresh)] = index
+            while pending and not self._is_done(answers):
+                now = time.monotonic()
+                wait = min(deadline, launcher.next_at) - now
+                done, _ = concurrent.futures.wait(pending, timeout=max(wait, 0),
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    answer = future.result()
+                    if answer is not None:
+                        answers[index] = answer
+                    else:
+                        launcher.failed()
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                for index in launcher.due(now):
+                    pending[self._executor.submit(self._call, index, refresh)] = index
+        finally:
+            # calls still running finish in the background, their stats are still recorded
+            self._close(refresh, launcher)
+        return self._merge(answers)
+
+    async def fetch_async(self, report=None):
+        # fetch() on the running event loop, the calls still running when it returns are cancelled
+        pending = {}
+        answers = {}
+        launcher = _Launcher(self, self.policy == MEDIAN)
+        deadline = time.monotonic() + self.timeout
+        refresh = _Refresh(report)
+        for index in launcher.due(time.monotonic()):
+            pending[asyncio.ensure_future(self._call_async(index, refresh))] = index
+        try:
+            while pending and not self._is_done(answers):
+                wait = min(deadline, launcher.next_at) - time.monotonic()
+                done, _ = await asyncio.wait(pending, timeout=max(wait, 0), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index = pending.pop(task)
+                    answer = task.result()
+                    if answer is not None:
+                        answers[index] = answer
+                    else:
+                        launcher.failed()
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                for index in launcher.due(now):
+                    pending[asyncio.ensure_future(self._call_async(index, refresh))] = index
+        finally:
+            for task in pending:
+                task.cancel()
+            self._close(refresh, launcher)
+        return self._merge(answers)
+
+    def stats(self):
+        # {provider name: ProviderStats.stats()}
+        return {provider.name: stats.stats() for provider, stats in zip(self.providers, self._stats)}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def _claim(self, index):
+        with self._lock:
+            if index in self._busy:
+                self._stats[index].skipped += 1
+                return False
+            self._busy.add(index)
+            return True
+
+    def _call(self, index, refresh):
+        # the provider's (rows, shadowed), None when it failed or had nothing
+        provider = self.providers[index]
+        call_report = self.report_factory() if self.report_factory is not None else None
+        start = time.monotonic()
+        error = None
+        answer = None
+        try:
+            answer = provider.fetch(call_report)
+            if not answer[0]:
+                error = 'no rows'
+        except Exception as e:
+            error = e
+        finally:
+            self._finish(index, start, error, refresh, call_report)
+        return answer if error is None else None
+
+    async def _call_async(self, index, refresh):
+        provider = self.providers[index]
+        call_report = self.report_factory() if self.report_factory is not None else None
+        start = time.monotonic()
+        future = None
+        if provider.native_async:
+            call = provider.fetch_async(call_report)
+        else:
+            # fetch() on a worker thread of the set, which goes on after the call is cancelled
+            future = self._executor.submit(provider.fetch, call_report)
+            call = asyncio.wrap_future(future)
+        error = None
+        answer = None
+        try:
+            answer = await call
+            if not answer[0]:
+                error = 'no rows'
+        except asyncio.CancelledError:
+            # lost the hedge, not a failure of the provider. it stays busy until a call on a worker thread returns
+            if future is None:
+                with self._lock:
+                    self._busy.discard(index)
+            else:
+                future.add_done_callback(lambda done: self._finish_late(index, start, refresh, call_report, done))
+            raise
+        except Exception as e:
+            error = e
+        self._finish(index, start, error, refresh, call_report)
+        return answer if error is None else None
+
+    def _close(self, refresh, launcher):
+        # fetch() is returning, the calls that finish from now on are late
+        with self._lock:
+            refresh.returned = True
+        if refresh.report is not None and not launcher.launched:
+            refresh.report.skipped = True
+
+    def _finish(self, index, start, error, refresh, call_report):
+        self._stats[index].record(time.monotonic() - start, error)
+        late = False
+        with self._lock:
+            self._busy.discard(index)
+            if refresh.report is not None and call_report is not None:
+                if refresh.returned:
+                    late = True
+                else:
+                    refresh.report.merge(call_report)
+        if late and self.on_late_report is not None:
+            self.on_late_report(call_report)
+        if error is not None and self.logger is not None:
+            self.logger.error('Price provider {} failed: {}'.format(self.providers[index].name, error))
+
+    def _finish_late(self, index, start, refresh, call_report, future):
+        # a call on a worker thread that lost the hedge has returned, or was cancelled before it started
+        if future.cancelled():
+            with self._lock:
+                self._busy.discard(index)
+            return
+        error = future.exception()
+        if error is None and not future.result()[0]:
+            error = 'no rows'
+        self._finish(index, start, error, refresh, call_report)
+
+    def _is_done(self, answers):
+        return bool(answers) and self.policy == PRECEDENCE
+
+    def _merge(self, answers):
+        if not answers:
+            return [], []
+        ordered = [answers[index] for index in sorted(answers)]
+        for index in answers:
+            self._stats[index].wins += 1
+        rows = merge_rows([rows for rows, _ in ordered], self.policy)
+        return rows, ordered[0][1]
+
+
+class _Refresh:
+    # one fetch() of a ProviderSet: the caller's report and whether fetch() has returned
+    def __init__(self, report):
+        self.report = report
+        self.returned = False
+
+
+class _Launcher:
+    # which providers a refresh asks next: with hedging one at a time, every hedge_delay seconds or right after a
+    # failure, otherwise all of them at once
+    def __init__(self, provider_set, all_at_once):
+        self.provider_set = provider_set
+        self.all_at_once = all_at_once
+        self.next_index = 0
+        self.next_at = time.monotonic()
+        self.launched = 0
+
+    def due(self, now):
+        indexes = []
+        count = len(self.provider_set.providers)
+        while self.next_index < count and now >= self.next_at:
+            index = self.next_index
+            self.next_index += 1
+            if self.provider_set._claim(index):
+                indexes.append(index)
+                self.launched += 1
+                if not self.all_at_once:
+                    self.next_at = now + self.provider_set.hedge_delay
+        if self.next_index >= count:
+            self.next_at = float('inf')
+        return indexes
+
+    def failed(self):
+        # a failed provider is hedged right away
+        if self.next_index < len(self.provider_set.providers):
+            self.next_at = time.monotonic()
+
+
+def merge_rows(answers, policy=PRECEDENCE):
+    # answers are lists of MarketRows from the most to the least trusted provider. the coins of the first list come
+    # first in its order, then the ones only the others list. with MEDIAN every number is the median of the lists
+    # that have it.
+    rows = list(answers[0])
+    symbols = {row.ticker_symbol for row in rows}
+    for other in answers[1:]:
+        for row in other:
+            if row.ticker_symbol not in symbols:
+                symbols.add(row.ticker_symbol)
+                rows.append(row)
+    if policy != MEDIAN or len(answers) == 1:
+        return rows
+    positions = {row.ticker_symbol: position for position, row in enumerate(rows)}
+    width = len(MarketRow._fields) - NUMERIC_START
+    values = np.full((len(answers), len(rows), width), np.nan)
+    for number, answer in enumerate(answers):
+        for row in answer:
+            values[number, positions[row.ticker_symbol]] = [np.nan if value is None else value
+                                                            for value in row[NUMERIC_START:]]
+    with warnings.catch_warnings():
+        # numbers no provider has stay NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        medians = np.nanmedian(values, axis=0)
+    return [MarketRow(*row[:NUMERIC_START], *[None if np.isnan(value) else float(value) for value in numbers])
+            for row, numbers in zip(rows, medians)]
@@ -0,0 +1,115 @@
+import bisect
+import copy
+import heapq
+import re
+
+# most tickers a prefix lookup returns
+MAX_COMPLETIONS = 10
+MAX_SUGGESTIONS = 3
+# keys longer than this are left out of the typo index, a misspelled long id is found by its prefix instead
+MAX_FUZZY_KEY_LENGTH = 20
+# sorts after every character a key can contain
+_MAX_CHAR = chr(0x10ffff)
+
+
+class SearchIndex:
+    # Finds tickers by symbol, name or CoinGecko id across one or more ticker_store.TickerStore, built once per
+    # snapshot. Entries are numbered in store order (the ranking). Every lower case key (symbol, id, name and each
+    # word of the name) is kept in one sorted list next to its entry number: the keys starting with a prefix are a
+    # contiguous slice found by bisecting, and its best ranked entries are the smallest numbers in that slice. Typos
+    # are matched with a one-character deletion index: two keys within one insert, delete, substitution or swap of
+    # each other share at least one variant.
+    def __init__(self, stores, max_completions=MAX_COMPLETIONS):
+        self.max_completions = max_completions
+        self._stores = list(stores)
+        # (store number, row) per entry
+        self._entries = []
+        self._by_symbol = {}
+        self._by_id = {}
+        self._variants = {}
+        keys = set()
+        for store_number, store in enumerate(self._stores):
+            for row in range(len(store)):
+                self._add(store_number, store, row, keys)
+        keys = sorted(keys)
+        self._keys = [key for key, _ in keys]
+        self._key_positions = [position for _, position in keys]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def rebind(self, stores):
+        # the same index over new stores holding the same coins in the same order (see TickerStore.same_identities),
+        # without building it again
+        index = copy.copy(self)
+        index._stores = list(stores)
+        return index
+
+    def lookup(self, query):
+        # exact ticker symbol, or CoinGecko id for coins whose symbol belongs to a higher ranked coin
+        query = query.strip()
+        position = self._by_symbol.get(query.upper())
+        if position is None:
+            position = self._by_id.get(query.lower())
+        return None if position is None else self._ticker(position)
+
+    def complete(self, prefix, limit=MAX_COMPLETIONS):
+        # best ranked tickers with a symbol, name, word of the name or id starting with prefix
+        return [self._ticker(position) for position in self._complete(normalize(prefix), limit)]
+
+    def suggest(self, query, limit=MAX_SUGGESTIONS):
+        # 'did you mean' candidates for a query that did not resolve: keys one typo away first, then completions
+        key = normalize(query)
+        positions = set()
+        for variant in _variants(key):
+            positions.update(self._variants.get(variant, ()))
+        suggestions = sorted(positions)[:limit]
+        if len(suggestions) < limit:
+            suggestions += [position for position in self._complete(key, limit) if position not in positions]
+        return [self._ticker(position) for position in suggestions[:limit]]
+
+    def _add(self, store_number, store, row, keys):
+        position = len(self._entries)
+        self._entries.append((store_number, row))
+        symbol, currency_id, name = store.symbols[row], store.currency_ids[row], store.names[row]
+        self._by_symbol.setdefault(symbol, position)
+        if currency_id:
+            self._by_id.setdefault(currency_id.lower(), position)
+
+        entry_keys = {normalize(key) for key in (symbol, currency_id) if key}
+        entry_keys.discard('')
+        # names are left out of the typo index, the id is nearly always the name spelled with dashes
+        for key in entry_keys:
+            if len(key) <= MAX_FUZZY_KEY_LENGTH:
+                for variant in _variants(key):
+                    positions = self._variants.setdefault(variant, [])
+                    if not positions or positions[-1] != position:
+                        positions.append(position)
+        if name:
+            # 'bit' should also find 'Wrapped Bitcoin'
+            name = normalize(name)
+            entry_keys.add(name)
+            entry_keys.update(word for word in name.split(' ') if word)
+        keys.update((key, position) for key in entry_keys)
+
+    def _complete(self, key, limit):
+        if not key:
+            return []
+        start = bisect.bisect_left(self._keys, key)
+        end = bisect.bisect_left(self._keys, key + _MAX_CHAR, start)
+        return heapq.nsmallest(min(limit, self.max_completions), set(self._key_positions[start:end]))
+
+    def _ticker(self, position):
+        store_number, row = self._entries[position]
+        return self._stores[store_number].ticker(row)
+
+
+def normalize(text):
+    return re.sub(r'\s+', ' ', text.strip().lower())
+
+
+def _variants(key):
+    # the key itself and every way of deleting one character from it
+    variants = {key}
+    variants.update(key[:index] + key[index + 1:] for index in range(len(key)))
+    return variants
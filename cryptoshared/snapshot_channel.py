@@ -0,0 +1,140 @@
+import os
+import socket
+import threading
+
+from cryptoshared import snapshot_file
+
+# seconds between attempts to reach the fetcher's socket
+RECONNECT_DELAY = 1.0
+# seconds a notification may take to reach one worker before that worker is dropped
+SEND_TIMEOUT = 1.0
+
+
+class SnapshotPublisher:
+    # Fetcher side of the snapshot distribution between one fetching process and any number of bot workers on the
+    # same machine. publish() writes the snapshot file, then sends the new version as one line to every worker
+    # connected to the unix socket at socket_path.
+    def __init__(self, path, socket_path, logger=None):
+        self.path = path
+        self.socket_path = socket_path
+        self.logger = logger
+        self._server = None
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        # a socket file left behind by a fetcher that did not shut down cleanly would make bind() fail
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.socket_path)
+        self._server.listen(64)
+        threading.Thread(target=self._accept, name='snapshot-publisher', daemon=True).start()
+        return self
+
+    def publish(self, snapshot):
+        snapshot_file.write_snapshot(self.path, snapshot)
+        message = '{}\n'.format(snapshot.version).encode()
+        with self._lock:
+            for connection in list(self._connections):
+                try:
+                    connection.sendall(message)
+                except OSError:
+                    self._connections.remove(connection)
+                    connection.close()
+
+    def subscribers(self):
+        with self._lock:
+            return len(self._connections)
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                # closed
+                return
+            connection.settimeout(SEND_TIMEOUT)
+            with self._lock:
+                self._connections.append(connection)
+            if self.logger is not None:
+                self.logger.info('Worker attached to {}'.format(self.socket_path))
+
+
+class SnapshotSubscriber:
+    # Worker side: start() loads the snapshot file that is already there, so a worker can answer right away without
+    # a fetch of its own, then follows the publisher's notifications on a thread and passes every newer snapshot to
+    # on_snapshot. When the fetcher goes away the subscriber keeps the last snapshot and reconnects, re-reading the
+    # file once connected in case it missed a version in between.
+    def __init__(self, path, socket_path, on_snapshot, reconnect_delay=RECONNECT_DELAY, logger=None):
+        self.path = path
+        self.socket_path = socket_path
+        self.on_snapshot = on_snapshot
+        self.reconnect_delay = reconnect_delay
+        self.logger = logger
+        self.version = 0
+        self._connection = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._load()
+        self._thread = threading.Thread(target=self._run, name='snapshot-subscriber', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        connection = self._connection
+        if connection is not None:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+                    connection.connect(self.socket_path)
+                    self._connection = connection
+                    self._load()
+                    for line in connection.makefile('rb'):
+                        if int(line) > self.version:
+                            self._load()
+            except (OSError, ValueError) as e:
+                if self.logger is not None and not self._stop.is_set():
+                    self.logger.debug('No connection to the snapshot fetcher: {}'.format(e))
+            finally:
+                self._connection = None
+            self._stop.wait(self.reconnect_delay)
+
+    def _load(self):
+        try:
+            snapshot = snapshot_file.read_snapshot(self.path)
+        except FileNotFoundError:
+            return
+        except snapshot_file.InvalidSnapshotFile as e:
+            if self.logger is not None:
+                self.logger.error(str(e))
+            return
+        if snapshot.version <= self.version:
+            return
+        self.version = snapshot.version
+        try:
+            self.on_snapshot(snapshot)
+        except Exception:
+            if self.logger is not None:
+                self.logger.exception('Unable to publish snapshot {}:'.format(snapshot.version))
@@ -0,0 +1,125 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+import numpy as np
+
+from cryptoshared.ticker_snapshot import TickerSnapshot
+from cryptoshared.ticker_store import TickerStore
+
+MAGIC = b'CPBSNAP2'
+# magic, the length of the json header that follows, and a crc32 of everything after this prefix so a damaged or
+# truncated file is never served
+_PREFIX = struct.Struct('<8sII')
+_ALIGNMENT = 8
+_STRING_COLUMNS = ('exchange_names', 'symbols', 'names', 'currency_ids')
+_ARRAY_COLUMNS = ('usd_price', 'market_cap', 'volume_24h', 'percent_change')
+_STORES = ('store', 'shadowed')
+
+
+class InvalidSnapshotFile(Exception):
+    pass
+
+
+def write_snapshot(path, snapshot):
+    # Writes the stores of a ticker_snapshot.TickerSnapshot to path: a json header with the version, the exchange
+    # rates, the rows the refresh did not fetch, the string columns and where each float64 array starts, followed by
+    # the raw arrays. The file is written and synced next to path, then renamed over it, so readers only ever open
+    # complete files, even after a crash.
+    arrays = []
+    stores = {}
+    offset = 0
+    for name in _STORES:
+        store = getattr(snapshot, name)
+        layout = {}
+        for column in _ARRAY_COLUMNS:
+            array = np.ascontiguousarray(getattr(store, column), dtype='<f8')
+            layout[column] = [offset, list(array.shape)]
+            arrays.append(array)
+            offset += array.nbytes
+        stores[name] = {'columns': {column: list(getattr(store, column)) for column in _STRING_COLUMNS},
+                        'arrays': layout}
+    stale_rows = None if snapshot.fetched is None else np.flatnonzero(~snapshot.fetched).tolist()
+    header = json.dumps({'version': snapshot.version, 'fetched_at': snapshot.fetched_at, 'rates': snapshot.rates,
+                         'stale_rows': stale_rows, 'stores': stores},
+                        separators=(',', ':')).encode()
+    # pad the header so the arrays start aligned
+    header += b' ' * (-(_PREFIX.size + len(header)) % _ALIGNMENT)
+    checksum = zlib.crc32(header)
+    for array in arrays:
+        checksum = zlib.crc32(array, checksum)
+
+    fd, temp_path = tempfile.mkstemp(prefix='.snapshot-', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        # readable by workers running as another user
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_PREFIX.pack(MAGIC, len(header), checksum))
+            f.write(header)
+            for array in arrays:
+                f.write(array.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def read_snapshot(path):
+    # The arrays of the returned snapshot are read-only views of the memory-mapped file, so attaching costs no copy.
+    # The mapping outlives a newer file being renamed over path and is released with the last array using it.
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise InvalidSnapshotFile('{} is empty'.format(path))
+    try:
+        magic, header_length, checksum = _PREFIX.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise InvalidSnapshotFile('{} is not a snapshot file'.format(path))
+        if zlib.crc32(memoryview(data)[_PREFIX.size:]) != checksum:
+            raise InvalidSnapshotFile('{} is damaged: checksum mismatch'.format(path))
+        data_start = _PREFIX.size + header_length
+        header = json.loads(data[_PREFIX.size:data_start])
+        stores = {}
+        for name in _STORES:
+            layout = header['stores'][name]
+            arrays = {column: _get_array(data, data_start + offset, shape)
+                      for column, (offset, shape) in layout['arrays'].items()}
+            stores[name] = TickerStore(*[layout['columns'][column] for column in _STRING_COLUMNS],
+                                       *[arrays[column] for column in _ARRAY_COLUMNS],
+                                       base_store=stores.get('store'))
+        fetched = None
+        if header.get('stale_rows') is not None:
+            fetched = np.ones(len(stores['store']), dtype=bool)
+            fetched[header['stale_rows']] = False
+    except (struct.error, ValueError, KeyError, TypeError, IndexError) as e:
+        raise InvalidSnapshotFile('{} is damaged: {}'.format(path, e))
+    return TickerSnapshot(stores['store'], header['version'], header['fetched_at'], stores['shadowed'],
+                          rates=header.get('rates'), fetched=fetched)
+
+
+def read_version(path):
+    # version of the snapshot in path without loading it, 0 if there is no readable file
+    try:
+        with open(path, 'rb') as f:
+            magic, header_length, _ = _PREFIX.unpack(f.read(_PREFIX.size))
+            if magic != MAGIC:
+                return 0
+            return json.loads(f.read(header_length))['version']
+    except (OSError, struct.error, ValueError, KeyError):
+        return 0
+
+
+def _get_array(data, offset, shape):
+    count = int(np.prod(shape))
+    if count == 0:
+        return np.empty(shape, dtype=np.float64)
+    if offset + count * 8 > len(data):
+        raise ValueError('array at {} runs past the end of the file'.format(offset))
+    return np.frombuffer(data, dtype='<f8', count=count, offset=offset).reshape(shape)
@@ -42,5 +42,15 @@ class GetPreviousPrice(unittest.TestCase):
         self.assertEqual(.05, result)
 
 
+class TestFormatting(unittest.TestCase):
+    def test_format_age(self):
+        self.assertEqual('0s', crypto_helpers.format_age(-2))
+        self.assertEqual('59s', crypto_helpers.format_age(59.9))
+        self.assertEqual('1m', crypto_helpers.format_age(60))
+        self.assertEqual('59m', crypto_helpers.format_age(3599))
+        self.assertEqual('3h', crypto_helpers.format_age(3 * 3600 + 1800))
+        self.assertEqual('2d', crypto_helpers.format_age(2 * 86400))
+
+
 if __name__ == '__main__':
     unittest.main()
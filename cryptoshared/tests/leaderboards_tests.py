@@ -0,0 +1,42 @@
+import unittest
+from cryptoshared.leaderboards import Leaderboards
+from cryptoshared.ticker_result import TickerResult
+from cryptoshared.ticker_store import TickerStore
+
+
+def build_ticker(symbol, change_24h, change_7d=None):
+    ticker = TickerResult()
+    ticker.ticker_symbol = symbol
+    ticker.currency_name = symbol.title()
+    ticker.usd_price = 1
+    ticker.percent_change_24h = change_24h
+    ticker.percent_change_7d = change_7d
+    return ticker
+
+
+class LeaderboardsTests(unittest.TestCase):
+    def setUp(self):
+        changes = [5, -3, None, 12, 5, -8, 0.5, 5, -3, 20]
+        tickers = [build_ticker('T{}'.format(i), change, i) for i, change in enumerate(changes)]
+        self.leaderboards = Leaderboards(TickerStore.from_tickers(tickers), universe_sizes=(5, 10), max_count=4)
+        self.expected_order = sorted([t for t in tickers if t.percent_change_24h is not None],
+                                     key=lambda t: t.percent_change_24h, reverse=True)
+
+    def test_top_matches_stable_sort(self):
+        top = self.leaderboards.top('24h', 10, 4)
+        self.assertEqual([t.ticker_symbol for t in self.expected_order[:4]], [entry[1] for entry in top])
+        self.assertEqual(('T9', 'T9', 20.0), (top[0][0].upper(), top[0][1], top[0][2]))
+
+    def test_bottom_with_ties(self):
+        bottom = self.leaderboards.bottom('24h', 10, 3)
+        self.assertEqual(['T5', 'T1', 'T8'], [entry[1] for entry in bottom])
+
+    def test_universe_and_window(self):
+        self.assertEqual(['T3', 'T0', 'T4', 'T1'], [entry[1] for entry in self.leaderboards.top('24h', 5, 10)])
+        self.assertEqual(['T9', 'T8', 'T7'], [entry[1] for entry in self.leaderboards.top('7d', 10, 3)])
+        self.assertEqual([], self.leaderboards.top('1h', 10, 3))
+        self.assertEqual([], self.leaderboards.top('24h', 200, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from cryptoshared import price_alerts
+from cryptoshared.price_alerts import AlertIndex, PriceAlert
+from cryptoshared.ticker_result import TickerResult
+from cryptoshared.ticker_store import TickerStore
+
+
+def build_store(btc_price, btc_change_1h=None):
+    ticker = TickerResult()
+    ticker.ticker_symbol = 'BTC'
+    ticker.usd_price = btc_price
+    ticker.percent_change_1h = btc_change_1h
+    return TickerStore.from_tickers([ticker])
+
+
+def fired_ids(result):
+    fired, _ = result
+    return sorted(alert.alert_id for alert, _ in fired)
+
+
+class AlertIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.index = AlertIndex()
+        self.index.add(PriceAlert(1, 1, 10, 'BTC', price_alerts.PRICE, price_alerts.ABOVE, 70000), 65000)
+        self.index.add(PriceAlert(2, 1, 10, 'BTC', price_alerts.PRICE, price_alerts.ABOVE, 80000), 65000)
+        self.index.add(PriceAlert(3, 1, 20, 'BTC', price_alerts.PRICE, price_alerts.BELOW, 60000), 65000)
+
+    def test_fires_only_crossed_thresholds(self):
+        self.assertEqual([], fired_ids(self.index.evaluate(build_store(69000))))
+        self.assertEqual([1], fired_ids(self.index.evaluate(build_store(70000))))
+        self.assertEqual([3], fired_ids(self.index.evaluate(build_store(59000))))
+        # a jump over several thresholds fires all of them, the already fired ones stay quiet
+        self.assertEqual([1, 2], fired_ids(self.index.evaluate(build_store(85000))))
+
+    def test_hysteresis(self):
+        self.assertEqual([1], fired_ids(self.index.evaluate(build_store(70100))))
+        # hovering around the threshold does not fire again until the price drops 1% below it
+        self.assertEqual([], fired_ids(self.index.evaluate(build_store(69900))))
+        self.assertEqual([], fired_ids(self.index.evaluate(build_store(70200))))
+        fired, rearmed = self.index.evaluate(build_store(69200))
+        self.assertEqual([1], [alert.alert_id for alert in rearmed])
+        self.assertEqual([1], fired_ids(self.index.evaluate(build_store(70050))))
+
+    def test_change_alerts(self):
+        self.index.add(PriceAlert(4, 1, 10, 'BTC', '1h', price_alerts.BELOW, -5), -1)
+        self.assertEqual([], fired_ids(self.index.evaluate(build_store(65000, -4.9))))
+        self.assertEqual([4], fired_ids(self.index.evaluate(build_store(65000, -5.5))))
+
+    def test_unchanged_symbols_are_skipped(self):
+        self.assertEqual([], fired_ids(self.index.evaluate(build_store(75000), changed=frozenset(['ETH']))))
+        self.assertEqual([1], fired_ids(self.index.evaluate(build_store(75000), changed=frozenset(['BTC']))))
+
+    def test_duplicates_and_remove(self):
+        self.assertFalse(self.index.add(PriceAlert(5, 2, 10, 'BTC', price_alerts.PRICE, price_alerts.ABOVE, 70000)))
+        self.assertEqual(1, self.index.remove(1).alert_id)
+        self.assertIsNone(self.index.remove(1))
+        self.assertEqual([2], [alert.alert_id for alert in self.index.get_chat_alerts(10)])
+        self.assertEqual([2], fired_ids(self.index.evaluate(build_store(90000))))
+        self.assertEqual(2, len(self.index))
+
+
+if __name__ == '__main__':
+    unittest.main()
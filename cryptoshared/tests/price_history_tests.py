@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+
+from cryptoshared.price_history import PriceHistory, history_key
+from cryptoshared.ticker_result import TickerResult
+from cryptoshared.ticker_store import TickerStore
+
+
+def build_store(prices, volume=100, currency_ids=None):
+    tickers = []
+    for symbol, price in prices.items():
+        ticker = TickerResult()
+        ticker.ticker_symbol = symbol
+        ticker.currency_id = (currency_ids or {}).get(symbol)
+        ticker.usd_price = price
+        ticker.volume_24h = volume
+        tickers.append(ticker)
+    return TickerStore.from_tickers(tickers)
+
+
+class PriceHistoryTests(unittest.TestCase):
+    def test_ring_buffer_wraps(self):
+        history = PriceHistory(depth=3, max_tickers=10)
+        for i in range(5):
+            history.append(build_store({'BTC': 100 + i, 'ETH': 10 + i}), timestamp=1000 + i * 10)
+        timestamps, prices, _ = history.samples('BTC')
+        self.assertEqual([1020, 1030, 1040], list(timestamps))
+        self.assertEqual([102, 103, 104], list(prices))
+        self.assertEqual([13, 14], list(history.samples('ETH', since=1025)[1]))
+        self.assertEqual(0, len(history.samples('LTC')[0]))
+
+    def test_window_stats(self):
+        history = PriceHistory(depth=10, max_tickers=10)
+        for i, (price, volume) in enumerate([(100, 1), (90, 1), (120, 2), (110, 0)]):
+            history.append(build_store({'BTC': price}, volume), timestamp=1000 + i * 10)
+        stats = history.window_stats('BTC', 20, now=1030)
+        self.assertAlmostEqual(22.2222222, stats['percent_change'])
+        self.assertEqual(90, stats['low'])
+        self.assertEqual(120, stats['high'])
+        self.assertEqual(110, stats['vwap'])
+        self.assertEqual(90, history.price_at('BTC', 1015))
+        # the history only goes back to 1000
+        self.assertIsNone(history.window_stats('BTC', 60, now=1030))
+
+    def test_max_tickers(self):
+        history = PriceHistory(depth=2, max_tickers=1)
+        history.append(build_store({'BTC': 1, 'ETH': 2}), timestamp=1)
+        self.assertEqual(1, len(history.samples('BTC')[0]))
+        self.assertEqual(0, len(history.samples('ETH')[0]))
+
+    def test_least_recently_seen_slots_are_reused(self):
+        history = PriceHistory(depth=4, max_tickers=2)
+        history.append(build_store({'BTC': 1, 'ETH': 2}), timestamp=1)
+        history.append(build_store({'BTC': 3, 'LTC': 4}), timestamp=2)
+        # ETH was listed last at 1, so LTC took its slot
+        self.assertEqual(0, len(history.samples('ETH')[0]))
+        self.assertEqual([4], list(history.samples('LTC')[1]))
+        self.assertEqual([1, 3], list(history.samples('BTC')[1]))
+        history.append(build_store({'ETH': 5}), timestamp=3)
+        self.assertEqual([5], list(history.samples('ETH')[1]))
+        self.assertEqual(0, len(history.samples('BTC')[0]))
+        self.assertEqual([4], list(history.samples('LTC')[1]))
+
+    def test_keyed_by_coingecko_id(self):
+        history = PriceHistory(depth=4, max_tickers=10)
+        ids = {'BTC': 'bitcoin', 'ETH': None}
+        history.append(build_store({'BTC': 100, 'ETH': 10}, currency_ids=ids), timestamp=1)
+        self.assertEqual([100], list(history.samples(history_key('bitcoin', 'BTC'))[1]))
+        self.assertEqual(0, len(history.samples('BTC')[0]))
+        # without an id the symbol is the key
+        self.assertEqual([10], list(history.samples(history_key(None, 'ETH'))[1]))
+
+    def test_only_fetched_rows_are_sampled(self):
+        history = PriceHistory(depth=4, max_tickers=10)
+        history.append(build_store({'BTC': 100, 'ETH': 10}), timestamp=1)
+        history.append(build_store({'BTC': 110, 'ETH': 10}), timestamp=2, fetched=[True, False])
+        self.assertEqual([100, 110], list(history.samples('BTC')[1]))
+        # the copy of ETH kept from the first refresh is not a new sample
+        self.assertEqual([1], list(history.samples('ETH')[0]))
+
+    def test_memory_mapped_file_survives_restart(self):
+        with tempfile.TemporaryDirectory() as history_dir:
+            path = os.path.join(history_dir, 'history.npy')
+            history = PriceHistory(depth=4, max_tickers=10, path=path)
+            history.append(build_store({'BTC': 100, 'ETH': 10}), timestamp=1)
+            history.append(build_store({'BTC': 101, 'ETH': 11}), timestamp=2)
+            del history
+            history = PriceHistory(depth=4, max_tickers=10, path=path)
+            self.assertEqual([100, 101], list(history.samples('BTC')[1]))
+            history.append(build_store({'ETH': 12}), timestamp=3)
+            self.assertEqual([10, 11, 12], list(history.samples('ETH')[1]))
+            del history
+            # a different depth does not match the file layout, so the history starts over
+            history = PriceHistory(depth=8, max_tickers=10, path=path)
+            self.assertEqual(0, len(history.samples('BTC')[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import asyncio
+import time
+import unittest
+
+from cryptoshared import price_providers
+from cryptoshared.market_row import MarketRow
+from cryptoshared.price_providers import PriceProvider, ProviderSet
+
+
+def build_row(symbol, usd_price, exchange_name='test', market_cap=None):
+    return MarketRow(exchange_name, symbol.lower(), symbol.title(), symbol, usd_price, market_cap, None, None, None,
+                     None, None, None)
+
+
+class StandInProvider(PriceProvider):
+    def __init__(self, name, rows, delay=0, error=None):
+        self.name = name
+        self.rows = rows
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def fetch(self, report=None):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        if report is not None:
+            report.requests += 1
+        return self.rows, []
+
+
+class CountingReport(object):
+    def __init__(self):
+        self.requests = 0
+        self.skipped = False
+
+    def merge(self, other):
+        self.requests += other.requests
+
+
+class ProviderSetTests(unittest.TestCase):
+    def build(self, providers, **options):
+        provider_set = ProviderSet(providers, **options)
+        self.addCleanup(provider_set.close)
+        return provider_set
+
+    def test_slow_provider_is_hedged(self):
+        primary = StandInProvider('primary', [build_row('BTC', 10000, 'primary')], delay=0.5)
+        backup = StandInProvider('backup', [build_row('BTC', 10001, 'backup')])
+        provider_set = self.build([primary, backup], hedge_delay=0.05)
+        start = time.monotonic()
+        rows, _ = provider_set.fetch()
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual('backup', rows[0].exchange_name)
+        self.assertEqual(1, provider_set.stats()['backup']['wins'])
+
+    def test_failed_provider_is_hedged_right_away(self):
+        primary = StandInProvider('primary', [], error=ConnectionError('down'))
+        backup = StandInProvider('backup', [build_row('BTC', 10001)])
+        provider_set = self.build([primary, backup], hedge_delay=10)
+        start = time.monotonic()
+        rows, _ = provider_set.fetch()
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(10001, rows[0].usd_price)
+        stats = provider_set.stats()['primary']
+        self.assertEqual((1, 1, 'down'), (stats['calls'], stats['failures'], stats['last_error']))
+
+    def test_fast_primary_is_not_hedged(self):
+        primary = StandInProvider('primary', [build_row('BTC', 10000)])
+        backup = StandInProvider('backup', [build_row('BTC', 10001)])
+        report = CountingReport()
+        rows, _ = self.build([primary, backup], report_factory=CountingReport).fetch(report)
+        self.assertEqual(10000, rows[0].usd_price)
+        self.assertEqual(0, backup.calls)
+        self.assertEqual(1, report.requests)
+
+    def test_busy_provider_is_skipped(self):
+        primary = StandInProvider('primary', [build_row('BTC', 10000)], delay=0.4)
+        provider_set = self.build([primary], timeout=0.1)
+        report = CountingReport()
+        self.assertEqual(([], []), provider_set.fetch(report))
+        self.assertFalse(report.skipped)
+        # the first call is still running
+        report = CountingReport()
+        self.assertEqual(([], []), provider_set.fetch(report))
+        self.assertTrue(report.skipped)
+        self.assertEqual(1, primary.calls)
+        self.assertEqual(1, provider_set.stats()['primary']['skipped'])
+
+    def test_median(self):
+        providers = [StandInProvider('a', [build_row('BTC', 100, 'a', 5), build_row('ETH', 10, 'a')]),
+                     StandInProvider('b', [build_row('BTC', 101, 'b'), build_row('SOL', 1, 'b')]),
+                     StandInProvider('c', [build_row('BTC', 130, 'c', 7), build_row('ETH', 12, 'c')])]
+        rows, _ = self.build(providers, policy=price_providers.MEDIAN).fetch()
+        self.assertEqual(['BTC', 'ETH', 'SOL'], [row.ticker_symbol for row in rows])
+        self.assertEqual(('a', 101, 6), (rows[0].exchange_name, rows[0].usd_price, rows[0].market_cap))
+        self.assertEqual(11, rows[1].usd_price)
+        self.assertIsNone(rows[1].market_cap)
+        self.assertEqual(1, rows[2].usd_price)
+
+    def test_async_fetch_cancels_the_losers(self):
+        class AsyncProvider(StandInProvider):
+            async def fetch_async(self, report=None):
+                self.calls += 1
+                try:
+                    await asyncio.sleep(self.delay)
+                except asyncio.CancelledError:
+                    self.cancelled = True
+                    raise
+                return self.rows, []
+
+        primary = AsyncProvider('primary', [build_row('BTC', 10000)], delay=5)
+        backup = AsyncProvider('backup', [build_row('BTC', 10001)])
+        provider_set = self.build([primary, backup], hedge_delay=0.05)
+        rows, _ = asyncio.run(provider_set.fetch_async())
+        self.assertEqual(10001, rows[0].usd_price)
+        self.assertTrue(primary.cancelled)
+        self.assertEqual(0, provider_set.stats()['primary']['calls'])
+
+    def test_async_loser_on_a_thread_stays_busy_until_it_returns(self):
+        primary = StandInProvider('primary', [build_row('BTC', 10000)], delay=0.3)
+        backup = StandInProvider('backup', [build_row('BTC', 10001)])
+        provider_set = self.build([primary, backup], hedge_delay=0.05)
+        rows, _ = asyncio.run(provider_set.fetch_async())
+        self.assertEqual(10001, rows[0].usd_price)
+        # the next refresh does not start a second call while the first one still runs
+        rows, _ = asyncio.run(provider_set.fetch_async())
+        self.assertEqual(1, primary.calls)
+        self.assertEqual(1, provider_set.stats()['primary']['skipped'])
+        time.sleep(0.4)
+        self.assertEqual(1, provider_set.stats()['primary']['calls'])
+        self.assertEqual(set(), provider_set._busy)
+
+    def test_late_reports(self):
+        late_reports = []
+        primary = StandInProvider('primary', [build_row('BTC', 10000)], delay=0.3)
+        backup = StandInProvider('backup', [build_row('BTC', 10001)])
+        provider_set = self.build([primary, backup], hedge_delay=0.05, report_factory=CountingReport,
+                                  on_late_report=late_reports.append)
+        for fetch in (provider_set.fetch, lambda report: asyncio.run(provider_set.fetch_async(report))):
+            report = CountingReport()
+            rows, _ = fetch(report)
+            self.assertEqual(10001, rows[0].usd_price)
+            self.assertEqual(1, report.requests)
+            # the primary's request is reported once it returns
+            time.sleep(0.4)
+            self.assertEqual([1], [late_report.requests for late_report in late_reports])
+            late_reports.clear()
+
+
+class MergeRowsTests(unittest.TestCase):
+    def test_precedence(self):
+        rows = price_providers.merge_rows([[build_row('BTC', 100, 'a')],
+                                           [build_row('ETH', 10, 'b'), build_row('BTC', 90, 'b')]])
+        self.assertEqual([('BTC', 100), ('ETH', 10)], [(row.ticker_symbol, row.usd_price) for row in rows])
+
+
+if __name__ == '__main__':
+    unittest.main()
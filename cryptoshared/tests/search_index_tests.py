@@ -0,0 +1,58 @@
+import unittest
+from cryptoshared.ticker_result import TickerResult
+from cryptoshared.ticker_store import TickerStore
+from cryptoshared.search_index import SearchIndex
+
+
+def build_store(coins):
+    tickers = []
+    for currency_id, symbol, name in coins:
+        ticker = TickerResult()
+        ticker.currency_id = currency_id
+        ticker.ticker_symbol = symbol
+        ticker.currency_name = name
+        ticker.usd_price = 1.0
+        tickers.append(ticker)
+    return TickerStore.from_tickers(tickers)
+
+
+class SearchIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.store = build_store([('bitcoin', 'BTC', 'Bitcoin'), ('ethereum', 'ETH', 'Ethereum'),
+                                  ('bitcoin-cash', 'BCH', 'Bitcoin Cash'), ('wrapped-bitcoin', 'WBTC', 'Wrapped Bitcoin'),
+                                  ('binancecoin', 'BNB', 'BNB')])
+        self.shadowed = build_store([('bitcoin-fork', 'BTC', 'Bitcoin Fork')])
+        self.index = SearchIndex([self.store, self.shadowed])
+
+    def symbols(self, tickers):
+        return [ticker.ticker_symbol for ticker in tickers]
+
+    def test_lookup(self):
+        self.assertEqual('bitcoin', self.index.lookup('btc').currency_id)
+        self.assertEqual('bitcoin-fork', self.index.lookup('Bitcoin-Fork').currency_id)
+        self.assertEqual('ETH', self.index.lookup(' ethereum ').ticker_symbol)
+        self.assertIsNone(self.index.lookup('bit'))
+
+    def test_complete_in_rank_order(self):
+        self.assertEqual(['BTC', 'BCH', 'WBTC', 'BNB', 'BTC'], self.symbols(self.index.complete('b')))
+        self.assertEqual(['BTC', 'BCH', 'WBTC', 'BTC'], self.symbols(self.index.complete('bit')))
+        self.assertEqual(['BCH'], self.symbols(self.index.complete('bitcoin c')))
+        self.assertEqual(['BTC', 'BCH'], self.symbols(self.index.complete('B', limit=2)))
+        self.assertEqual([], self.index.complete('xyz'))
+
+    def test_max_completions(self):
+        index = SearchIndex([self.store], max_completions=2)
+        self.assertEqual(['BTC', 'BCH'], self.symbols(index.complete('b')))
+
+    def test_suggest_typos(self):
+        self.assertEqual(['BTC', 'ETH', 'BCH'], self.symbols(self.index.suggest('bth')))
+        self.assertEqual(['ETH'], self.symbols(self.index.suggest('etherum')))
+        self.assertEqual(['ETH'], self.symbols(self.index.suggest('ehtereum')))
+        self.assertEqual([], self.index.suggest('qqqqq'))
+
+    def test_suggest_falls_back_to_completions(self):
+        self.assertEqual(['BTC', 'BCH', 'WBTC'], self.symbols(self.index.suggest('bitco')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+from cryptoshared import snapshot_file
+from cryptoshared.snapshot_channel import SnapshotPublisher, SnapshotSubscriber
+from cryptoshared.ticker_result import TickerResult
+from cryptoshared.ticker_snapshot import TickerSnapshot
+
+
+def build_ticker(symbol, usd_price, currency_id=None, change_24h=None):
+    ticker = TickerResult()
+    ticker.ticker_symbol = symbol
+    ticker.currency_name = symbol.title()
+    ticker.currency_id = currency_id
+    ticker.exchange_name = 'CoinGecko'
+    ticker.usd_price = usd_price
+    ticker.percent_change_24h = change_24h
+    return ticker
+
+
+def build_snapshot(version, btc_price=10000):
+    tickers = {'BTC': build_ticker('BTC', btc_price, 'bitcoin', 5), 'ETH': build_ticker('ETH', 500, 'ethereum'),
+               'UNI': build_ticker('UNI', 5, 'uniswap', -2.5)}
+    return TickerSnapshot.from_tickers(tickers, version, fetched_at=1000.5,
+                                       shadowed=[build_ticker('UNI', 0.01, 'unicorn-token')],
+                                       rates={'USD': 1.0, 'EUR': 0.5})
+
+
+class SnapshotFileTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'snapshot.bin')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        snapshot_file.write_snapshot(self.path, build_snapshot(7))
+        snapshot = snapshot_file.read_snapshot(self.path)
+        self.assertEqual(7, snapshot.version)
+        self.assertEqual(1000.5, snapshot.fetched_at)
+        self.assertEqual(['BTC', 'ETH', 'UNI'], [t.ticker_symbol for t in snapshot.tickers()])
+        uni = snapshot.get('UNI')
+        self.assertEqual(5, uni.usd_price)
+        self.assertEqual(-2.5, uni.percent_change_24h)
+        self.assertIsNone(uni.percent_change_1h)
+        self.assertEqual(.0005, uni.btc_price)
+        self.assertEqual('uniswap', uni.currency_id)
+        # shadowed coins are priced against the main BTC row
+        self.assertEqual(0.000001, snapshot.resolve('unicorn-token').btc_price)
+        self.assertEqual(['BTC', 'UNI'], [entry[1] for entry in snapshot.leaderboards.top('24h', count=2)])
+        self.assertEqual(2.5, snapshot.in_currency('eur').get('UNI').usd_price)
+        self.assertEqual(7, snapshot_file.read_version(self.path))
+
+    def test_fetched_rows(self):
+        snapshot_file.write_snapshot(self.path, build_snapshot(1))
+        self.assertIsNone(snapshot_file.read_snapshot(self.path).fetched)
+        snapshot = build_snapshot(2)
+        snapshot_file.write_snapshot(self.path, TickerSnapshot(snapshot.store, 2, shadowed=snapshot.shadowed,
+                                                               fetched=[True, False, True]))
+        self.assertEqual([True, False, True], snapshot_file.read_snapshot(self.path).fetched.tolist())
+
+    def test_arrays_are_read_only(self):
+        snapshot_file.write_snapshot(self.path, build_snapshot(1))
+        snapshot = snapshot_file.read_snapshot(self.path)
+        with self.assertRaises(ValueError):
+            snapshot.store.usd_price[0] = 1
+
+    def test_replaced_file_keeps_old_snapshot_readable(self):
+        snapshot_file.write_snapshot(self.path, build_snapshot(1, btc_price=10000))
+        old = snapshot_file.read_snapshot(self.path)
+        snapshot_file.write_snapshot(self.path, build_snapshot(2, btc_price=20000))
+        self.assertEqual(10000, old.get('BTC').usd_price)
+        self.assertEqual(20000, snapshot_file.read_snapshot(self.path).get('BTC').usd_price)
+        self.assertEqual(['snapshot.bin'], os.listdir(self.directory.name))
+
+    def test_invalid_files(self):
+        for content in (b'', b'not a snapshot file', snapshot_file.MAGIC + b'\xff\xff\x00\x00{'):
+            with open(self.path, 'wb') as f:
+                f.write(content)
+            with self.assertRaises(snapshot_file.InvalidSnapshotFile):
+                snapshot_file.read_snapshot(self.path)
+            self.assertEqual(0, snapshot_file.read_version(self.path))
+        snapshot_file.write_snapshot(self.path, build_snapshot(1))
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 8)
+        with self.assertRaises(snapshot_file.InvalidSnapshotFile):
+            snapshot_file.read_snapshot(self.path)
+        # a flipped bit in a price
+        snapshot_file.write_snapshot(self.path, build_snapshot(1))
+        with open(self.path, 'r+b') as f:
+            f.seek(-8, os.SEEK_END)
+            value = f.read(1)
+            f.seek(-8, os.SEEK_END)
+            f.write(bytes([value[0] ^ 1]))
+        with self.assertRaises(snapshot_file.InvalidSnapshotFile):
+            snapshot_file.read_snapshot(self.path)
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'needs unix sockets')
+class SnapshotChannelTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'snapshot.bin')
+        self.socket_path = os.path.join(self.directory.name, 'snapshot.sock')
+        self.received = []
+        self.received_event = threading.Event()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def on_snapshot(self, snapshot):
+        self.received.append(snapshot.version)
+        self.received_event.set()
+
+    def wait_for(self, version):
+        while not self.received or self.received[-1] < version:
+            self.assertTrue(self.received_event.wait(5))
+            self.received_event.clear()
+
+    def test_worker_starts_from_file_and_follows_publisher(self):
+        publisher = SnapshotPublisher(self.path, self.socket_path).start()
+        publisher.publish(build_snapshot(1))
+        subscriber = SnapshotSubscriber(self.path, self.socket_path, self.on_snapshot, reconnect_delay=0.01).start()
+        try:
+            # loaded before start() returns, without waiting for a notification
+            self.assertEqual([1], self.received)
+            while publisher.subscribers() == 0:
+                threading.Event().wait(0.01)
+            publisher.publish(build_snapshot(2))
+            self.wait_for(2)
+            self.assertEqual([1, 2], self.received)
+        finally:
+            subscriber.close()
+            publisher.close()
+
+    def test_worker_reconnects_to_restarted_fetcher(self):
+        subscriber = SnapshotSubscriber(self.path, self.socket_path, self.on_snapshot, reconnect_delay=0.01).start()
+        try:
+            # no fetcher and no file yet
+            self.assertEqual([], self.received)
+            publisher = SnapshotPublisher(self.path, self.socket_path).start()
+            publisher.publish(build_snapshot(1))
+            self.wait_for(1)
+            publisher.close()
+            # published while the worker was not connected, picked up once it is
+            snapshot_file.write_snapshot(self.path, build_snapshot(2))
+            publisher = SnapshotPublisher(self.path, self.socket_path).start()
+            self.wait_for(2)
+            self.assertEqual([1, 2], self.received)
+            publisher.close()
+        finally:
+            subscriber.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
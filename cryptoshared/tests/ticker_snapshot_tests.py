@@ -0,0 +1,117 @@
+import unittest
+from cryptoshared.market_row import MarketRow
+from cryptoshared.ticker_result import TickerResult
+from cryptoshared.ticker_snapshot import TickerSnapshot, EMPTY_SNAPSHOT
+
+
+def build_ticker(symbol, usd_price, change_24h=None):
+    ticker = TickerResult()
+    ticker.ticker_symbol = symbol
+    ticker.currency_name = symbol.title()
+    ticker.usd_price = usd_price
+    ticker.percent_change_24h = change_24h
+    return ticker
+
+
+def build_row(symbol, usd_price, change_24h=None):
+    return MarketRow('CoinGecko', symbol.lower(), symbol.title(), symbol, usd_price, None, None, None, change_24h,
+                     None, None, None)
+
+
+class TickerSnapshotTests(unittest.TestCase):
+    def test_cross_prices(self):
+        tickers = {'BTC': build_ticker('BTC', 10000, 0), 'ETH': build_ticker('ETH', 500, 0),
+                   'LTC': build_ticker('LTC', 50, 100)}
+        snapshot = TickerSnapshot.from_tickers(tickers, version=3)
+        ltc = snapshot.get('LTC')
+        self.assertEqual(.005, ltc.btc_price)
+        self.assertEqual(.1, ltc.eth_price)
+        self.assertAlmostEqual(100, ltc.btc_percent_change_24h)
+        self.assertEqual(3, snapshot.version)
+        self.assertEqual(['BTC', 'ETH', 'LTC'], [t.ticker_symbol for t in snapshot.tickers()])
+
+    def test_missing_change_has_no_relative_change(self):
+        snapshot = TickerSnapshot.from_tickers({'BTC': build_ticker('BTC', 10000, 5), 'LTC': build_ticker('LTC', 50)})
+        self.assertIsNone(snapshot.get('LTC').btc_percent_change_24h)
+        self.assertIsNone(snapshot.get('LTC').eth_price)
+        self.assertFalse(snapshot.has_base_pairs())
+
+    def test_immutable(self):
+        tickers = {'BTC': build_ticker('BTC', 10000)}
+        snapshot = TickerSnapshot.from_tickers(tickers)
+        tickers['ETH'] = build_ticker('ETH', 500)
+        self.assertNotIn('ETH', snapshot)
+        with self.assertRaises(AttributeError):
+            snapshot.version = 2
+        snapshot.get('BTC').usd_price = 1
+        self.assertEqual(10000, snapshot.get('BTC').usd_price)
+
+    def test_resolve_shadowed_ticker_by_id(self):
+        btc = build_ticker('BTC', 10000, 0)
+        btc.currency_id = 'bitcoin'
+        fork = build_ticker('BTC', 5, 0)
+        fork.currency_id = 'bitcoin-fork'
+        snapshot = TickerSnapshot.from_tickers({'BTC': btc}, shadowed=[fork])
+        self.assertEqual('bitcoin', snapshot.resolve('btc').currency_id)
+        self.assertEqual('bitcoin', snapshot.resolve('bitcoin').currency_id)
+        self.assertEqual(.0005, snapshot.resolve('bitcoin-fork').btc_price)
+        self.assertEqual(1, len(snapshot))
+        self.assertIsNone(snapshot.resolve('bitcoin-cash'))
+
+    def test_changed_symbols(self):
+        rows = [build_row('BTC', 10000, 1), build_row('ETH', 500, 2), build_row('LTC', 50)]
+        first = TickerSnapshot.from_rows(rows, version=1)
+        self.assertIsNone(first.changed)
+        second = TickerSnapshot.from_rows([rows[0], build_row('ETH', 510, 2), rows[2]], version=2, previous=first)
+        # LTC has no 24h change, which is NaN in the store and still equal to itself
+        self.assertEqual({'ETH'}, second.changed)
+        third = TickerSnapshot.from_rows([rows[0], build_row('ETH', 510, 2), build_row('DOGE', 0.1)], version=3,
+                                         previous=second)
+        self.assertEqual({'DOGE', 'LTC'}, third.changed)
+
+    def test_unchanged_parts_are_reused(self):
+        rows = [build_row('BTC', 10000, 1), build_row('ETH', 500, 2)] + \
+            [build_row('C{}'.format(index), 1, 0) for index in range(600)]
+        first = TickerSnapshot.from_rows(rows)
+        first.search_index
+        rows[550] = build_row('C548', 2, 0)
+        second = TickerSnapshot.from_rows(rows, previous=first)
+        # only the top 500 feed the leaderboards, and no coin was added or moved so the search index is rebound
+        self.assertIs(first.leaderboards, second.leaderboards)
+        self.assertEqual(2, second.search_index.lookup('c548').usd_price)
+        rows[2] = build_row('C0', 5, 0)
+        third = TickerSnapshot.from_rows(rows, previous=second)
+        self.assertIsNot(second.leaderboards, third.leaderboards)
+        self.assertEqual(5, third.search_index.lookup('c0').usd_price)
+        rows.append(build_row('NEW', 1))
+        fourth = TickerSnapshot.from_rows(rows, previous=third)
+        self.assertIsNone(fourth._search_index)
+        self.assertEqual('NEW', fourth.search_index.lookup('new').ticker_symbol)
+
+    def test_in_currency(self):
+        btc = build_ticker('BTC', 10000, 0)
+        fork = build_ticker('BTC', 5, 0)
+        fork.currency_id = 'bitcoin-fork'
+        tickers = {'BTC': btc, 'ETH': build_ticker('ETH', 500, 0), 'LTC': build_ticker('LTC', 50, 10)}
+        snapshot = TickerSnapshot.from_tickers(tickers, version=4, shadowed=[fork], rates={'USD': 1.0, 'EUR': 0.9})
+        euro = snapshot.in_currency('eur')
+        self.assertEqual('EUR', euro.currency)
+        self.assertEqual(45, euro.get('LTC').usd_price)
+        self.assertEqual(4.5, euro.resolve('bitcoin-fork').usd_price)
+        # percent changes and the BTC and ETH pairs do not depend on the quote currency
+        self.assertEqual(10, euro.get('LTC').percent_change_24h)
+        self.assertEqual(.005, euro.get('LTC').btc_price)
+        self.assertIs(snapshot.leaderboards, euro.leaderboards)
+        self.assertEqual(4, euro.version)
+        self.assertIs(euro, snapshot.in_currency('EUR'))
+        self.assertIs(snapshot, euro.in_currency('usd'))
+        self.assertIsNone(snapshot.in_currency('JPY'))
+        self.assertEqual(50, snapshot.get('LTC').usd_price)
+
+    def test_empty_snapshot(self):
+        self.assertEqual(0, len(EMPTY_SNAPSHOT))
+        self.assertNotIn('BTC', EMPTY_SNAPSHOT)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import gc
+import unittest
+
+import numpy as np
+
+from cryptoshared import crypto_helpers, market_row
+from cryptoshared.ticker_result import TickerResult
+from cryptoshared.ticker_store import TickerStore
+
+
+def build_ticker(symbol, usd_price, changes):
+    ticker = TickerResult()
+    ticker.ticker_symbol = symbol
+    ticker.currency_name = symbol.title()
+    ticker.usd_price = usd_price
+    ticker.percent_change_1h, ticker.percent_change_24h, ticker.percent_change_7d, ticker.percent_change_30d, \
+        ticker.percent_change_1y = changes
+    return ticker
+
+
+class TickerStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.store = TickerStore.from_tickers([build_ticker('BTC', 10000, (1, 2, 3, 4, 5)),
+                                               build_ticker('ETH', 500, (-1, -2, None, 10, 20)),
+                                               build_ticker('LTC', 50, (5, 10, 15, None, -100))])
+
+    def test_row_round_trip(self):
+        ltc = self.store.ticker(self.store.row('LTC'))
+        self.assertEqual('LTC', ltc.ticker_symbol)
+        self.assertEqual(50, ltc.usd_price)
+        self.assertEqual(15, ltc.percent_change_7d)
+        self.assertIsNone(ltc.percent_change_30d)
+        self.assertIsNone(ltc.market_cap)
+        self.assertEqual(.005, ltc.btc_price)
+        self.assertEqual(.1, ltc.eth_price)
+        self.assertIsNone(self.store.row('DOGE'))
+
+    def test_relative_changes_match_scalar_math(self):
+        ltc, eth = self.store.row('LTC'), self.store.row('ETH')
+        expected = crypto_helpers.get_relative_percent_change(50, 10, 500, -2)
+        self.assertAlmostEqual(expected, self.store.ticker(ltc).eth_percent_change_24h)
+        changes = self.store.relative_percent_changes(ltc, eth)
+        self.assertAlmostEqual(crypto_helpers.get_relative_percent_change(50, 5, 500, -1), changes[0])
+        self.assertAlmostEqual(expected, changes[1])
+        # missing on either side, or a -100% change with no start price, is reported as not available
+        self.assertIsNone(changes[2])
+        self.assertIsNone(changes[3])
+        self.assertIsNone(changes[4])
+
+    def test_relative_changes_between_non_base_tickers(self):
+        store = TickerStore.from_tickers([build_ticker('LTC', 50, (5, 10, 15, 20, 25)),
+                                          build_ticker('DOGE', .01, (1, 2, 3, 4, 5))])
+        changes = store.relative_percent_changes(store.row('LTC'), store.row('DOGE'))
+        self.assertAlmostEqual(crypto_helpers.get_relative_percent_change(50, 20, .01, 4), changes[3])
+
+    def test_built_from_previous_store(self):
+        rows = [market_row.from_ticker(self.store.ticker(row)) for row in range(len(self.store))]
+        # LTC moved, DOGE is new, ETH went from the second to the third row. BTC is parsed again
+        rows = [rows[0]._replace(currency_name=''.join('Btc')), rows[2]._replace(usd_price=60), rows[1],
+                rows[0]._replace(ticker_symbol='DOGE')]
+        store = TickerStore.from_rows(rows, previous=self.store)
+        self.assertIsNot(rows[0].currency_name, store.names[0])
+        self.assertIs(self.store.names[0], store.names[0])
+        self.assertEqual(['BTC', 'LTC', 'ETH', 'DOGE'], store.symbols)
+        self.assertEqual(60, store.ticker(store.row('LTC')).usd_price)
+        self.assertEqual([1, 2, 3], store.diff(self.store)[0].tolist())
+        # the diff worked out while building matches a diff of two unrelated stores
+        unrelated = TickerStore.from_rows(rows)
+        self.assertEqual([1, 2, 3], unrelated.diff(self.store)[0].tolist())
+        self.assertEqual([], unrelated.diff(self.store)[1])
+        self.assertEqual(['DOGE'], self.store.diff(store)[1])
+
+    def test_unchanged_store_shares_everything(self):
+        rows = [market_row.from_ticker(self.store.ticker(row)) for row in range(len(self.store))]
+        store = TickerStore.from_rows(rows, previous=self.store)
+        self.assertIs(self.store.symbols, store.symbols)
+        self.assertIs(self.store.index, store.index)
+        self.assertIs(self.store.percent_change, store.percent_change)
+        self.assertEqual(([], []), (store.diff(self.store)[0].tolist(), store.diff(self.store)[1]))
+        self.assertIsNone(store.converted(2)._diff)
+
+    def test_rows_kept_from_the_previous_store(self):
+        rows = [market_row.from_ticker(self.store.ticker(row)) for row in range(len(self.store))]
+        first = TickerStore.from_rows(rows)
+        second = TickerStore.from_rows([rows[0]._replace(usd_price=11000), rows[1], rows[2]], previous=first)
+        self.assertEqual([11000, 500, 50], second.usd_price.tolist())
+        np.testing.assert_array_equal(first.percent_change, second.percent_change)
+        self.assertEqual(['BTC', 'ETH', 'LTC'], second.symbols)
+        self.assertEqual([0], second.diff(first)[0].tolist())
+        # the diff does not keep the previous store alive
+        del first
+        gc.collect()
+        self.assertIsNone(second._diff[0]())
+
+
+if __name__ == '__main__':
+    unittest.main()
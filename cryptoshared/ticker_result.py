@@ -1,4 +1,9 @@
 class TickerResult:
+    __slots__ = ('exchange_name', 'currency_name', 'currency_id', 'ticker_symbol', 'eth_price', 'btc_price',
+                 'usd_price', 'market_cap', 'volume_24h', 'percent_change_24h', 'percent_change_1h',
+                 'percent_change_7d', 'percent_change_30d', 'percent_change_1y', 'btc_percent_change_24h',
+                 'eth_percent_change_24h')
+
     def __init__(self):
         self.exchange_name = None
         self.currency_name = None
@@ -14,3 +19,5 @@ class TickerResult:
         self.percent_change_7d = None
         self.percent_change_30d = None
         self.percent_change_1y = None
+        self.btc_percent_change_24h = None
+        self.eth_percent_change_24h = None
@@ -0,0 +1,151 @@
+import threading
+import time
+
+import numpy as np
+
+from cryptoshared.leaderboards import Leaderboards, UNIVERSE_SIZES
+from cryptoshared.search_index import SearchIndex
+from cryptoshared.ticker_store import TickerStore
+
+USD = 'USD'
+
+
+class TickerSnapshot:
+    # Everything the bot knows about the market after a single refresh. A snapshot is built once, before it is
+    # published, and never modified afterwards: the refresh thread swaps in a new instance with one reference
+    # assignment, and handlers read the current instance once per request so they never mix two refresh cycles.
+    # Coins whose symbol belongs to a higher ranked coin are kept in the separate shadowed store: they are left out
+    # of the leaderboards and the symbol lookups, but can still be found through search_index by name or id.
+    # search_index is only built on first use, most requests resolve through the symbol index of the store.
+    # Built with the previous snapshot, it also knows the symbols that changed since then (changed, None when there
+    # is no previous snapshot), and reuses the leaderboards and the search index when their inputs did not change.
+    # fetched (a bool per row of store) tells which coins the refresh actually fetched, the others are copies kept
+    # from earlier refreshes; None when every coin was fetched.
+    # Prices are in USD. rates ({currency code: units per USD}) are fetched with the snapshot, in_currency() converts
+    # it to one of those currencies.
+    __slots__ = ('store', 'shadowed', 'leaderboards', 'version', 'fetched_at', 'changed', 'rates', 'currency',
+                 'fetched', '_search_index', '_quotes', '_source', '_lock')
+
+    def __init__(self, store, version=0, fetched_at=None, shadowed=None, previous=None, rates=None, fetched=None):
+        shadowed = TickerStore.from_rows([]) if shadowed is None else shadowed
+        changed = None
+        leaderboards = None
+        search_index = None
+        if previous is not None:
+            changed_rows, removed = store.diff(previous.store)
+            shadowed_rows, shadowed_removed = shadowed.diff(previous.shadowed)
+            changed = frozenset([store.symbols[row] for row in changed_rows] + removed +
+                                [shadowed.symbols[row] for row in shadowed_rows] + shadowed_removed)
+            universe = max(UNIVERSE_SIZES)
+            if min(len(store), universe) == min(len(previous.store), universe) and \
+                    not (changed_rows < universe).any():
+                leaderboards = previous.leaderboards
+            if previous._search_index is not None and store.same_identities(previous.store) and \
+                    shadowed.same_identities(previous.shadowed):
+                search_index = previous._search_index.rebind([store, shadowed])
+        object.__setattr__(self, 'store', store)
+        object.__setattr__(self, 'shadowed', shadowed)
+        object.__setattr__(self, 'leaderboards', Leaderboards(store) if leaderboards is None else leaderboards)
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'fetched_at', time.time() if fetched_at is None else fetched_at)
+        object.__setattr__(self, 'changed', changed)
+        object.__setattr__(self, 'rates', {} if rates is None else rates)
+        object.__setattr__(self, 'currency', USD)
+        object.__setattr__(self, 'fetched', None if fetched is None else np.asarray(fetched, dtype=bool))
+        object.__setattr__(self, '_search_index', search_index)
+        object.__setattr__(self, '_quotes', {})
+        object.__setattr__(self, '_source', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    @classmethod
+    def from_rows(cls, rows, version=0, fetched_at=None, shadowed=(), previous=None, rates=None, fetched=None):
+        # rows and shadowed are lists of market_row.MarketRow, fetched a bool per row
+        store = TickerStore.from_rows(rows, previous=None if previous is None else previous.store)
+        shadowed = TickerStore.from_rows(shadowed, base_store=store,
+                                         previous=None if previous is None else previous.shadowed)
+        return cls(store, version, fetched_at, shadowed, previous, rates, fetched)
+
+    @classmethod
+    def from_tickers(cls, tickers_by_symbol, version=0, fetched_at=None, shadowed=(), previous=None, rates=None):
+        store = TickerStore.from_tickers(tickers_by_symbol.values())
+        return cls(store, version, fetched_at, TickerStore.from_tickers(shadowed, base_store=store), previous,
+                   rates)
+
+    @property
+    def search_index(self):
+        with self._lock:
+            if self._search_index is None:
+                if self._source is not None:
+                    search_index = self._source.search_index.rebind([self.store, self.shadowed])
+                else:
+                    search_index = SearchIndex([self.store, self.shadowed])
+                object.__setattr__(self, '_search_index', search_index)
+            return self._search_index
+
+    def in_currency(self, currency):
+        # this snapshot with prices, market caps and volumes in currency instead of USD (the usd_* values of its
+        # tickers are then in currency), None when there is no rate for it. every currency is converted once per
+        # snapshot in a vectorized pass, whatever the number of requests.
+        source = self if self._source is None else self._source
+        currency = currency.upper()
+        if currency == source.currency:
+            return source
+        rate = source.rates.get(currency)
+        if rate is None:
+            return None
+        with source._lock:
+            quoted = source._quotes.get(currency)
+            if quoted is None:
+                quoted = object.__new__(TickerSnapshot)
+                store = source.store.converted(rate)
+                values = {'store': store, 'shadowed': source.shadowed.converted(rate),
+                          'leaderboards': source.leaderboards, 'version': source.version,
+                          'fetched_at': source.fetched_at, 'changed': source.changed, 'rates': source.rates,
+                          'currency': currency, 'fetched': source.fetched, '_search_index': None, '_quotes': None,
+                          '_source': source, '_lock': threading.Lock()}
+                for name, value in values.items():
+                    object.__setattr__(quoted, name, value)
+                source._quotes[currency] = quoted
+            return quoted
+
+    def __setattr__(self, key, value):
+        raise AttributeError('TickerSnapshot is immutable')
+
+    def __delattr__(self, key):
+        raise AttributeError('TickerSnapshot is immutable')
+
+    def __contains__(self, ticker_symbol):
+        return ticker_symbol in self.store
+
+    def __len__(self):
+        return len(self.store)
+
+    def get(self, ticker_symbol):
+        # returns a new TickerResult for the row, so callers can never write into the snapshot
+        row = self.store.row(ticker_symbol)
+        if row is None:
+            return None
+        return self.store.ticker(row)
+
+    def resolve(self, query):
+        # ticker for a ticker symbol or CoinGecko id, None when neither matches
+        row = self.store.row(query.strip().upper())
+        if row is not None:
+            return self.store.ticker(row)
+        return self.search_index.lookup(query)
+
+    def tickers(self, limit=None):
+        count = len(self.store) if limit is None else min(limit, len(self.store))
+        return [self.store.ticker(row) for row in range(count)]
+
+    def relative_percent_changes(self, ticker_symbol_a, ticker_symbol_b):
+        return self.store.relative_percent_changes(self.store.row(ticker_symbol_a), self.store.row(ticker_symbol_b))
+
+    def has_base_pairs(self):
+        return 'BTC' in self.store and 'ETH' in self.store
+
+    def age(self, now=None):
+        return (time.time() if now is None else now) - self.fetched_at
+
+
+EMPTY_SNAPSHOT = TickerSnapshot.from_tickers({}, version=0, fetched_at=0)
@@ -0,0 +1,257 @@
+import copy
+import math
+import operator
+import weakref
+
+import numpy as np
+
+from cryptoshared import crypto_helpers, market_row
+from cryptoshared.market_row import MarketRow, NUMERIC_START
+from cryptoshared.ticker_result import TickerResult
+
+# column order of the percent change arrays
+CHANGE_WINDOWS = ('1h', '24h', '7d', '30d', '1y')
+CHANGE_ATTRIBUTES = ('percent_change_1h', 'percent_change_24h', 'percent_change_7d', 'percent_change_30d',
+                     'percent_change_1y')
+BASE_SYMBOLS = ('BTC', 'ETH')
+# the string columns that tell which coin a row is
+IDENTITY_COLUMNS = ('exchange_names', 'symbols', 'names', 'currency_ids')
+
+
+class TickerStore:
+    # Columnar storage for one refresh: a float64 array per numeric field (NaN when CoinGecko had no value) and a
+    # symbol -> row index. Rows keep the CoinGecko ranking order. Prices and percent changes relative to BTC and ETH
+    # are computed for every row and window in one vectorized pass when the store is built, against the BTC and ETH
+    # rows of base_store when one is given. A store built from the previous refresh's store copies the rows that are
+    # the very same MarketRow objects at the same position instead of converting them again, e.g. the pages
+    # page_tiers.PageTiers did not fetch, and shares its strings and whatever did not change at all.
+    __slots__ = ('exchange_names', 'symbols', 'names', 'currency_ids', 'index', 'usd_price', 'market_cap',
+                 'volume_24h', 'percent_change', 'base_price', 'base_percent_change', 'rows', '_diff',
+                 '__weakref__')
+
+    def __init__(self, exchange_names, symbols, names, currency_ids, usd_price, market_cap, volume_24h,
+                 percent_change, base_store=None, index=None):
+        self.exchange_names = exchange_names
+        self.symbols = symbols
+        self.names = names
+        self.currency_ids = currency_ids
+        self.index = {symbol: row for row, symbol in enumerate(symbols)} if index is None else index
+        self.usd_price = usd_price
+        self.market_cap = market_cap
+        self.volume_24h = volume_24h
+        self.percent_change = percent_change
+        # the market_row.MarketRows of a store built by from_rows()
+        self.rows = None
+        # (weak reference to the previous store, diff() against it) when built from the previous store. the reference
+        # is weak so stores do not keep every store before them alive
+        self._diff = None
+        # {base symbol: price array} and {base symbol: (rows x windows) relative change array}
+        self.base_price = {}
+        self.base_percent_change = {}
+        base_store = self if base_store is None else base_store
+        for base_symbol in BASE_SYMBOLS:
+            base_row = base_store.index.get(base_symbol)
+            if base_row is not None:
+                base_usd_price = base_store.usd_price[base_row]
+                self.base_price[base_symbol] = usd_price / base_usd_price
+                self.base_percent_change[base_symbol] = _get_relative_percent_changes(
+                    usd_price[:, np.newaxis], percent_change, base_usd_price, base_store.percent_change[base_row])
+
+    @classmethod
+    def from_rows(cls, rows, base_store=None, previous=None):
+        # rows are market_row.MarketRow tuples in ranking order. the numeric fields are converted in one pass, None
+        # becomes NaN. previous is the store of the refresh before, whose unchanged parts are reused
+        rows = list(rows)
+        kept = _get_kept_rows(rows, previous)
+        if kept.any():
+            strings, arrays = _copy_rows(rows, kept, previous)
+        else:
+            strings, arrays = _convert_rows(rows)
+        if previous is None:
+            store = cls(*strings, *arrays, base_store)
+        else:
+            strings = [_share_strings(column, getattr(previous, name))
+                       for column, name in zip(strings, IDENTITY_COLUMNS)]
+            # the kept rows are the same as before
+            changed, equal_arrays = _compare(strings, arrays, previous, np.flatnonzero(~kept))
+            arrays = [previous_array if equal else array
+                      for array, previous_array, equal in zip(arrays, previous._arrays(), equal_arrays)]
+            store = cls(*strings, *arrays, base_store, previous.index if strings[1] is previous.symbols else None)
+            # the diff against previous is a by-product of the build
+            store._diff = (weakref.ref(previous), (np.flatnonzero(changed), store._removed(previous)))
+        store.rows = rows
+        return store
+
+    @classmethod
+    def from_tickers(cls, tickers, base_store=None):
+        return cls.from_rows([market_row.from_ticker(ticker) for ticker in tickers], base_store)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, ticker_symbol):
+        return ticker_symbol in self.index
+
+    def row(self, ticker_symbol):
+        return self.index.get(ticker_symbol)
+
+    def ticker(self, row):
+        ticker = TickerResult()
+        ticker.exchange_name = self.exchange_names[row]
+        ticker.currency_name = self.names[row]
+        ticker.currency_id = self.currency_ids[row]
+        ticker.ticker_symbol = self.symbols[row]
+        ticker.usd_price = _to_optional(self.usd_price[row])
+        ticker.market_cap = _to_optional(self.market_cap[row])
+        ticker.volume_24h = _to_optional(self.volume_24h[row])
+        for column, attribute in enumerate(CHANGE_ATTRIBUTES):
+            setattr(ticker, attribute, _to_optional(self.percent_change[row, column]))
+        if 'BTC' in self.base_price:
+            ticker.btc_price = _to_optional(self.base_price['BTC'][row])
+            ticker.btc_percent_change_24h = _to_optional(self.base_percent_change['BTC'][row, 1])
+        if 'ETH' in self.base_price:
+            ticker.eth_price = _to_optional(self.base_price['ETH'][row])
+            ticker.eth_percent_change_24h = _to_optional(self.base_percent_change['ETH'][row, 1])
+        return ticker
+
+    def converted(self, rate):
+        # the same coins with prices, market caps and volumes multiplied by rate, e.g. euros per USD, in one
+        # vectorized pass. percent changes and the BTC and ETH pairs do not depend on the quote currency and are shared
+        store = copy.copy(self)
+        store.usd_price = self.usd_price * rate
+        store.market_cap = self.market_cap * rate
+        store.volume_24h = self.volume_24h * rate
+        store.rows = None
+        store._diff = None
+        return store
+
+    def diff(self, previous):
+        # (rows that are new, moved or have different values than in the previous store, symbols of previous that
+        # are gone). rows are compared position by position, a coin that moved in the ranking counts as changed.
+        if self._diff is not None and self._diff[0]() is previous:
+            return self._diff[1]
+        changed, _ = _compare([getattr(self, name) for name in IDENTITY_COLUMNS], self._arrays(), previous,
+                              np.arange(min(len(self), len(previous))))
+        return np.flatnonzero(changed), self._removed(previous)
+
+    def same_identities(self, other):
+        # same coins in the same order, only the numbers may differ
+        return self.symbols == other.symbols and self.currency_ids == other.currency_ids and \
+            self.names == other.names
+
+    def relative_percent_changes(self, row_a, row_b):
+        # percent change of ticker a priced in ticker b, for every window. None where either change is missing.
+        base_symbol = self.symbols[row_b]
+        if base_symbol in self.base_percent_change:
+            changes = self.base_percent_change[base_symbol][row_a]
+        else:
+            changes = _get_relative_percent_changes(self.usd_price[row_a], self.percent_change[row_a],
+                                                    self.usd_price[row_b], self.percent_change[row_b])
+        return [_to_optional(change) for change in changes]
+
+    def _removed(self, previous):
+        # symbols of previous that are gone
+        if self.index is previous.index:
+            return []
+        return [symbol for symbol in previous.symbols if symbol not in self.index]
+
+    def _arrays(self):
+        return self.usd_price, self.market_cap, self.volume_24h, self.percent_change
+
+
+def _get_relative_percent_changes(price_a, change_a, price_b, change_b):
+    # same math as crypto_helpers.get_relative_percent_change, applied elementwise over numpy arrays.
+    # a -100% change leaves no start price, which shows up as inf/NaN and is reported as missing.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return crypto_helpers.get_relative_percent_change(price_a, change_a, price_b, change_b)
+
+
+def _get_kept_rows(rows, previous):
+    # bool per row: the same MarketRow object at the same position of the rows previous was built from
+    kept = np.zeros(len(rows), dtype=bool)
+    if previous is not None and previous.rows is not None:
+        shared = min(len(rows), len(previous.rows))
+        kept[:shared] = np.fromiter(map(operator.is_, rows, previous.rows), dtype=bool, count=shared)
+    return kept
+
+
+def _convert_rows(rows):
+    # (string columns, numeric arrays) of rows
+    if not rows:
+        numbers = np.empty((0, len(MarketRow._fields) - NUMERIC_START), dtype=np.float64)
+        return [[], [], [], []], [numbers[:, 0], numbers[:, 1], numbers[:, 2], numbers[:, 3:]]
+    columns = list(zip(*rows))
+    numbers = np.array(columns[NUMERIC_START:], dtype=np.float64)
+    return ([list(columns[0]), list(columns[3]), list(columns[2]), list(columns[1])],
+            [numbers[0], numbers[1], numbers[2], np.ascontiguousarray(numbers[3:].T)])
+
+
+def _copy_rows(rows, kept, previous):
+    # _convert_rows() that copies the kept rows from previous and only converts the others
+    count = len(rows)
+    fresh = np.flatnonzero(~kept)
+    fresh_strings, fresh_arrays = _convert_rows([rows[row] for row in fresh.tolist()])
+    strings = []
+    for name, fresh_column in zip(IDENTITY_COLUMNS, fresh_strings):
+        column = _to_objects(getattr(previous, name), count)
+        column[fresh] = fresh_column
+        strings.append(column.tolist())
+    kept = np.flatnonzero(kept)
+    arrays = []
+    for previous_array, fresh_array in zip(previous._arrays(), fresh_arrays):
+        array = np.empty((count,) + previous_array.shape[1:], dtype=np.float64)
+        array[kept] = previous_array[kept]
+        array[fresh] = fresh_array
+        arrays.append(array)
+    return strings, arrays
+
+
+def _compare(strings, arrays, previous, candidates):
+    # (bool per row: new, moved or with different values than in previous, bool per array: same values as the one
+    # of previous). only the candidates among the rows both have are compared, position by position in one
+    # vectorized pass per column, the others are taken to be the same
+    count = len(strings[1])
+    candidates = candidates[candidates < len(previous)]
+    same = np.ones(len(candidates), dtype=bool)
+    for column, name in zip(strings, IDENTITY_COLUMNS):
+        previous_column = getattr(previous, name)
+        if column is not previous_column:
+            same &= _to_objects(column, count)[candidates] == _to_objects(previous_column, len(previous))[candidates]
+    equal_arrays = []
+    for array, previous_array in zip(arrays, previous._arrays()):
+        if array is not previous_array:
+            values, previous_values = array[candidates], previous_array[candidates]
+            equal = (values == previous_values) | (np.isnan(values) & np.isnan(previous_values))
+            same &= equal.all(axis=1) if equal.ndim > 1 else equal
+            equal_arrays.append(len(array) == len(previous_array) and bool(equal.all()))
+        else:
+            equal_arrays.append(True)
+    changed = np.zeros(count, dtype=bool)
+    changed[len(previous):] = True
+    changed[candidates] = ~same
+    return changed, equal_arrays
+
+
+def _share_strings(column, previous_column):
+    # column with the strings that equal the ones at the same rows of previous_column taken from it, so the strings
+    # of coins that did not change are kept once. previous_column itself when nothing changed
+    if column == previous_column:
+        return previous_column
+    shared = min(len(column), len(previous_column))
+    objects = _to_objects(column, len(column))
+    equal = objects[:shared] == _to_objects(previous_column, shared)
+    objects[:shared][equal] = _to_objects(previous_column, shared)[equal]
+    return objects.tolist()
+
+
+def _to_objects(values, count):
+    # the first count values as a numpy object array, so they can be compared in one pass. None past the end
+    values = values[:count]
+    objects = np.empty(count, dtype=object)
+    objects[:len(values)] = values
+    return objects
+
+
+def _to_optional(value):
+    value = float(value)
+    return value if math.isfinite(value) else None